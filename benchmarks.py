@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""Non-interactive benchmarks for the emulator. The results are printed as
+JSON so that they can be compared between releases::
+
+    $ python3 benchmarks.py --output results.json
+
+The emulator window (PySide, Qt 4) needs an X display. Without one, or
+without PySide, the window benchmarks are skipped. On a machine without a
+display, run them under Xvfb::
+
+    $ xvfb-run python3 benchmarks.py
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tracemalloc
+from contextlib import redirect_stdout
+from time import perf_counter, time
+
+import pifacecad_emulator
+from pifacecad_emulator.version import __version__
+
+
+DEFAULT_REPEAT = 1000
+DEFAULT_WRITES = 10000
+DEFAULT_FRAMES = 500
+DEFAULT_STARTUPS = 5
+
+WRITE_MESSAGE = "hello world"
+# two full screens which differ in every character, so that every frame
+# of the redraw benchmark repaints both rows
+FRAMES = ("0123456789abcdef\nfedcba9876543210",
+          "ABCDEFGHIJKLMNOP\nponmlkjihgfedcba")
+
+
+def get_latency(function, repeat):
+    """Calls function repeat times and returns its latency in
+    microseconds.
+    """
+    durations = []
+    for i in range(repeat):
+        start = perf_counter()
+        function()
+        durations.append(perf_counter() - start)
+    durations.sort()
+    return {
+        'calls': repeat,
+        'median_us': durations[len(durations) // 2] * 1e6,
+        'p99_us': durations[int(len(durations) * 0.99)] * 1e6,
+        'max_us': durations[-1] * 1e6,
+    }
+
+
+def start_emulator(headless, pool=None):
+    """Returns a :class:`PiFaceCAD` once its emulator is answering."""
+    cad = pifacecad_emulator.PiFaceCAD(headless=headless, pool=pool)
+    if not headless:
+        cad.get_reply(('sync', 0))
+    return cad
+
+
+def stop_emulator(cad):
+    cad.close()
+
+
+def benchmark_startup(headless, startups, pool=None):
+    durations = []
+    for i in range(startups):
+        start = perf_counter()
+        cad = start_emulator(headless, pool)
+        durations.append(perf_counter() - start)
+        stop_emulator(cad)
+    durations.sort()
+    return {
+        'startups': startups,
+        'median_ms': durations[len(durations) // 2] * 1e3,
+        'max_ms': durations[-1] * 1e3,
+    }
+
+
+def benchmark_write(cad, writes):
+    """Returns how many LCD writes a second the emulator applies, one
+    message per write and with every write in one batch.
+    """
+    results = {}
+    for name in ('unbatched', 'batched'):
+        cad.lcd.clear()
+        cad.get_state()
+        start = perf_counter()
+        if name == 'batched':
+            with cad.batch():
+                for i in range(writes):
+                    cad.lcd.write(WRITE_MESSAGE)
+        else:
+            for i in range(writes):
+                cad.lcd.write(WRITE_MESSAGE)
+        # wait until the emulator has applied every write
+        cad.get_state()
+        elapsed = perf_counter() - start
+        results[name] = {
+            'writes': writes,
+            'seconds': elapsed,
+            'writes_per_second': writes / elapsed,
+        }
+    return results
+
+
+def benchmark_getters(cad, repeat):
+    getters = {
+        'switch_value': lambda: cad.switches[0].value,
+        'get_cursor': cad.lcd.get_cursor,
+        'viewport_corner': lambda: cad.lcd.viewport_corner,
+    }
+    if not cad.headless:
+        # a query which always waits for the emulator window
+        getters['round_trip'] = lambda: cad.get_reply(('sync', 0))
+
+    def write_then_get_cursor():
+        cad.lcd.write("x")
+        cad.lcd.get_cursor()
+    getters['write_then_get_cursor'] = write_then_get_cursor
+
+    results = {}
+    for name, getter in sorted(getters.items()):
+        cad.lcd.clear()
+        results[name] = get_latency(getter, repeat)
+    return results
+
+
+def get_process_rss(pid):
+    """Returns the resident set size of a process in bytes, or None if it
+    can't be read (only Linux is supported).
+    """
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def benchmark_memory(headless):
+    tracemalloc.start()
+    cad = start_emulator(headless)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results = {'allocated_in_this_process_bytes': allocated}
+    if not headless:
+        results['emulator_process_rss_bytes'] = \
+            get_process_rss(cad.emulator.pid)
+    stop_emulator(cad)
+    return results
+
+
+def get_window_skip_reason():
+    """Returns why the emulator window can't be benchmarked, or None if it
+    can. Qt 4 aborts the process rather than raising an error when there
+    is no display, so this has to be checked first.
+    """
+    try:
+        import PySide.QtGui
+    except ImportError as e:
+        return str(e)
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        return "no X display (run under xvfb-run)"
+    return None
+
+
+def benchmark_redraw(frames):
+    """Returns how many full frames a second the emulator window can
+    render, ignoring its frame rate cap.
+    """
+    skip_reason = get_window_skip_reason()
+    if skip_reason is not None:
+        return {'skipped': skip_reason}
+    from PySide.QtGui import QApplication
+    from pifacecad_emulator.gui import PiFaceCADEmulatorWindow
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = PiFaceCADEmulatorWindow()
+    window.display_on()
+    window.cursor_on()
+    window.blink_on()
+    window.show()
+    app.processEvents()
+
+    start = perf_counter()
+    for i in range(frames):
+        window.home()
+        window.write_message(FRAMES[i % len(FRAMES)])
+        window.render_timer.stop()
+        window.render()
+        app.processEvents()
+    elapsed = perf_counter() - start
+    window.close()
+    return {
+        'frames': frames,
+        'seconds': elapsed,
+        'frames_per_second': frames / elapsed,
+    }
+
+
+def run_benchmarks(headless_only=False,
+                   repeat=DEFAULT_REPEAT,
+                   writes=DEFAULT_WRITES,
+                   frames=DEFAULT_FRAMES,
+                   startups=DEFAULT_STARTUPS):
+    """Runs every benchmark and returns the results as a dict."""
+    results = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time(),
+        'backends': {},
+    }
+    backends = [('headless', True)]
+    if not headless_only:
+        skip_reason = get_window_skip_reason()
+        if skip_reason is None:
+            backends.append(('window', False))
+        else:
+            results['backends']['window'] = {'skipped': skip_reason}
+    for name, headless in backends:
+        cad = start_emulator(headless)
+        try:
+            backend_results = {
+                'write': benchmark_write(cad, writes),
+                'getters': benchmark_getters(cad, repeat),
+            }
+        finally:
+            stop_emulator(cad)
+        backend_results['startup'] = benchmark_startup(headless, startups)
+        if not headless:
+            pool = pifacecad_emulator.EmulatorPool()
+            backend_results['pool_startup'] = \
+                benchmark_startup(headless, startups, pool)
+            pool.close()
+        backend_results['memory'] = benchmark_memory(headless)
+        results['backends'][name] = backend_results
+    if not headless_only:
+        results['redraw'] = benchmark_redraw(frames)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the PiFace CAD emulator.")
+    parser.add_argument("--headless", action="store_true",
+                        help="only benchmark the headless backend")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="calls per getter")
+    parser.add_argument("--writes", type=int, default=DEFAULT_WRITES,
+                        help="LCD writes per write benchmark")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES,
+                        help="frames in the redraw benchmark")
+    parser.add_argument("--startups", type=int, default=DEFAULT_STARTUPS,
+                        help="emulators started in the startup benchmark")
+    parser.add_argument("--output", help="write the results to a file")
+    args = parser.parse_args()
+
+    # keep anything the emulator prints out of the JSON
+    with redirect_stdout(sys.stderr):
+        results = run_benchmarks(headless_only=args.headless,
+                                 repeat=args.repeat,
+                                 writes=args.writes,
+                                 frames=args.frames,
+                                 startups=args.startups)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,19 +7,48 @@ from .core import (
     PiFaceCAD,
     PiFaceLCD,
     SwitchEventListener,
+    EmulatorPool,
+)
+
+from .lcd import (
+    LCDBitmap,
+)
+
+from .ir import (
     IREventListener,
 )
 
-# from .lcd import (
-#     PiFaceLCD,
-#     LCDBitmap,
-# )
+from .server import (
+    EmulatorServer,
+)
 
-# from .ir import (
-#     IREventListener,
-# )
+from .record import (
+    SessionRecorder,
+)
+
+from .framebuffer import (
+    FrameRenderer,
+    FrameExporter,
+)
 
 # functions
+from .record import (
+    read_recording,
+    replay,
+)
+
+from .snapshot import (
+    get_snapshot,
+    diff_snapshots,
+    format_snapshot,
+)
+
+from .scenario import (
+    read_switch_script,
+    play_switch_events,
+    play_switch_script,
+)
+
 # from .core import (
 #     init,
 #     deinit,
@@ -0,0 +1,290 @@
+import asyncio
+from collections import deque
+from .core import PiFaceCAD, get_switch_event
+from .snapshot import get_snapshot
+from .protocol import QueryError
+from .transport import get_state_from_reply
+
+
+class AsyncSwitch(object):
+    """An emulated switch on PiFace CAD, for use with asyncio."""
+    def __init__(self, switch_num, cad):
+        self.switch_num = switch_num
+        self.cad = cad
+
+    async def get_value(self):
+        state = await self.cad.get_state()
+        return (state.switches >> self.switch_num) & 1
+
+
+class AsyncSwitchPort(object):
+    """An emulated switch port on PiFace CAD, for use with asyncio."""
+    def __init__(self, cad):
+        self.cad = cad
+
+    async def get_value(self):
+        """Returns a numeric value of the switches, bit n is switch n."""
+        state = await self.cad.get_state()
+        return state.switches
+
+
+class AsyncPiFaceLCD(object):
+    """An emulated PiFace CAD LCD, for use with asyncio. Commands are queued
+    for the emulator without blocking, getters are awaitable.
+    """
+    def __init__(self, cad):
+        self.cad = cad
+        self.lcd = cad.cad.lcd
+
+    async def get_viewport_corner(self):
+        state = await self.cad.get_state()
+        return state.viewport_corner
+
+    async def set_viewport_corner(self, position):
+        self.lcd.viewport_corner = position
+
+    async def get_cursor(self):
+        state = await self.cad.get_state()
+        return state.cursor
+
+    async def set_cursor(self, col, row):
+        self.lcd.set_cursor(col, row)
+
+    async def see_cursor(self):
+        self.lcd.see_cursor()
+
+    async def clear(self):
+        self.lcd.clear()
+
+    async def home(self):
+        self.lcd.home()
+
+    async def display_off(self):
+        self.lcd.display_off()
+
+    async def display_on(self):
+        self.lcd.display_on()
+
+    async def cursor_off(self):
+        self.lcd.cursor_off()
+
+    async def cursor_on(self):
+        self.lcd.cursor_on()
+
+    async def blink_off(self):
+        self.lcd.blink_off()
+
+    async def blink_on(self):
+        self.lcd.blink_on()
+
+    async def backlight_off(self):
+        self.lcd.backlight_off()
+
+    async def backlight_on(self):
+        self.lcd.backlight_on()
+
+    async def move_left(self):
+        self.lcd.move_left()
+
+    async def move_right(self):
+        self.lcd.move_right()
+
+    async def write(self, text):
+        self.lcd.write(text)
+
+    async def write_custom_bitmap(self, char_bank, bitmap=None):
+        self.lcd.write_custom_bitmap(char_bank, bitmap)
+
+    async def store_custom_bitmap(self, char_bank, bitmap):
+        self.lcd.store_custom_bitmap(char_bank, bitmap)
+
+    def batch(self):
+        return self.cad.batch()
+
+
+class AsyncPiFaceCAD(object):
+    """An emulated PiFace CAD for use with asyncio.
+
+    Replies and switch events from the emulator are read from pipes which
+    are registered with the event loop, so any number of queries can be
+    waiting at once without tying up threads::
+
+        async with AsyncPiFaceCAD() as cad:
+            await cad.lcd.write("hello")
+            col, row = await cad.lcd.get_cursor()
+            async for event in cad.switch_events():
+                print(event.pin_num, event.direction)
+
+    Emulators connected to over a socket are queried on the event loop's
+    default executor instead.
+
+    :param headless: See :class:`PiFaceCAD`.
+    :type headless: bool
+    :param pool: See :class:`PiFaceCAD`.
+    :type pool: :class:`EmulatorPool`
+    :param connect: See :class:`PiFaceCAD`.
+    :type connect: str
+    """
+    def __init__(self, headless=None, pool=None, connect=None):
+        self.cad = PiFaceCAD(headless=headless, pool=pool, connect=connect)
+        # there are no pipes to read from the event loop over a socket
+        self.connected = \
+            not self.cad.headless and self.cad.emulator_process is None
+        self.switch_port = AsyncSwitchPort(self)
+        self.switches = [AsyncSwitch(i, self)
+                         for i in range(len(self.cad.switches))]
+        self.lcd = AsyncPiFaceLCD(self)
+        self.loop = None
+        self._pending_replies = deque()
+        self._switch_event_queues = []
+
+    def batch(self):
+        """See :meth:`PiFaceCAD.batch`."""
+        return self.cad.batch()
+
+    def flush(self):
+        self.cad.flush()
+
+    async def press_switch(self, switch_num):
+        """See :meth:`PiFaceCAD.press_switch`."""
+        self.cad.press_switch(switch_num)
+
+    async def release_switch(self, switch_num):
+        self.cad.release_switch(switch_num)
+
+    async def get_state(self):
+        """Returns the current :class:`EmulatorState` once the emulator has
+        applied every command sent so far.
+        """
+        self.cad.flush()
+        if self.cad.headless:
+            return self.cad.emulator.state
+        elif self.connected:
+            return get_state_from_reply(await self.request(('get_state', 0)))
+        state, up_to_date = self.cad.transport.read_state()
+        if not up_to_date:
+            await self.request(('sync', 0))
+            state, up_to_date = self.cad.transport.read_state()
+        return state
+
+    async def snapshot(self):
+        """See :meth:`PiFaceCAD.snapshot`."""
+        return get_snapshot(await self.get_state())
+
+    async def request(self, action):
+        """Sends a query to the emulator and waits for its reply."""
+        self.cad.flush()
+        if self.cad.headless:
+            return self.cad.emulator.handle(action)
+        elif self.connected:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self.cad.transport.request, action)
+        self._start_reading()
+        reply = self.loop.create_future()
+        # the emulator answers queries in the order they were sent
+        self._pending_replies.append(reply)
+        self.cad.send(action)
+        return await reply
+
+    async def switch_events(self):
+        """Yields an InterruptEvent each time a switch is pressed or
+        released.
+        """
+        self._start_reading()
+        events = asyncio.Queue()
+        if not self._switch_event_queues:
+            self._subscribe_switch_events(True)
+        self._switch_event_queues.append(events)
+        try:
+            while True:
+                yield await events.get()
+        finally:
+            self._switch_event_queues.remove(events)
+            if not self._switch_event_queues:
+                self._subscribe_switch_events(False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stops reading from the emulator and closes it, see
+        :meth:`PiFaceCAD.close`. Queries still waiting for a reply raise
+        EOFError.
+        """
+        if self.loop is not None and self._reads_pipes:
+            transport = self.cad.transport
+            for pipe in (transport.pipe_from_em, transport.events):
+                self.loop.remove_reader(pipe.fileno())
+        self.loop = None
+        while self._pending_replies:
+            reply = self._pending_replies.popleft()
+            if not reply.done():
+                reply.set_exception(
+                    EOFError("The emulator was closed before it replied."))
+        self.cad.close()
+
+    @property
+    def _reads_pipes(self):
+        return not self.cad.headless and not self.connected
+
+    def _start_reading(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        if self._reads_pipes:
+            transport = self.cad.transport
+            self.loop.add_reader(transport.pipe_from_em.fileno(),
+                                 self._read_replies)
+            self.loop.add_reader(transport.events.fileno(),
+                                 self._read_events)
+
+    def _subscribe_switch_events(self, subscribe):
+        if self.connected:
+            # events are read on the PiFaceCAD's event thread
+            if subscribe:
+                self.cad.add_switch_event_callback(
+                    self._on_threaded_switch_event)
+            else:
+                self.cad.remove_switch_event_callback(
+                    self._on_threaded_switch_event)
+        elif self.cad.headless:
+            callbacks = self.cad.emulator.event_callbacks['switch']
+            if subscribe:
+                callbacks.append(self._on_switch_event)
+            else:
+                callbacks.remove(self._on_switch_event)
+        else:
+            self.cad.flush()
+            self.cad.send(('subscribe_switch_events', 1 if subscribe else 0))
+
+    def _read_replies(self):
+        pipe = self.cad.transport.pipe_from_em
+        while pipe.poll():
+            value = pipe.recv()
+            reply = self._pending_replies.popleft()
+            if reply.cancelled():
+                continue
+            if isinstance(value, QueryError):
+                reply.set_exception(value)
+            else:
+                reply.set_result(value)
+
+    def _read_events(self):
+        pipe = self.cad.transport.events
+        while pipe.poll():
+            message = pipe.recv()
+            if message[0] == 'switch':
+                task, switch_num, pressed, timestamp = message
+                self._on_switch_event(switch_num, pressed, timestamp)
+
+    def _on_threaded_switch_event(self, switch_num, pressed, timestamp):
+        self.loop.call_soon_threadsafe(
+            self._on_switch_event, switch_num, pressed, timestamp)
+
+    def _on_switch_event(self, switch_num, pressed, timestamp):
+        event = get_switch_event(self.cad, switch_num, pressed, timestamp)
+        for events in self._switch_event_queues:
+            events.put_nowait(event)
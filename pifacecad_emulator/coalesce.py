@@ -0,0 +1,95 @@
+# Coalescing of display commands for the emulator window. When a
+# producer writes faster than the window can repaint, every command which
+# is waiting in the queue is read at once and commands whose effects are
+# completely overwritten by later ones are dropped.
+from .lcd import MAX_CUSTOM_BITMAPS
+
+# the parts of the display state which commands read and write
+DDRAM = 'ddram'
+CURSOR = 'cursor'
+VIEWPORT = 'viewport'
+DISPLAY_ENABLE = 'display_enable'
+BACKLIGHT_ENABLE = 'backlight_enable'
+CURSOR_ENABLE = 'cursor_enable'
+BLINK_ENABLE = 'blink_enable'
+# each custom bitmap bank
+CGRAM_BANKS = tuple('cgram{}'.format(bank)
+                    for bank in range(MAX_CUSTOM_BITMAPS))
+DISPLAY_STATE_FIELDS = frozenset((DDRAM,
+                                  CURSOR,
+                                  VIEWPORT,
+                                  DISPLAY_ENABLE,
+                                  BACKLIGHT_ENABLE,
+                                  CURSOR_ENABLE,
+                                  BLINK_ENABLE) + CGRAM_BANKS)
+
+# task: (fields read, fields written, fields completely overwritten)
+TASK_FIELDS = {
+    'set_message': ({CURSOR}, {DDRAM, CURSOR}, set()),
+    'set_cursor': (set(), {CURSOR}, {CURSOR}),
+    'set_viewport_corner': (set(), {VIEWPORT}, {VIEWPORT}),
+    'move_left': ({VIEWPORT}, {VIEWPORT}, set()),
+    'move_right': ({VIEWPORT}, {VIEWPORT}, set()),
+    'see_cursor': ({CURSOR, VIEWPORT}, {VIEWPORT}, set()),
+    'home': (set(), {CURSOR, VIEWPORT}, {CURSOR, VIEWPORT}),
+    'clear': (set(), {DDRAM, CURSOR, VIEWPORT}, {DDRAM, CURSOR, VIEWPORT}),
+    'set_display_enable': (set(), {DISPLAY_ENABLE}, {DISPLAY_ENABLE}),
+    'set_backlight_enable': (set(), {BACKLIGHT_ENABLE}, {BACKLIGHT_ENABLE}),
+    'set_cursor_enable': (set(), {CURSOR_ENABLE}, {CURSOR_ENABLE}),
+    'set_blink_enable': (set(), {BLINK_ENABLE}, {BLINK_ENABLE}),
+}
+
+
+def is_coalescable(action):
+    """Returns True if the action only changes the display state. Anything
+    else (getters, sync, subscriptions) has to be applied in order.
+    """
+    task = action[0]
+    if task == 'batch':
+        return all(is_coalescable(a) for a in action[1])
+    return task in TASK_FIELDS or task == 'store_custom_bitmap'
+
+
+def get_task_fields(action):
+    """Returns the fields an action reads, writes and completely
+    overwrites.
+    """
+    if action[0] == 'store_custom_bitmap':
+        char_bank, rows = action[1]
+        bank = {CGRAM_BANKS[char_bank]}
+        return set(), bank, bank
+    return TASK_FIELDS[action[0]]
+
+
+def coalesce_actions(actions):
+    """Returns the (task, data) actions which still have a visible effect
+    and the number of messages dropped. Batches are flattened, and count
+    as one message which is only dropped if every action in it is. Empty
+    batches have nothing to drop, so they are never counted. Every action
+    must be coalescable.
+
+    Works backwards from the final state: an action is dropped when every
+    field it writes is overwritten by a later action before being read.
+    """
+    # (message number, action)
+    flat_actions = []
+    for message_num, action in enumerate(actions):
+        if action[0] == 'batch':
+            flat_actions.extend((message_num, a) for a in action[1])
+        else:
+            flat_actions.append((message_num, action))
+
+    messages = set(message_num for message_num, action in flat_actions)
+    live = set(DISPLAY_STATE_FIELDS)
+    kept = []
+    kept_messages = set()
+    for message_num, action in reversed(flat_actions):
+        reads, writes, overwrites = get_task_fields(action)
+        if not (writes & live):
+            continue
+        kept.append(action)
+        kept_messages.add(message_num)
+        live -= overwrites
+        live |= reads
+    kept.reverse()
+    return kept, len(messages) - len(kept_messages)
@@ -1,16 +1,49 @@
 import sys
-from multiprocessing import Process, Queue
+import queue
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing import Process, Pipe
 from threading import Barrier
-from .gui import (
-    run_emulator,
-    get_col_row_from_value,
-    get_value_from_col_row
+from .lcd import (
+    MAX_CUSTOM_BITMAPS,
+    get_value_from_col_row,
+    get_custom_bitmap_rows,
 )
+from .headless import HeadlessEmulator, headless_requested
+from .state import SharedState
+from .transport import PipeTransport, SocketTransport
+from .protocol import ActionQueue, BLOCK
+from .record import SessionRecorder
+from .snapshot import get_snapshot
+from .server import run_headless_emulator
 import pifacecommon.mcp23s17
-from pifacecommon.interrupts import (IODIR_ON, IODIR_OFF, IODIR_BOTH)
+import pifacecommon.interrupts
+from pifacecommon.interrupts import (
+    IODIR_ON,
+    IODIR_OFF,
+    IODIR_BOTH,
+    InterruptEvent,
+)
 import pifacecad
 
 
+# how long, in seconds, an emulator window gets to close before its process
+# is terminated
+QUIT_TIMEOUT = 5
+
+
+def get_switch_event(cad, switch_num, pressed, timestamp):
+    """Returns an InterruptEvent like the ones pifacecad passes to event
+    listener callbacks. Pressing a switch pulls its input low, so a press
+    has the direction IODIR_ON.
+    """
+    interrupt_flag = 1 << switch_num
+    interrupt_capture = 0 if pressed else interrupt_flag
+    return InterruptEvent(interrupt_flag, interrupt_capture, cad, timestamp)
+
+
 # classes
 class Switch(object):
     """An emulated switch on PiFace CAD."""
@@ -20,23 +53,19 @@ class Switch(object):
 
     @property
     def value(self):
-        self.cad.proc_comms_q_to_em.put(('get_switch', self.switch_num))
-        return self.cad.proc_comms_q_from_em.get()
+        return (self.cad.get_state().switches >> self.switch_num) & 1
 
 
 class SwitchPort(object):
     """An emulated switch port on PiFace CAD."""
     def __init__(self, cad):
+        self.cad = cad
         self.switches = [Switch(i, cad) for i in range(8)]
 
     @property
     def value(self):
-        """Returns a numeric value of the switches."""
-        onezero_switches = map(lambda x: 1 if x else 0, self.switches)
-        v = 0
-        for i, switch_value in enumerate(reversed(onezero_switches)):
-            v |= switch_value << i
-        return v
+        """Returns a numeric value of the switches, bit n is switch n."""
+        return self.cad.get_state().switches
 
 
 class PiFaceLCD(object):
@@ -46,64 +75,97 @@ class PiFaceLCD(object):
 
     @property
     def viewport_corner(self):
-        self.cad.proc_comms_q_to_em.put(('get_viewport_corner', 0))
-        return self.cad.proc_comms_q_from_em.get()
+        return self.cad.get_state().viewport_corner
 
     @viewport_corner.setter
     def viewport_corner(self, position):
-        self.cad.proc_comms_q_to_em.put(('set_viewport_corner', position))
+        self.cad.put_command(('set_viewport_corner', position))
 
     def see_cursor(self):
-        self.cad.proc_comms_q_to_em.put(('see_cursor', 0))
+        self.cad.put_command(('see_cursor', 0))
 
     def clear(self):
-        self.cad.proc_comms_q_to_em.put(('clear', 0))
+        self.cad.put_command(('clear', 0))
 
     def home(self):
-        self.cad.proc_comms_q_to_em.put(('home', 0))
+        self.cad.put_command(('home', 0))
 
     def display_off(self):
-        self.cad.proc_comms_q_to_em.put(('set_display_enable', 0))
+        self.cad.put_command(('set_display_enable', 0))
 
     def display_on(self):
-        self.cad.proc_comms_q_to_em.put(('set_display_enable', 1))
+        self.cad.put_command(('set_display_enable', 1))
 
     def cursor_off(self):
-        self.cad.proc_comms_q_to_em.put(('set_cursor_enable', 0))
+        self.cad.put_command(('set_cursor_enable', 0))
 
     def cursor_on(self):
-        self.cad.proc_comms_q_to_em.put(('set_cursor_enable', 1))
+        self.cad.put_command(('set_cursor_enable', 1))
 
     def blink_off(self):
-        self.cad.proc_comms_q_to_em.put(('set_blink_enable', 0))
+        self.cad.put_command(('set_blink_enable', 0))
 
     def blink_on(self):
-        self.cad.proc_comms_q_to_em.put(('set_blink_enable', 1))
+        self.cad.put_command(('set_blink_enable', 1))
 
     def backlight_off(self):
-        self.cad.proc_comms_q_to_em.put(('set_backlight_enable', 0))
+        self.cad.put_command(('set_backlight_enable', 0))
 
     def backlight_on(self):
-        self.cad.proc_comms_q_to_em.put(('set_backlight_enable', 1))
+        self.cad.put_command(('set_backlight_enable', 1))
 
     # cursor or display shift
     def move_left(self):
-        self.cad.proc_comms_q_to_em.put(('move_left', None))
+        self.cad.put_command(('move_left', None))
 
     def move_right(self):
-        self.cad.proc_comms_q_to_em.put(('move_right', None))
+        self.cad.put_command(('move_right', None))
 
     def set_cursor(self, col, row):
         col_row = get_value_from_col_row(col, row)
-        self.cad.proc_comms_q_to_em.put(('set_cursor', col_row))
+        self.cad.put_command(('set_cursor', col_row))
 
     def get_cursor(self):
-        self.cad.proc_comms_q_to_em.put(('get_cursor', 0))
-        return proc_comms_q_from_em.get()
+        return self.cad.get_state().cursor
 
     def write(self, text):
-        self.cad.proc_comms_q_to_em.put(('set_message', text))
-        # print("q to em len", proc_comms_q_to_em.qsize())
+        self.cad.put_command(('set_message', text))
+
+    def write_custom_bitmap(self, char_bank, bitmap=None):
+        """Writes the custom bitmap in CGRAM stored at char_bank. If a
+        LCDBitmap is given, store it in the CGRAM address char_bank and then
+        write it to the screen.
+        """
+        if bitmap is not None:
+            self.store_custom_bitmap(char_bank, bitmap)
+        self.write(chr(char_bank))
+
+    def store_custom_bitmap(self, char_bank, bitmap):
+        """Stores a custom bitmap bitmap at char_bank. Bitmaps have 8 rows,
+        missing rows are blank.
+        """
+        self.char_bank_in_range_or_error(char_bank)
+        rows = get_custom_bitmap_rows(bitmap)
+        self.cad.put_command(('store_custom_bitmap', (char_bank, rows)))
+
+    def char_bank_in_range_or_error(self, char_bank):
+        if char_bank >= MAX_CUSTOM_BITMAPS or char_bank < 0:
+            raise ValueError(
+                "There are only {max} custom characters (You tried to "
+                "access {cgramaddr}).".format(max=MAX_CUSTOM_BITMAPS,
+                                              cgramaddr=char_bank))
+
+    def batch(self):
+        """Returns a context manager which sends every LCD command issued
+        inside it to the emulator as a single message. See
+        :meth:`PiFaceCAD.batch`.
+        """
+        return self.cad.batch()
+
+    def flush(self):
+        """Sends any batched LCD commands to the emulator."""
+        self.cad.flush()
+
     # not implemented
     # def left_to_right(self):
     # def right_to_left(self):
@@ -114,18 +176,49 @@ class PiFaceLCD(object):
     # def send_data(self, data):
     # def send_byte(self, b):
     # def pulse_clock(self):
-    # def write_custom_bitmap(self, char_bank, bitmap=None):
-    # def store_custom_bitmap(self, char_bank, bitmap):
-    # def char_bank_in_range_or_error():
 
 
-class PiFaceCAD(object):
-    """An emulated PiFace CAD."""
-    def __init__(self):
-        self.switch_port = SwitchPort(self)
-        self.switches = [Switch(i, self)
-                         for i in range(pifacecad.NUM_SWITCHES)]
-        self.lcd = PiFaceLCD(self)
+class EmulatorProcess(object):
+    """An emulator window running in another process, with the queue and
+    pipes used to talk to it and the shared memory it publishes its state
+    in. With headless, a :class:`HeadlessEmulator` runs in the process
+    instead of the window.
+
+    :param coalesce: See :class:`PiFaceCAD`.
+    :type coalesce: bool
+    :param max_fps: See :class:`PiFaceCAD`.
+    :type max_fps: int
+    :param socket_path: See the listen parameter of :class:`PiFaceCAD`.
+    :type socket_path: str
+    :param queue_size: See :class:`PiFaceCAD`.
+    :type queue_size: int
+    :param overflow: See :class:`PiFaceCAD`.
+    :type overflow: str
+    :param switch_debounce: See :class:`PiFaceCAD`.
+    :type switch_debounce: float
+    :param headless: Run a headless emulator instead of the window.
+    :type headless: bool
+    """
+    def __init__(self, coalesce=False, max_fps=None, socket_path=None,
+                 queue_size=0, overflow=BLOCK, switch_debounce=None,
+                 headless=False):
+        self.q_to_em = ActionQueue(queue_size, overflow)
+        self.pipe_from_em, pipe_to_here = Pipe(duplex=False)
+        self.events, events_to_here = Pipe(duplex=False)
+        self.shared_state = SharedState()
+        weakref.finalize(self, self.shared_state.unlink)
+        self.messages_sent = 0
+        self.socket_path = socket_path
+
+        if headless:
+            self.process = Process(target=run_headless_emulator,
+                                   args=(self.q_to_em,
+                                         pipe_to_here,
+                                         events_to_here,
+                                         self.shared_state,
+                                         socket_path))
+            self.start(pipe_to_here, events_to_here)
+            return
 
         try:
             cad = pifacecad.PiFaceCAD()
@@ -135,32 +228,523 @@ class PiFaceCAD(object):
             print("Running without PiFace CAD.")
             cad = None
 
-        self.proc_comms_q_to_em = Queue()
-        self.proc_comms_q_from_em = Queue()
+        # only import Qt when the emulator window is actually needed
+        from .gui import run_emulator
 
         emulator_sync = Barrier(2)
         # start the gui in another process
-        self.emulator = Process(target=run_emulator,
-                                args=(sys.argv,
-                                      cad,
-                                      self.proc_comms_q_to_em,
-                                      self.proc_comms_q_from_em,
-                                      emulator_sync))
-        self.emulator.start()
-
-
-class SwitchEventListener(object):
-    """An emulated Switch event listener"""
-    def __init__(self, arg):
-        raise NotImplementedError("Switch Interrupts are not implemented in "
-                                  "the emulator.")
-
-
-class IREventListener(object):
-    """An emulated IR event listener"""
-    def __init__(self, arg):
-        raise NotImplementedError("IR Interrupts are not implemented in the "
-                                  "emulator.")
+        self.process = Process(target=run_emulator,
+                               args=(sys.argv,
+                                     cad,
+                                     self.q_to_em,
+                                     pipe_to_here,
+                                     events_to_here,
+                                     self.shared_state,
+                                     emulator_sync,
+                                     coalesce,
+                                     max_fps,
+                                     socket_path,
+                                     switch_debounce))
+        self.start(pipe_to_here, events_to_here)
+
+    def start(self, pipe_to_here, events_to_here):
+        self.process.start()
+        # the emulator has its own copies of the sending ends
+        pipe_to_here.close()
+        events_to_here.close()
+
+    def wait_until_ready(self):
+        """Blocks until the emulator window is answering."""
+        self.q_to_em.put(('sync', 0))
+        self.messages_sent += 1
+        self.pipe_from_em.recv()
+
+    def quit(self, timeout=QUIT_TIMEOUT):
+        """Closes the emulator window and waits for its process to end.
+        The process is terminated if it hasn't ended after timeout seconds.
+        """
+        if self.process.is_alive():
+            try:
+                self.q_to_em.put(('quit',), timeout)
+            except queue.Full:
+                # the emulator isn't reading its queue
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+class EmulatorPool(object):
+    """Starts emulator windows before they are needed, so that creating a
+    :class:`PiFaceCAD` doesn't have to wait for Qt to start up::
+
+        pool = EmulatorPool(size=4)
+        for test in tests:
+            cad = PiFaceCAD(pool=pool)
+            ...
+
+    Each emulator window is only used once. A replacement is started
+    whenever one is taken, while the one taken is being used.
+
+    :param size: The number of emulator windows to keep started.
+    :type size: int
+    :param coalesce: See :class:`PiFaceCAD`.
+    :type coalesce: bool
+    :param max_fps: See :class:`PiFaceCAD`.
+    :type max_fps: int
+    :param queue_size: See :class:`PiFaceCAD`.
+    :type queue_size: int
+    :param overflow: See :class:`PiFaceCAD`.
+    :type overflow: str
+    :param switch_debounce: See :class:`PiFaceCAD`.
+    :type switch_debounce: float
+    :param headless: Start headless emulators instead of windows, see
+        :class:`EmulatorProcess`.
+    :type headless: bool
+    """
+    def __init__(self, size=1, coalesce=False, max_fps=None, queue_size=0,
+                 overflow=BLOCK, switch_debounce=None, headless=False):
+        self.coalesce = coalesce
+        self.max_fps = max_fps
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.switch_debounce = switch_debounce
+        self.headless = headless
+        self.emulators = deque(self.start_emulator() for i in range(size))
+
+    def start_emulator(self):
+        return EmulatorProcess(self.coalesce, self.max_fps,
+                               queue_size=self.queue_size,
+                               overflow=self.overflow,
+                               switch_debounce=self.switch_debounce,
+                               headless=self.headless)
+
+    def get(self):
+        """Returns an :class:`EmulatorProcess` which is ready to use and
+        starts another one in its place.
+        """
+        try:
+            emulator = self.emulators.popleft()
+        except IndexError:
+            emulator = self.start_emulator()
+        else:
+            self.emulators.append(self.start_emulator())
+        emulator.wait_until_ready()
+        return emulator
+
+    def close(self):
+        """Closes the emulator windows which haven't been used."""
+        while self.emulators:
+            self.emulators.popleft().quit()
+
+
+class PiFaceCAD(object):
+    """An emulated PiFace CAD.
+
+    :param headless: Run against an in-memory model in this process instead
+        of starting the emulator window. Defaults to the value of the
+        PIFACECAD_EMULATOR_HEADLESS environment variable.
+    :type headless: bool
+    :param coalesce: Let the emulator window drop display commands which
+        are overwritten by commands waiting behind them in the queue, so
+        that it keeps up with fast writers. See :attr:`messages_dropped`.
+    :type coalesce: bool
+    :param max_fps: The most times a second the emulator window repaints
+        the LCD. Defaults to 30.
+    :type max_fps: int
+    :param queue_size: The most commands which can be waiting for the
+        emulator window, or 0 for no limit.
+    :type queue_size: int
+    :param overflow: What happens when a command is sent and queue_size
+        commands are waiting: 'block' waits for the emulator window,
+        'drop_oldest' drops the oldest waiting command if it is a display
+        command (counted in :attr:`messages_dropped`) and otherwise waits,
+        and 'error' raises queue.Full.
+    :type overflow: str
+    :param switch_debounce: How long, in seconds, the switches of a real
+        PiFace CAD attached to the emulator are left to stop bouncing.
+        Every edge in that time is passed on as one update. Defaults to
+        0.02.
+    :type switch_debounce: float
+    :param pool: Take an emulator window which has already been started
+        from the pool, or a board from an :class:`EmulatorServer`. The
+        pool's coalesce, max_fps, queue_size, overflow and switch_debounce
+        are used.
+    :type pool: :class:`EmulatorPool`
+    :param listen: Let other processes drive the emulator window too, by
+        connecting to the Unix domain socket at this path.
+    :type listen: str
+    :param connect: Drive an emulator which is already listening on the
+        Unix domain socket at this path instead of starting one. See
+        :func:`pifacecad_emulator.server.serve`.
+    :type connect: str
+    :param record: Append the commands sent to the emulator, the replies
+        to queries and the events it pushes to this file. See
+        :func:`pifacecad_emulator.record.replay`.
+    :type record: str
+
+    Call :meth:`close` when finished with the emulator, or use it as a
+    context manager::
+
+        with PiFaceCAD() as cad:
+            cad.lcd.write("hello")
+    """
+    def __init__(self, headless=None, coalesce=False, max_fps=None,
+                 pool=None, listen=None, connect=None, queue_size=0,
+                 overflow=BLOCK, record=None, switch_debounce=None):
+        self.switch_port = SwitchPort(self)
+        self.switches = [Switch(i, self)
+                         for i in range(pifacecad.NUM_SWITCHES)]
+        self.lcd = PiFaceLCD(self)
+        self._batch = None
+        self._batch_depth = 0
+        # called when the emulator pushes events, see _read_events
+        self.event_callbacks = {'switch': [], 'ir': []}
+        self._event_lock = threading.Lock()
+        self._event_reader = None
+        self.emulator_process = None
+        self.closed = False
+        self.recorder = None
+        if record is not None:
+            self.recorder = SessionRecorder(record)
+
+        if connect is not None:
+            self.headless = False
+            self.emulator = None
+            self.transport = SocketTransport(connect)
+            return
+
+        if headless is None:
+            headless = headless_requested()
+        self.headless = headless
+        if self.headless:
+            self.emulator = HeadlessEmulator()
+            if self.recorder is not None:
+                # headless events are not read from a transport
+                for event_type in self.emulator.event_callbacks:
+                    self.emulator.event_callbacks[event_type].append(
+                        self._get_event_recorder(event_type))
+            return
+
+        if pool is None:
+            self.emulator_process = EmulatorProcess(
+                coalesce, max_fps, listen, queue_size, overflow,
+                switch_debounce)
+        else:
+            self.emulator_process = pool.get()
+        self.emulator = self.emulator_process.process
+        self.proc_comms_q_to_em = self.emulator_process.q_to_em
+        self.proc_comms_pipe_from_em = self.emulator_process.pipe_from_em
+        self.proc_comms_events = self.emulator_process.events
+        self.shared_state = self.emulator_process.shared_state
+        self.transport = PipeTransport(self.emulator_process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Sends any batched commands, then closes the emulator window and
+        waits for its process to end. Emulators connected to with connect
+        and boards of an :class:`EmulatorServer` are left running.
+        """
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        if self.emulator_process is not None:
+            self.emulator_process.quit()
+        elif not self.headless:
+            self.transport.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def put_command(self, action):
+        """Sends an action to the emulator, or adds it to the current batch
+        if there is one.
+        """
+        if self._batch is None:
+            self.send(action)
+        else:
+            self._batch.append(action)
+
+    def get_reply(self, action):
+        """Sends a query to the emulator and returns its reply. Any batched
+        commands are flushed first so that the reply reflects them.
+        """
+        self.flush()
+        if self.headless:
+            reply = self.emulator.handle(action)
+        else:
+            reply = self.transport.request(action)
+        if self.recorder is not None:
+            self.recorder.record_query(action, reply)
+        return reply
+
+    @property
+    def messages_dropped(self):
+        """The number of messages the emulator window has dropped because
+        they were overwritten by later commands, or which were dropped
+        because the queue was full. A batch is one message, and is only
+        counted once every command in it has been dropped.
+        """
+        if self.headless:
+            return 0
+        return self.transport.messages_dropped
+
+    @property
+    def messages_sent(self):
+        """The number of messages sent to the emulator."""
+        if self.headless:
+            return 0
+        return self.transport.messages_sent
+
+    def get_state(self):
+        """Returns the current :class:`EmulatorState`.
+
+        The state is read from shared memory without asking the emulator.
+        If some of the commands sent so far have not been applied yet then
+        this waits for the emulator to catch up first.
+        """
+        self.flush()
+        if self.headless:
+            state = self.emulator.state
+        else:
+            state = self.transport.get_state()
+        if self.recorder is not None:
+            self.recorder.record_query(('get_state', 0), state)
+        return state
+
+    def read_state(self):
+        """Returns the last :class:`EmulatorState` the emulator published.
+        Unlike :meth:`get_state` this doesn't send the current batch or
+        wait for commands which haven't been applied yet, so monitors can
+        call it from another thread.
+        """
+        if self.headless:
+            return self.emulator.state
+        elif self.emulator_process is None:
+            # connected over a socket, there is no shared memory
+            return self.transport.get_state()
+        return self.transport.read_state()[0]
+
+    def snapshot(self):
+        """Returns an immutable :class:`DisplaySnapshot` of the LCD, see
+        :meth:`get_state`. Compare snapshots with ``==`` or
+        :func:`diff_snapshots`.
+        """
+        return get_snapshot(self.get_state())
+
+    @contextmanager
+    def batch(self):
+        """Collects the commands issued inside the with block and sends them
+        to the emulator as one message, which is applied as one update::
+
+            with cad.batch():
+                cad.lcd.clear()
+                cad.lcd.set_cursor(0, 1)
+                cad.lcd.write("world")
+
+        Batches can be nested, the commands are sent when the outermost
+        batch exits.
+        """
+        if self._batch is None:
+            self._batch = []
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+                self._batch = None
+
+    def flush(self):
+        """Sends the commands collected so far in the current batch."""
+        if self._batch:
+            self.send(('batch', self._batch))
+            self._batch = []
+
+    def send(self, action):
+        """Sends an action to the emulator now, even inside a batch."""
+        if self.headless:
+            self.emulator.handle(action)
+        else:
+            self.transport.send(action)
+        if self.recorder is not None:
+            self.recorder.record_action(action)
+
+    def add_switch_event_callback(self, callback):
+        """Calls callback(switch_num, pressed, timestamp) each time a switch
+        is pressed or released. The emulator only pushes switch events while
+        there are callbacks, they are read on a separate thread.
+        """
+        self._add_event_callback('switch', callback)
+
+    def remove_switch_event_callback(self, callback):
+        self._remove_event_callback('switch', callback)
+
+    def add_ir_event_callback(self, callback):
+        """Calls callback(ir_code, timestamp) each time an IR code is sent
+        from the emulator.
+        """
+        self._add_event_callback('ir', callback)
+
+    def remove_ir_event_callback(self, callback):
+        self._remove_event_callback('ir', callback)
+
+    def send_ir_code(self, ir_code):
+        """Sends an IR code through the emulator, as if it had been typed
+        into the emulator window.
+        """
+        self.put_command(('inject_ir', ir_code))
+
+    def press_switch(self, switch_num):
+        """Presses an emulated switch. Applications see this exactly like a
+        click on the switch in the emulator window.
+        """
+        self.set_switch(switch_num, True)
+
+    def release_switch(self, switch_num):
+        """Releases an emulated switch."""
+        self.set_switch(switch_num, False)
+
+    @contextmanager
+    def hold_switch(self, switch_num):
+        """Holds an emulated switch down for the with block::
+
+            with cad.hold_switch(4):
+                sleep(1)
+        """
+        self.press_switch(switch_num)
+        try:
+            yield self
+        finally:
+            self.release_switch(switch_num)
+
+    def set_switch(self, switch_num, pressed):
+        """Presses (True) or releases (False) an emulated switch. Like
+        other commands, this is added to the current batch if there is one.
+        """
+        self.switch_in_range_or_error(switch_num)
+        self.put_command(('inject_switch', (switch_num, 1 if pressed else 0)))
+
+    def switch_in_range_or_error(self, switch_num):
+        if switch_num >= len(self.switches) or switch_num < 0:
+            raise ValueError(
+                "There are only {max} switches (You tried to "
+                "press {switch_num}).".format(max=len(self.switches),
+                                              switch_num=switch_num))
+
+    def _add_event_callback(self, event_type, callback):
+        if self.headless:
+            self.emulator.event_callbacks[event_type].append(callback)
+            return
+        with self._event_lock:
+            callbacks = self.event_callbacks[event_type]
+            callbacks.append(callback)
+            if len(callbacks) == 1:
+                self.send(('subscribe_{}_events'.format(event_type), 1))
+            if self._event_reader is None:
+                self._event_reader = threading.Thread(
+                    target=self._read_events)
+                self._event_reader.daemon = True
+                self._event_reader.start()
+
+    def _remove_event_callback(self, event_type, callback):
+        if self.headless:
+            self.emulator.event_callbacks[event_type].remove(callback)
+            return
+        with self._event_lock:
+            callbacks = self.event_callbacks[event_type]
+            callbacks.remove(callback)
+            if not callbacks:
+                self.send(('subscribe_{}_events'.format(event_type), 0))
+
+    def _get_event_recorder(self, event_type):
+        def record_event(*args):
+            self.recorder.record_event((event_type,) + args)
+        return record_event
+
+    def _read_events(self):
+        while True:
+            try:
+                message = self.transport.recv_event()
+            except EOFError:
+                return
+            event_type = message[0]
+            if self.recorder is not None and event_type != 'subscribe':
+                self.recorder.record_event(message)
+            if event_type == 'subscribe':
+                # stop reading once the emulator has stopped sending
+                with self._event_lock:
+                    if not any(self.event_callbacks.values()):
+                        self._event_reader = None
+                        return
+            else:
+                for callback in list(self.event_callbacks[event_type]):
+                    callback(*message[1:])
+
+
+class EventQueue(pifacecommon.interrupts.EventQueue):
+    """Stores emulated switch events. They refer to the emulated chip, which
+    can't be pickled, so they are kept in a thread queue.
+    """
+    def __init__(self, pin_function_maps):
+        super(EventQueue, self).__init__(pin_function_maps)
+        self.queue = queue.Queue()
+
+
+class SwitchEventListener(pifacecommon.interrupts.PortEventListener):
+    """Listens for events on the emulated switches and calls the registered
+    functions, just like pifacecad.SwitchEventListener.
+
+    >>> def print_flag(event):
+    ...     print(event.interrupt_flag)
+    ...
+    >>> listener = pifacecad_emulator.SwitchEventListener(chip=cad)
+    >>> listener.register(0, pifacecad_emulator.IODIR_ON, print_flag)
+    >>> listener.activate()
+
+    The emulator pushes each switch edge to this process as it happens, so
+    there is no polling.
+    """
+    def __init__(self, chip=None, daemon=False):
+        if chip is None:
+            chip = PiFaceCAD()
+        self.chip = chip
+        self.pin_function_maps = list()
+        self.event_queue = EventQueue(self.pin_function_maps)
+        self.dispatcher = threading.Thread(
+            target=pifacecommon.interrupts.handle_events,
+            args=(
+                self.pin_function_maps,
+                self.event_queue,
+                pifacecommon.interrupts._event_matches_pin_function_map,
+                SwitchEventListener.TERMINATE_SIGNAL))
+        self.dispatcher.daemon = daemon
+
+    def activate(self):
+        """When activated the :class:`SwitchEventListener` will run callbacks
+        associated with pins/directions.
+        """
+        self.chip.add_switch_event_callback(self.add_event)
+        self.dispatcher.start()
+
+    def deactivate(self):
+        """When deactivated the :class:`SwitchEventListener` will not run
+        anything.
+        """
+        self.chip.remove_switch_event_callback(self.add_event)
+        self.event_queue.put(self.TERMINATE_SIGNAL)
+        self.dispatcher.join()
+
+    def add_event(self, switch_num, pressed, timestamp):
+        self.event_queue.add_event(
+            get_switch_event(self.chip, switch_num, pressed, timestamp))
 
 
 # def init():
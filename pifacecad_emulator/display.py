@@ -0,0 +1,304 @@
+from PySide.QtCore import (Qt, QRect, QRectF)
+from PySide.QtGui import (QWidget, QPixmap, QPainter, QColor)
+from collections import OrderedDict
+from .lcd import (
+    LCD_LINES,
+    LCD_WIDTH,
+    DDRAM_ENCODING,
+    MAX_CUSTOM_BITMAPS,
+    CUSTOM_BITMAP_ROWS,
+    CUSTOM_BITMAP_COLUMNS,
+)
+from .font import (
+    NUM_CHARACTER_CODES,
+    CGRAM_CODES,
+    BLANK_GLYPH,
+    BLOCK_GLYPH,
+    UNDERLINE_GLYPH,
+    LIT_DOT_ALPHA,
+    UNLIT_DOT_ALPHA,
+    ROM_GLYPHS,
+)
+
+
+# dots which are on, and the faint dots which are off
+LIT_DOT_COLOUR = QColor(0, 0, 0, LIT_DOT_ALPHA)
+UNLIT_DOT_COLOUR = QColor(0, 0, 0, UNLIT_DOT_ALPHA)
+# the gap between characters, in dots
+CELL_GAP_DOTS = 1
+# how much of the dot pitch a dot fills, the rest is the gap between dots
+DOT_FILL = 0.85
+
+# the atlas holds every ROM character and then these two, in a grid
+# ATLAS_COLUMNS cells wide
+BLOCK_CODE = NUM_CHARACTER_CODES
+UNDERLINE_CODE = NUM_CHARACTER_CODES + 1
+ATLAS_COLUMNS = 16
+ATLAS_ROWS = (UNDERLINE_CODE + ATLAS_COLUMNS) // ATLAS_COLUMNS
+
+# the most custom character pixmaps kept, see GlyphCache
+GLYPH_CACHE_SIZE = 256
+# what a cell shows while the display is off
+SPACE_CODE = 0x20
+
+
+class DotGeometry(object):
+    """Where the dots of a character are drawn in a cell of cell_width by
+    cell_height pixels. Dots are square and as large as fit, centred in
+    the cell.
+    """
+    def __init__(self, cell_width, cell_height):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.pitch = min(
+            cell_width / (CUSTOM_BITMAP_COLUMNS + CELL_GAP_DOTS),
+            cell_height / (CUSTOM_BITMAP_ROWS + CELL_GAP_DOTS))
+        self.dot_size = self.pitch * DOT_FILL
+        self.left = (cell_width - CUSTOM_BITMAP_COLUMNS * self.pitch) / 2
+        self.top = (cell_height - CUSTOM_BITMAP_ROWS * self.pitch) / 2
+
+    @property
+    def cell_size(self):
+        return self.cell_width, self.cell_height
+
+    def draw(self, painter, x, y, rows, unlit_colour=UNLIT_DOT_COLOUR):
+        """Draws the dots of a character in the cell at (x, y). Dots which
+        are off are drawn with unlit_colour, or not at all if it is None.
+        """
+        for row_num, row in enumerate(rows):
+            dot_y = y + self.top + row_num * self.pitch
+            for col in range(CUSTOM_BITMAP_COLUMNS):
+                # the leftmost dot is the highest bit
+                if row & (1 << (CUSTOM_BITMAP_COLUMNS - 1 - col)):
+                    colour = LIT_DOT_COLOUR
+                elif unlit_colour is not None:
+                    colour = unlit_colour
+                else:
+                    continue
+                painter.fillRect(
+                    QRectF(x + self.left + col * self.pitch, dot_y,
+                           self.dot_size, self.dot_size),
+                    colour)
+
+
+class GlyphAtlas(object):
+    """Every ROM character drawn once, at one cell size, into one pixmap.
+    Cells are copied out of it so that nothing is rasterised while the
+    display is painted. Also holds the block of the blinking cursor and
+    the underline of the cursor, which are drawn over a character.
+    """
+    def __init__(self, dot_geometry):
+        self.dot_geometry = dot_geometry
+        width, height = dot_geometry.cell_size
+        self.pixmap = QPixmap(ATLAS_COLUMNS * width, ATLAS_ROWS * height)
+        self.pixmap.fill(Qt.transparent)
+        painter = QPainter(self.pixmap)
+        for code, rows in enumerate(ROM_GLYPHS):
+            x, y = self.get_cell_origin(code)
+            dot_geometry.draw(painter, x, y, rows)
+        for code, rows in ((BLOCK_CODE, BLOCK_GLYPH),
+                           (UNDERLINE_CODE, UNDERLINE_GLYPH)):
+            x, y = self.get_cell_origin(code)
+            dot_geometry.draw(painter, x, y, rows, unlit_colour=None)
+        painter.end()
+
+    def get_cell_origin(self, code):
+        width, height = self.dot_geometry.cell_size
+        return ((code % ATLAS_COLUMNS) * width,
+                (code // ATLAS_COLUMNS) * height)
+
+    def get_source_rect(self, code):
+        """Returns the part of the pixmap which holds a code."""
+        x, y = self.get_cell_origin(code)
+        width, height = self.dot_geometry.cell_size
+        return QRect(x, y, width, height)
+
+
+def draw_glyph(dot_geometry, rows):
+    """Returns a pixmap of one cell with the dots of a custom bitmap."""
+    pixmap = QPixmap(*dot_geometry.cell_size)
+    pixmap.fill(Qt.transparent)
+    painter = QPainter(pixmap)
+    dot_geometry.draw(painter, 0, 0, rows)
+    painter.end()
+    return pixmap
+
+
+class GlyphCache(object):
+    """Pixmaps of custom characters keyed by their rows, so that a bitmap
+    is only drawn once however often it is stored. The least recently used
+    pixmaps are dropped after GLYPH_CACHE_SIZE.
+    """
+    def __init__(self, dot_geometry, size=GLYPH_CACHE_SIZE):
+        self.dot_geometry = dot_geometry
+        self.size = size
+        self.pixmaps = OrderedDict()
+
+    def get(self, rows):
+        try:
+            pixmap = self.pixmaps.pop(rows)
+        except KeyError:
+            pixmap = draw_glyph(self.dot_geometry, rows)
+            if len(self.pixmaps) >= self.size:
+                self.pixmaps.popitem(last=False)
+        self.pixmaps[rows] = pixmap
+        return pixmap
+
+
+class DotMatrixDisplay(QWidget):
+    """A 16x2 character LCD painted dot by dot. Characters are copied from
+    a :class:`GlyphAtlas` which is only drawn again when the size of a
+    cell changes, and only the cells which change are repainted.
+    """
+    def __init__(self, parent=None):
+        super(DotMatrixDisplay, self).__init__(parent)
+        self.codes = [bytearray(b" " * LCD_WIDTH) for row in range(LCD_LINES)]
+        self.custom_bitmaps = [BLANK_GLYPH for i in range(MAX_CUSTOM_BITMAPS)]
+        self.display_enabled = True
+        # (col, row) of the cursor and the blinking cursor's block, or None
+        # if they are hidden
+        self.cursor_position = None
+        self.block_position = None
+
+        # set up for the size of the widget by update_layout
+        self.dot_geometry = None
+        self.cell_left = 0
+        self.cell_top = 0
+        self.atlas = None
+        self.glyph_cache = None
+        self._bank_pixmaps = [None for i in range(MAX_CUSTOM_BITMAPS)]
+        self.cells_painted = 0
+
+    def set_line(self, row, line):
+        """Shows LCD_WIDTH characters on a row.
+
+        :param row: The row.
+        :type row: int
+        :param line: The characters.
+        :type line: str
+        """
+        cells = self.codes[row]
+        for col, code in enumerate(line.encode(DDRAM_ENCODING, "replace")):
+            if cells[col] != code:
+                cells[col] = code
+                self.update_cell(col, row)
+
+    def set_custom_bitmap(self, char_bank, rows):
+        """Sets the rows of a custom bitmap, repainting the cells which
+        show it.
+        """
+        if rows == self.custom_bitmaps[char_bank]:
+            return
+        self.custom_bitmaps[char_bank] = rows
+        self._bank_pixmaps[char_bank] = None
+        for row, cells in enumerate(self.codes):
+            for col, code in enumerate(cells):
+                if code < CGRAM_CODES and \
+                        code % MAX_CUSTOM_BITMAPS == char_bank:
+                    self.update_cell(col, row)
+
+    def set_cursor_position(self, position):
+        """Shows the cursor at (col, row), or hides it if None."""
+        self._move_marker(self.cursor_position, position)
+        self.cursor_position = position
+
+    def set_block_position(self, position):
+        """Shows the blinking cursor's block at (col, row), or hides it if
+        None.
+        """
+        self._move_marker(self.block_position, position)
+        self.block_position = position
+
+    def _move_marker(self, old_position, new_position):
+        if new_position != old_position:
+            for position in (old_position, new_position):
+                if position is not None:
+                    self.update_cell(*position)
+
+    def set_display_enabled(self, enabled):
+        if enabled != self.display_enabled:
+            self.display_enabled = enabled
+            self.update()
+
+    def update_cell(self, col, row):
+        """Schedules a repaint of one cell."""
+        if self.dot_geometry is not None:
+            self.update(self.get_cell_rect(col, row))
+
+    def get_cell_rect(self, col, row):
+        width, height = self.dot_geometry.cell_size
+        return QRect(self.cell_left + col * width,
+                     self.cell_top + row * height,
+                     width,
+                     height)
+
+    def update_layout(self):
+        """Fits the cells to the size of the widget. The atlas and custom
+        characters are drawn again if the size of a cell has changed.
+        """
+        cell_width = max(1, self.width() // LCD_WIDTH)
+        cell_height = max(1, self.height() // LCD_LINES)
+        self.cell_left = (self.width() - cell_width * LCD_WIDTH) // 2
+        self.cell_top = (self.height() - cell_height * LCD_LINES) // 2
+        if self.dot_geometry is not None and \
+                self.dot_geometry.cell_size == (cell_width, cell_height):
+            return
+        self.dot_geometry = DotGeometry(cell_width, cell_height)
+        self.atlas = None
+        self.glyph_cache = GlyphCache(self.dot_geometry)
+        self._bank_pixmaps = [None for i in range(MAX_CUSTOM_BITMAPS)]
+
+    def get_atlas(self):
+        if self.atlas is None:
+            self.atlas = GlyphAtlas(self.dot_geometry)
+        return self.atlas
+
+    def get_bank_pixmap(self, char_bank):
+        pixmap = self._bank_pixmaps[char_bank]
+        if pixmap is None:
+            pixmap = self.glyph_cache.get(self.custom_bitmaps[char_bank])
+            self._bank_pixmaps[char_bank] = pixmap
+        return pixmap
+
+    def resizeEvent(self, event):
+        self.update_layout()
+
+    def paintEvent(self, event):
+        if self.dot_geometry is None:
+            self.update_layout()
+        width, height = self.dot_geometry.cell_size
+        rect = event.rect()
+        first_col = max(0, (rect.left() - self.cell_left) // width)
+        last_col = min(LCD_WIDTH - 1, (rect.right() - self.cell_left) // width)
+        first_row = max(0, (rect.top() - self.cell_top) // height)
+        last_row = min(LCD_LINES - 1,
+                       (rect.bottom() - self.cell_top) // height)
+        painter = QPainter(self)
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                self.paint_cell(painter, col, row)
+        painter.end()
+
+    def paint_cell(self, painter, col, row):
+        atlas = self.get_atlas()
+        target = self.get_cell_rect(col, row)
+        self.cells_painted += 1
+        if not self.display_enabled:
+            painter.drawPixmap(
+                target, atlas.pixmap, atlas.get_source_rect(SPACE_CODE))
+            return
+        if (col, row) == self.block_position:
+            # the block hides the character under it
+            painter.drawPixmap(
+                target, atlas.pixmap, atlas.get_source_rect(BLOCK_CODE))
+            return
+        code = self.codes[row][col]
+        if code < CGRAM_CODES:
+            pixmap = self.get_bank_pixmap(code % MAX_CUSTOM_BITMAPS)
+            painter.drawPixmap(target, pixmap, pixmap.rect())
+        else:
+            painter.drawPixmap(
+                target, atlas.pixmap, atlas.get_source_rect(code))
+        if (col, row) == self.cursor_position:
+            painter.drawPixmap(
+                target, atlas.pixmap, atlas.get_source_rect(UNDERLINE_CODE))
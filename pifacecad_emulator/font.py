@@ -0,0 +1,275 @@
+# The character patterns of the HD44780 A00 character generator ROM, kept
+# free of Qt so that the display can be drawn without a window. Each
+# character is 5x8 dots and is returned as rows in the same format as the
+# custom bitmaps in CGRAM (one byte a row, the leftmost dot in bit 4). The
+# bottom row is left blank for the cursor.
+from .lcd import (
+    MAX_CUSTOM_BITMAPS,
+    CUSTOM_BITMAP_ROWS,
+    CUSTOM_BITMAP_COLUMNS,
+    CUSTOM_BITMAP_MASK,
+)
+
+
+# number of character codes
+NUM_CHARACTER_CODES = 256
+# codes below this are drawn from CGRAM, 8 to 15 repeat banks 0 to 7
+CGRAM_CODES = 2 * MAX_CUSTOM_BITMAPS
+# the row the cursor is drawn on
+CURSOR_ROW = CUSTOM_BITMAP_ROWS - 1
+BLANK_GLYPH = bytes(CUSTOM_BITMAP_ROWS)
+# the blinking cursor's block, which hides the character under it, and the
+# cursor's underline
+BLOCK_GLYPH = bytes([CUSTOM_BITMAP_MASK] * CUSTOM_BITMAP_ROWS)
+UNDERLINE_GLYPH = bytes(CUSTOM_BITMAP_MASK if row == CURSOR_ROW else 0
+                        for row in range(CUSTOM_BITMAP_ROWS))
+# dots are black over the background (the LCD image in the window, a flat
+# colour in screenshots), this opaque out of 255 when on and faint when off
+LIT_DOT_ALPHA = 220
+UNLIT_DOT_ALPHA = 18
+
+# the first code in ROM_COLUMNS
+FIRST_ROM_CODE = 0x20
+# the dot columns of codes 0x20 to 0x7f, left to right, with the top dot in
+# bit 0. This half of A00 is ASCII except for 0x5c (yen), 0x7e (right
+# arrow) and 0x7f (left arrow). Codes 0x80 to 0x9f are blank.
+ROM_COLUMNS = (
+    (0x00, 0x00, 0x00, 0x00, 0x00),  # 0x20 space
+    (0x00, 0x00, 0x5f, 0x00, 0x00),  # 0x21 !
+    (0x00, 0x07, 0x00, 0x07, 0x00),  # 0x22 "
+    (0x14, 0x7f, 0x14, 0x7f, 0x14),  # 0x23 #
+    (0x24, 0x2a, 0x7f, 0x2a, 0x12),  # 0x24 $
+    (0x23, 0x13, 0x08, 0x64, 0x62),  # 0x25 %
+    (0x36, 0x49, 0x55, 0x22, 0x50),  # 0x26 &
+    (0x00, 0x05, 0x03, 0x00, 0x00),  # 0x27 '
+    (0x00, 0x1c, 0x22, 0x41, 0x00),  # 0x28 (
+    (0x00, 0x41, 0x22, 0x1c, 0x00),  # 0x29 )
+    (0x08, 0x2a, 0x1c, 0x2a, 0x08),  # 0x2a *
+    (0x08, 0x08, 0x3e, 0x08, 0x08),  # 0x2b +
+    (0x00, 0x50, 0x30, 0x00, 0x00),  # 0x2c ,
+    (0x08, 0x08, 0x08, 0x08, 0x08),  # 0x2d -
+    (0x00, 0x60, 0x60, 0x00, 0x00),  # 0x2e .
+    (0x20, 0x10, 0x08, 0x04, 0x02),  # 0x2f /
+    (0x3e, 0x51, 0x49, 0x45, 0x3e),  # 0x30 0
+    (0x00, 0x42, 0x7f, 0x40, 0x00),  # 0x31 1
+    (0x42, 0x61, 0x51, 0x49, 0x46),  # 0x32 2
+    (0x21, 0x41, 0x45, 0x4b, 0x31),  # 0x33 3
+    (0x18, 0x14, 0x12, 0x7f, 0x10),  # 0x34 4
+    (0x27, 0x45, 0x45, 0x45, 0x39),  # 0x35 5
+    (0x3c, 0x4a, 0x49, 0x49, 0x30),  # 0x36 6
+    (0x01, 0x71, 0x09, 0x05, 0x03),  # 0x37 7
+    (0x36, 0x49, 0x49, 0x49, 0x36),  # 0x38 8
+    (0x06, 0x49, 0x49, 0x29, 0x1e),  # 0x39 9
+    (0x00, 0x36, 0x36, 0x00, 0x00),  # 0x3a :
+    (0x00, 0x56, 0x36, 0x00, 0x00),  # 0x3b ;
+    (0x08, 0x14, 0x22, 0x41, 0x00),  # 0x3c <
+    (0x14, 0x14, 0x14, 0x14, 0x14),  # 0x3d =
+    (0x00, 0x41, 0x22, 0x14, 0x08),  # 0x3e >
+    (0x02, 0x01, 0x51, 0x09, 0x06),  # 0x3f ?
+    (0x32, 0x49, 0x79, 0x41, 0x3e),  # 0x40 @
+    (0x7e, 0x11, 0x11, 0x11, 0x7e),  # 0x41 A
+    (0x7f, 0x49, 0x49, 0x49, 0x36),  # 0x42 B
+    (0x3e, 0x41, 0x41, 0x41, 0x22),  # 0x43 C
+    (0x7f, 0x41, 0x41, 0x22, 0x1c),  # 0x44 D
+    (0x7f, 0x49, 0x49, 0x49, 0x41),  # 0x45 E
+    (0x7f, 0x09, 0x09, 0x09, 0x01),  # 0x46 F
+    (0x3e, 0x41, 0x49, 0x49, 0x7a),  # 0x47 G
+    (0x7f, 0x08, 0x08, 0x08, 0x7f),  # 0x48 H
+    (0x00, 0x41, 0x7f, 0x41, 0x00),  # 0x49 I
+    (0x20, 0x40, 0x41, 0x3f, 0x01),  # 0x4a J
+    (0x7f, 0x08, 0x14, 0x22, 0x41),  # 0x4b K
+    (0x7f, 0x40, 0x40, 0x40, 0x40),  # 0x4c L
+    (0x7f, 0x02, 0x0c, 0x02, 0x7f),  # 0x4d M
+    (0x7f, 0x04, 0x08, 0x10, 0x7f),  # 0x4e N
+    (0x3e, 0x41, 0x41, 0x41, 0x3e),  # 0x4f O
+    (0x7f, 0x09, 0x09, 0x09, 0x06),  # 0x50 P
+    (0x3e, 0x41, 0x51, 0x21, 0x5e),  # 0x51 Q
+    (0x7f, 0x09, 0x19, 0x29, 0x46),  # 0x52 R
+    (0x46, 0x49, 0x49, 0x49, 0x31),  # 0x53 S
+    (0x01, 0x01, 0x7f, 0x01, 0x01),  # 0x54 T
+    (0x3f, 0x40, 0x40, 0x40, 0x3f),  # 0x55 U
+    (0x1f, 0x20, 0x40, 0x20, 0x1f),  # 0x56 V
+    (0x3f, 0x40, 0x38, 0x40, 0x3f),  # 0x57 W
+    (0x63, 0x14, 0x08, 0x14, 0x63),  # 0x58 X
+    (0x07, 0x08, 0x70, 0x08, 0x07),  # 0x59 Y
+    (0x61, 0x51, 0x49, 0x45, 0x43),  # 0x5a Z
+    (0x00, 0x7f, 0x41, 0x41, 0x00),  # 0x5b [
+    (0x15, 0x16, 0x7c, 0x16, 0x15),  # 0x5c yen
+    (0x00, 0x41, 0x41, 0x7f, 0x00),  # 0x5d ]
+    (0x04, 0x02, 0x01, 0x02, 0x04),  # 0x5e ^
+    (0x40, 0x40, 0x40, 0x40, 0x40),  # 0x5f _
+    (0x00, 0x01, 0x02, 0x04, 0x00),  # 0x60 `
+    (0x20, 0x54, 0x54, 0x54, 0x78),  # 0x61 a
+    (0x7f, 0x48, 0x44, 0x44, 0x38),  # 0x62 b
+    (0x38, 0x44, 0x44, 0x44, 0x20),  # 0x63 c
+    (0x38, 0x44, 0x44, 0x48, 0x7f),  # 0x64 d
+    (0x38, 0x54, 0x54, 0x54, 0x18),  # 0x65 e
+    (0x08, 0x7e, 0x09, 0x01, 0x02),  # 0x66 f
+    (0x0c, 0x52, 0x52, 0x52, 0x3e),  # 0x67 g
+    (0x7f, 0x08, 0x04, 0x04, 0x78),  # 0x68 h
+    (0x00, 0x44, 0x7d, 0x40, 0x00),  # 0x69 i
+    (0x20, 0x40, 0x44, 0x3d, 0x00),  # 0x6a j
+    (0x7f, 0x10, 0x28, 0x44, 0x00),  # 0x6b k
+    (0x00, 0x41, 0x7f, 0x40, 0x00),  # 0x6c l
+    (0x7c, 0x04, 0x18, 0x04, 0x78),  # 0x6d m
+    (0x7c, 0x08, 0x04, 0x04, 0x78),  # 0x6e n
+    (0x38, 0x44, 0x44, 0x44, 0x38),  # 0x6f o
+    (0x7c, 0x14, 0x14, 0x14, 0x08),  # 0x70 p
+    (0x08, 0x14, 0x14, 0x18, 0x7c),  # 0x71 q
+    (0x7c, 0x08, 0x04, 0x04, 0x08),  # 0x72 r
+    (0x48, 0x54, 0x54, 0x54, 0x20),  # 0x73 s
+    (0x04, 0x3f, 0x44, 0x40, 0x20),  # 0x74 t
+    (0x3c, 0x40, 0x40, 0x20, 0x7c),  # 0x75 u
+    (0x1c, 0x20, 0x40, 0x20, 0x1c),  # 0x76 v
+    (0x3c, 0x40, 0x30, 0x40, 0x3c),  # 0x77 w
+    (0x44, 0x28, 0x10, 0x28, 0x44),  # 0x78 x
+    (0x0c, 0x50, 0x50, 0x50, 0x3c),  # 0x79 y
+    (0x44, 0x64, 0x54, 0x4c, 0x44),  # 0x7a z
+    (0x00, 0x08, 0x36, 0x41, 0x00),  # 0x7b {
+    (0x00, 0x00, 0x7f, 0x00, 0x00),  # 0x7c |
+    (0x00, 0x41, 0x36, 0x08, 0x00),  # 0x7d }
+    (0x08, 0x08, 0x2a, 0x1c, 0x08),  # 0x7e right arrow
+    (0x08, 0x1c, 0x2a, 0x08, 0x08),  # 0x7f left arrow
+)
+
+# the first code in UPPER_ROM_COLUMNS
+FIRST_UPPER_ROM_CODE = 0xa0
+# the dot columns of codes 0xa0 to 0xff, as ROM_COLUMNS. This half of A00
+# is Japanese punctuation and katakana followed by Greek letters and
+# symbols. The 5x10 characters (g, j, p, q and y) lose their descenders.
+UPPER_ROM_COLUMNS = (
+    (0x00, 0x00, 0x00, 0x00, 0x00),  # 0xa0 blank
+    (0x70, 0x50, 0x70, 0x00, 0x00),  # 0xa1 ideographic full stop
+    (0x00, 0x00, 0x0f, 0x01, 0x01),  # 0xa2 left corner bracket
+    (0x40, 0x40, 0x78, 0x00, 0x00),  # 0xa3 right corner bracket
+    (0x10, 0x20, 0x40, 0x00, 0x00),  # 0xa4 ideographic comma
+    (0x00, 0x18, 0x18, 0x00, 0x00),  # 0xa5 middle dot
+    (0x0a, 0x0a, 0x4a, 0x2a, 0x1e),  # 0xa6 katakana wo
+    (0x04, 0x44, 0x34, 0x14, 0x0c),  # 0xa7 small katakana a
+    (0x20, 0x10, 0x78, 0x04, 0x00),  # 0xa8 small katakana i
+    (0x18, 0x08, 0x4c, 0x48, 0x38),  # 0xa9 small katakana u
+    (0x48, 0x48, 0x78, 0x48, 0x48),  # 0xaa small katakana e
+    (0x48, 0x28, 0x18, 0x7c, 0x08),  # 0xab small katakana o
+    (0x08, 0x7c, 0x08, 0x28, 0x18),  # 0xac small katakana ya
+    (0x40, 0x48, 0x48, 0x78, 0x40),  # 0xad small katakana yu
+    (0x54, 0x54, 0x54, 0x7c, 0x00),  # 0xae small katakana yo
+    (0x18, 0x00, 0x58, 0x40, 0x38),  # 0xaf small katakana tu
+    (0x08, 0x08, 0x08, 0x08, 0x08),  # 0xb0 prolonged sound mark
+    (0x01, 0x41, 0x3d, 0x09, 0x07),  # 0xb1 katakana a
+    (0x10, 0x08, 0x7c, 0x02, 0x01),  # 0xb2 katakana i
+    (0x0e, 0x02, 0x43, 0x22, 0x1e),  # 0xb3 katakana u
+    (0x42, 0x42, 0x7e, 0x42, 0x42),  # 0xb4 katakana e
+    (0x22, 0x12, 0x0a, 0x7f, 0x02),  # 0xb5 katakana o
+    (0x42, 0x3f, 0x02, 0x42, 0x3e),  # 0xb6 katakana ka
+    (0x0a, 0x0a, 0x7f, 0x0a, 0x0a),  # 0xb7 katakana ki
+    (0x08, 0x46, 0x42, 0x22, 0x1e),  # 0xb8 katakana ku
+    (0x04, 0x03, 0x42, 0x3e, 0x02),  # 0xb9 katakana ke
+    (0x42, 0x42, 0x42, 0x42, 0x7e),  # 0xba katakana ko
+    (0x02, 0x4f, 0x22, 0x1f, 0x02),  # 0xbb katakana sa
+    (0x4a, 0x4a, 0x40, 0x20, 0x1c),  # 0xbc katakana si
+    (0x42, 0x22, 0x12, 0x2a, 0x46),  # 0xbd katakana su
+    (0x02, 0x3f, 0x42, 0x4a, 0x46),  # 0xbe katakana se
+    (0x06, 0x48, 0x40, 0x20, 0x1e),  # 0xbf katakana so
+    (0x08, 0x46, 0x4a, 0x2a, 0x1e),  # 0xc0 katakana ta
+    (0x0a, 0x4a, 0x3e, 0x09, 0x08),  # 0xc1 katakana ti
+    (0x0e, 0x00, 0x4e, 0x20, 0x1e),  # 0xc2 katakana tu
+    (0x04, 0x45, 0x3d, 0x05, 0x04),  # 0xc3 katakana te
+    (0x00, 0x7f, 0x08, 0x10, 0x00),  # 0xc4 katakana to
+    (0x44, 0x24, 0x1f, 0x04, 0x04),  # 0xc5 katakana na
+    (0x40, 0x42, 0x42, 0x42, 0x40),  # 0xc6 katakana ni
+    (0x42, 0x2a, 0x12, 0x2a, 0x06),  # 0xc7 katakana nu
+    (0x22, 0x12, 0x7b, 0x16, 0x22),  # 0xc8 katakana ne
+    (0x00, 0x40, 0x20, 0x1f, 0x00),  # 0xc9 katakana no
+    (0x78, 0x00, 0x02, 0x04, 0x78),  # 0xca katakana ha
+    (0x3f, 0x44, 0x44, 0x44, 0x44),  # 0xcb katakana hi
+    (0x02, 0x42, 0x42, 0x22, 0x1e),  # 0xcc katakana hu
+    (0x04, 0x02, 0x04, 0x08, 0x30),  # 0xcd katakana he
+    (0x32, 0x02, 0x7f, 0x02, 0x32),  # 0xce katakana ho
+    (0x02, 0x12, 0x22, 0x52, 0x0e),  # 0xcf katakana ma
+    (0x00, 0x2a, 0x2a, 0x2a, 0x40),  # 0xd0 katakana mi
+    (0x38, 0x24, 0x22, 0x20, 0x70),  # 0xd1 katakana mu
+    (0x40, 0x28, 0x10, 0x28, 0x06),  # 0xd2 katakana me
+    (0x0a, 0x3e, 0x4a, 0x4a, 0x4a),  # 0xd3 katakana mo
+    (0x04, 0x7f, 0x04, 0x14, 0x0c),  # 0xd4 katakana ya
+    (0x40, 0x42, 0x7e, 0x42, 0x40),  # 0xd5 katakana yu
+    (0x4a, 0x4a, 0x4a, 0x4a, 0x7e),  # 0xd6 katakana yo
+    (0x04, 0x05, 0x45, 0x25, 0x1c),  # 0xd7 katakana ra
+    (0x0f, 0x40, 0x20, 0x1f, 0x00),  # 0xd8 katakana ri
+    (0x7c, 0x00, 0x7e, 0x40, 0x30),  # 0xd9 katakana ru
+    (0x7e, 0x40, 0x20, 0x10, 0x08),  # 0xda katakana re
+    (0x7e, 0x42, 0x42, 0x42, 0x7e),  # 0xdb katakana ro
+    (0x0e, 0x02, 0x42, 0x22, 0x1e),  # 0xdc katakana wa
+    (0x42, 0x42, 0x20, 0x10, 0x0c),  # 0xdd katakana n
+    (0x02, 0x04, 0x01, 0x02, 0x00),  # 0xde voiced sound mark
+    (0x07, 0x05, 0x07, 0x00, 0x00),  # 0xdf semi-voiced sound mark (degree)
+    (0x38, 0x44, 0x48, 0x30, 0x4c),  # 0xe0 alpha
+    (0x21, 0x54, 0x55, 0x54, 0x78),  # 0xe1 a umlaut
+    (0x7c, 0x2a, 0x2a, 0x2a, 0x14),  # 0xe2 beta
+    (0x28, 0x54, 0x54, 0x44, 0x00),  # 0xe3 epsilon
+    (0x7c, 0x20, 0x00, 0x30, 0x1c),  # 0xe4 mu
+    (0x38, 0x44, 0x4c, 0x44, 0x34),  # 0xe5 sigma
+    (0x78, 0x24, 0x24, 0x24, 0x18),  # 0xe6 rho
+    (0x18, 0x24, 0x24, 0x24, 0x7c),  # 0xe7 g
+    (0x10, 0x20, 0x1e, 0x02, 0x02),  # 0xe8 square root
+    (0x04, 0x04, 0x00, 0x0e, 0x00),  # 0xe9 superscript -1
+    (0x20, 0x40, 0x40, 0x44, 0x3d),  # 0xea j
+    (0x0a, 0x04, 0x0a, 0x00, 0x00),  # 0xeb superscript x
+    (0x18, 0x24, 0x7e, 0x24, 0x24),  # 0xec cent
+    (0x7e, 0x49, 0x49, 0x42, 0x60),  # 0xed pound
+    (0x7c, 0x09, 0x05, 0x05, 0x78),  # 0xee n tilde
+    (0x38, 0x45, 0x44, 0x45, 0x38),  # 0xef o umlaut
+    (0x7c, 0x24, 0x24, 0x24, 0x18),  # 0xf0 p
+    (0x18, 0x24, 0x24, 0x24, 0x7c),  # 0xf1 q
+    (0x3e, 0x49, 0x49, 0x49, 0x3e),  # 0xf2 theta
+    (0x30, 0x28, 0x10, 0x28, 0x18),  # 0xf3 infinity
+    (0x5c, 0x62, 0x02, 0x62, 0x5c),  # 0xf4 omega
+    (0x3c, 0x41, 0x40, 0x21, 0x7c),  # 0xf5 u umlaut
+    (0x63, 0x55, 0x49, 0x41, 0x41),  # 0xf6 capital sigma
+    (0x44, 0x3c, 0x04, 0x7c, 0x44),  # 0xf7 pi
+    (0x45, 0x29, 0x11, 0x29, 0x45),  # 0xf8 x bar
+    (0x1c, 0x20, 0x20, 0x20, 0x7c),  # 0xf9 y
+    (0x14, 0x14, 0x7c, 0x14, 0x12),  # 0xfa thousand
+    (0x22, 0x1e, 0x0a, 0x4a, 0x3a),  # 0xfb ten thousand
+    (0x3e, 0x0a, 0x0e, 0x0a, 0x3e),  # 0xfc yen (kanji)
+    (0x08, 0x08, 0x2a, 0x08, 0x08),  # 0xfd divide
+    (0x00, 0x00, 0x00, 0x00, 0x00),  # 0xfe blank
+    (0x7f, 0x7f, 0x7f, 0x7f, 0x7f),  # 0xff block
+)
+
+
+def get_rows_from_columns(columns):
+    """Returns the rows of a character given as dot columns."""
+    return bytes(
+        sum(((column >> y) & 1) << (CUSTOM_BITMAP_COLUMNS - 1 - x)
+            for x, column in enumerate(columns))
+        for y in range(CUSTOM_BITMAP_ROWS))
+
+
+def get_rom_columns(code):
+    """Returns the dot columns of a character code, or None if the code is
+    blank.
+    """
+    if FIRST_ROM_CODE <= code < FIRST_ROM_CODE + len(ROM_COLUMNS):
+        return ROM_COLUMNS[code - FIRST_ROM_CODE]
+    if code >= FIRST_UPPER_ROM_CODE:
+        return UPPER_ROM_COLUMNS[code - FIRST_UPPER_ROM_CODE]
+    return None
+
+
+ROM_GLYPHS = tuple(
+    BLANK_GLYPH if get_rom_columns(code) is None
+    else get_rows_from_columns(get_rom_columns(code))
+    for code in range(NUM_CHARACTER_CODES))
+
+
+def get_glyph(code, cgram):
+    """Returns the rows drawn for a character code.
+
+    :param code: The character code.
+    :type code: int
+    :param cgram: The custom bitmaps for codes below CGRAM_CODES.
+    :type cgram: :class:`pifacecad_emulator.lcd.CGRAM`
+    """
+    if code < CGRAM_CODES:
+        return cgram.get_bitmap(code % MAX_CUSTOM_BITMAPS)
+    return ROM_GLYPHS[code]
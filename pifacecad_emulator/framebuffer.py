@@ -0,0 +1,286 @@
+# Offscreen rendering of the LCD for screenshots, without Qt. Snapshots
+# (see snapshot.py) are rasterised dot by dot from the A00 ROM in font.py
+# into a raw RGB buffer, which can be written as it is or as a PNG. Each
+# cell is drawn once and cached, so a frame is mostly joining cached rows.
+import os
+import struct
+import logging
+import threading
+import zlib
+from binascii import crc32
+from collections import OrderedDict
+from time import monotonic
+from .lcd import (
+    LCD_LINES,
+    LCD_WIDTH,
+    MAX_CUSTOM_BITMAPS,
+    CUSTOM_BITMAP_ROWS,
+    CUSTOM_BITMAP_COLUMNS,
+)
+from .font import (
+    CGRAM_CODES,
+    BLANK_GLYPH,
+    BLOCK_GLYPH,
+    UNDERLINE_GLYPH,
+    LIT_DOT_ALPHA,
+    UNLIT_DOT_ALPHA,
+    ROM_GLYPHS,
+)
+from .snapshot import get_snapshot, get_visible_cursor
+from .state import SharedStateError
+
+
+# the background with the backlight on and off, the dots are drawn over
+# it as in the emulator window (see font.py)
+BACKLIGHT_ON_RGB = (150, 200, 60)
+BACKLIGHT_OFF_RGB = (110, 130, 70)
+# pixels a dot, the last pixel of each dot is left as a gap when there is
+# more than one
+DOT_SCALE = 3
+# the gap between characters and the border around them, in dots
+CELL_GAP_DOTS = 1
+BORDER_DOTS = 2
+# the most cells kept, see FrameRenderer
+CELL_CACHE_SIZE = 512
+# zlib level for PNGs, the frames are small and flat so 1 is plenty
+PNG_COMPRESSION = 1
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# how often, in seconds, a FrameExporter writes a frame by default
+EXPORT_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def get_cursor_glyph(rows):
+    """Returns the rows of a character with the cursor under it."""
+    return bytes(row | underline
+                 for row, underline in zip(rows, UNDERLINE_GLYPH))
+
+
+class FrameRenderer(object):
+    """Rasterises :class:`DisplaySnapshot` into RGB frames. One renderer
+    can be shared by any number of emulators, and threads, so that they
+    share its cache of cells.
+
+    :param scale: Pixels a dot.
+    :type scale: int
+    """
+    def __init__(self, scale=DOT_SCALE):
+        self.scale = scale
+        self.cell_width = (CUSTOM_BITMAP_COLUMNS + CELL_GAP_DOTS) * scale
+        self.cell_height = (CUSTOM_BITMAP_ROWS + CELL_GAP_DOTS) * scale
+        self.border = BORDER_DOTS * scale
+        self.width = 2 * self.border + LCD_WIDTH * self.cell_width
+        self.height = 2 * self.border + LCD_LINES * self.cell_height
+        # (rows, backlight) to the cell's pixel rows
+        self.cells = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_cell(self, rows, backlight):
+        """Returns the pixel rows of a cell showing a character, as RGB
+        bytes.
+        """
+        key = rows, backlight
+        with self._lock:
+            try:
+                cell = self.cells.pop(key)
+            except KeyError:
+                cell = self.draw_cell(rows, backlight)
+                if len(self.cells) >= CELL_CACHE_SIZE:
+                    self.cells.popitem(last=False)
+            self.cells[key] = cell
+        return cell
+
+    def draw_cell(self, rows, backlight):
+        background = get_background(backlight)
+        unlit = bytes(get_dot_rgb(backlight, UNLIT_DOT_ALPHA))
+        lit = bytes(get_dot_rgb(backlight, LIT_DOT_ALPHA))
+        dot_pixels = max(1, self.scale - 1)
+        gap = background * (self.scale - dot_pixels)
+        cell_gap = background * (CELL_GAP_DOTS * self.scale)
+        blank_row = background * self.cell_width
+        pixel_rows = []
+        for row in rows:
+            dots = []
+            for col in range(CUSTOM_BITMAP_COLUMNS):
+                # the leftmost dot is the highest bit
+                if row & (1 << (CUSTOM_BITMAP_COLUMNS - 1 - col)):
+                    dots.append(lit * dot_pixels + gap)
+                else:
+                    dots.append(unlit * dot_pixels + gap)
+            dot_row = b"".join(dots) + cell_gap
+            pixel_rows.extend([dot_row] * dot_pixels)
+            pixel_rows.extend([blank_row] * (self.scale - dot_pixels))
+        pixel_rows.extend([blank_row] * (CELL_GAP_DOTS * self.scale))
+        return tuple(pixel_rows)
+
+    def get_cell_rows(self, snapshot, code, position, cursor, blink):
+        if not snapshot.display_enabled:
+            return BLANK_GLYPH
+        if blink and snapshot.blink_enabled and position == cursor:
+            # the block hides the character under it
+            return BLOCK_GLYPH
+        if code < CGRAM_CODES:
+            start = (code % MAX_CUSTOM_BITMAPS) * CUSTOM_BITMAP_ROWS
+            rows = snapshot.cgram[start:start+CUSTOM_BITMAP_ROWS]
+        else:
+            rows = ROM_GLYPHS[code]
+        if snapshot.cursor_enabled and position == cursor:
+            rows = get_cursor_glyph(rows)
+        return rows
+
+    def render(self, snapshot, blink=False):
+        """Returns the frame of a snapshot as width * height RGB pixels,
+        top row first.
+
+        :param snapshot: The display.
+        :type snapshot: :class:`DisplaySnapshot`
+        :param blink: Draw the blinking cursor's block, if it is enabled.
+        :type blink: bool
+        """
+        backlight = snapshot.backlight_enabled
+        background = get_background(backlight)
+        blank_row = background * self.width
+        side = background * self.border
+        cursor = get_visible_cursor(snapshot)
+
+        frame = [blank_row * self.border]
+        for row, line in enumerate(snapshot.lines):
+            cells = [self.get_cell(self.get_cell_rows(snapshot, ord(char),
+                                                      (col, row), cursor,
+                                                      blink),
+                                   backlight)
+                     for col, char in enumerate(line)]
+            for pixel_rows in zip(*cells):
+                frame.append(side)
+                frame.extend(pixel_rows)
+                frame.append(side)
+        frame.append(blank_row * self.border)
+        return b"".join(frame)
+
+    def render_png(self, snapshot, blink=False):
+        """Returns the frame of a snapshot as a PNG, see :meth:`render`."""
+        return encode_png(self.width, self.height,
+                          self.render(snapshot, blink))
+
+
+def get_background_rgb(backlight):
+    return BACKLIGHT_ON_RGB if backlight else BACKLIGHT_OFF_RGB
+
+
+def get_background(backlight):
+    return bytes(get_background_rgb(backlight))
+
+
+def get_dot_rgb(backlight, alpha):
+    """Returns the colour of a dot drawn in black with an alpha out of 255
+    over the background.
+    """
+    return tuple(c * (255 - alpha) // 255
+                 for c in get_background_rgb(backlight))
+
+
+def get_png_chunk(chunk_type, data):
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+            struct.pack(">I", crc32(chunk_type + data) & 0xffffffff))
+
+
+def encode_png(width, height, rgb):
+    """Returns width * height RGB pixels, top row first, as a PNG."""
+    stride = width * 3
+    # each row starts with filter type 0 (none)
+    scanlines = b"".join(b"\x00" + rgb[y*stride:(y+1)*stride]
+                         for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (PNG_SIGNATURE +
+            get_png_chunk(b"IHDR", header) +
+            get_png_chunk(b"IDAT", zlib.compress(scanlines, PNG_COMPRESSION)) +
+            get_png_chunk(b"IEND", b""))
+
+
+class FrameExporter(object):
+    """Writes screenshots of an emulator to a file, at most once every
+    interval seconds and only when the display has changed. The file is a
+    PNG if its name ends with .png and raw RGB otherwise, and is replaced
+    in one step so readers never see half a frame. Frames which can't be
+    exported are logged and counted, and the exporter carries on::
+
+        exporter = FrameExporter(cad, "/var/www/kiosk1.png")
+        exporter.start()
+
+    :param cad: The emulator.
+    :type cad: :class:`pifacecad_emulator.PiFaceCAD`
+    :param path: The file to write.
+    :type path: str
+    :param interval: The shortest time between frames, in seconds.
+    :type interval: float
+    :param renderer: The renderer, share one between exporters to share
+        its cells.
+    :type renderer: :class:`FrameRenderer`
+    """
+    def __init__(self, cad, path, interval=EXPORT_INTERVAL, renderer=None):
+        self.cad = cad
+        self.path = path
+        self.interval = interval
+        self.renderer = FrameRenderer() if renderer is None else renderer
+        self.png = path.lower().endswith(".png")
+        self.last_snapshot = None
+        self.frames_written = 0
+        # unchanged since the last frame
+        self.frames_skipped = 0
+        # couldn't be written, or the emulator couldn't be read
+        self.frames_failed = 0
+        self._stop = threading.Event()
+        self.thread = None
+
+    def export(self):
+        """Writes a frame now if the display has changed. Returns True if
+        it did.
+        """
+        snapshot = get_snapshot(self.cad.read_state())
+        if snapshot == self.last_snapshot:
+            self.frames_skipped += 1
+            return False
+        if self.png:
+            frame = self.renderer.render_png(snapshot)
+        else:
+            frame = self.renderer.render(snapshot)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(frame)
+        os.replace(temp_path, self.path)
+        self.last_snapshot = snapshot
+        self.frames_written += 1
+        return True
+
+    def start(self):
+        """Exports frames on a thread until :meth:`stop`."""
+        self._stop.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        next_export = monotonic()
+        while not self._stop.is_set():
+            try:
+                self.export()
+            except (OSError, SharedStateError):
+                # the disk may be full or the emulator restarting, so keep
+                # trying rather than leave a stale frame behind
+                self.frames_failed += 1
+                logger.exception("Couldn't export a frame to %s.",
+                                 self.path)
+            next_export += self.interval
+            delay = next_export - monotonic()
+            if delay < 0:
+                # running late, don't export a burst of frames to catch up
+                next_export = monotonic()
+                delay = 0
+            self._stop.wait(delay)
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -1,31 +1,62 @@
-from PySide.QtCore import (QThread, QObject, Slot, Signal)
+from PySide.QtCore import (QThread, QObject, QTimer, Slot, Signal, Qt)
 from PySide.QtGui import (
     QMainWindow,
     QPushButton,
     QApplication,
     QPainter,
-    QFont
+    QFont,
+    QWidget,
+    QGridLayout,
 )
-from time import sleep
+from time import sleep, time, monotonic
+from functools import partial, wraps
+import queue
 import threading
 # from .watchers import (start_interface_message_handler, start_switch_watcher)
 from .pifacecad_emulator_ui import Ui_pifaceCADEmulatorWindow
 from .watchers import (
-    start_blinker,
     start_interface_message_handler,
     start_switch_watcher,
 )
+from .lcd import (
+    LCD_LINES,
+    LCD_WIDTH,
+    LCD_RAM_WIDTH,
+    LCD_ROW_WIDTH,
+    DDRAM,
+    CGRAM,
+    BLINK_INTERVAL,
+    MAX_CUSTOM_BITMAPS,
+    get_col_row_from_value,
+    get_value_from_col_row,
+    get_switch_port_value,
+)
+from .display import DotMatrixDisplay
+from .mirror import HardwareMirror
+from .state import EmulatorState
+from .server import route_server_actions
+from .transport import TransportHub, ParentConnection
 import pifacecad
 
 
-COL_PIXEL = (39, 49, 59, 69, 79, 89, 99, 109, 119, 129, 139, 149, 159,
-             169, 179, 189)
-ROW_PIXEL = (80, 101)
+# the LCD is repainted at most this many times a second
+DEFAULT_MAX_FPS = 30
+
+# x, y, width and height of the dot matrix display over the LCD image
+LCD_DISPLAY_GEOMETRY = (32, 76, 176, 48)
 
-LCD_LINES = 2
-LCD_WIDTH = 16
-LCD_RAM_WIDTH = 80
-LCD_ROW_WIDTH = int(80 / 2)
+
+def replies_on_error(slot):
+    """Makes a query slot send an error in place of its reply if it fails,
+    so that the application isn't left waiting for the reply.
+    """
+    @wraps(slot)
+    def reply_or_send_error(self, *args):
+        try:
+            slot(self, *args)
+        except Exception as e:
+            self.send_error.emit("{}: {}".format(type(e).__name__, e))
+    return reply_or_send_error
 
 
 class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
@@ -35,9 +66,51 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
 
         self._blink_hidden_state = False
         self.cad = None
+        # display changes are copied to the real board, if there is one, by
+        # a worker thread. The window's own state is always right.
+        self.hardware_mirror = None
+
+        # state published to the application process, see publish_state
+        self.shared_state = None
+        self.messages_applied = 0
+        self.messages_dropped = 0
+        self._switch_bits = 0
+
+        # switch edges are pushed to the application on the events pipe
+        self.events_pipe = None
+        self.switch_events_subscribed = False
+        self.ir_events_subscribed = False
+
+        # the LCD is painted dot by dot over the LCD image, in place of the
+        # text and cursor labels from the .ui file
+        self.lcd_display = DotMatrixDisplay(self.lcdLine0Label.parentWidget())
+        self.lcd_display.setGeometry(*LCD_DISPLAY_GEOMETRY)
+        # keep the backlight over the dots
+        self.lcd_display.stackUnder(self.backlightLabel)
+        for label in (self.lcdLine0Label, self.lcdLine1Label,
+                      self.cursorLabel, self.blinkLabel):
+            label.setVisible(False)
+
+        # changes mark the display dirty and are passed to lcd_display by
+        # render_timer, see schedule_render
+        self.max_fps = DEFAULT_MAX_FPS
+        self._lines_dirty = False
+        self._cursor_dirty = False
+        self._last_render = 0
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.render)
+
+        # only runs while a blinking cursor can be seen, see
+        # update_blink_timer
+        self.blink_timer = QTimer(self)
+        self.blink_timer.setInterval(int(round(BLINK_INTERVAL * 1000)))
+        self.blink_timer.timeout.connect(self.blink)
+
+        self.cgram = CGRAM()
 
         # self.switch_state = [False for i in range(8)]
-        self._cursor_position = [0, 0]
+        self.ddram = DDRAM()
         self.clear()
 
         self.switch_buttons = [self.switch0Button,
@@ -49,9 +122,10 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
                                self.switch6Button,
                                self.switch7Button]
 
-        for button in self.switch_buttons:
-            button.pressed.connect(self.switch_pressed)
-            button.released.connect(self.switch_released)
+        for switch_num, button in enumerate(self.switch_buttons):
+            button.pressed.connect(partial(self.switch_pressed, switch_num))
+            button.released.connect(
+                partial(self.switch_released, switch_num))
 
         self.displayCheckBox.stateChanged.connect(self.change_display)
         self.backlightCheckBox.stateChanged.connect(self.change_backlight)
@@ -74,27 +148,59 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
         self.moveLeftPushButton.clicked.connect(self.move_left)
         self.moveRightPushButton.clicked.connect(self.move_right)
 
+        self.irCodeLineEdit.returnPressed.connect(self.send_ir_code)
+        self.sendIRCodeButton.clicked.connect(self.send_ir_code)
+
         # self.flush_lcd_lines()
         self.viewport_corner = 0
 
-    def switch_pressed(self):
-        self.switch_pressed_or_released()
+    def switch_pressed(self, switch_num):
+        self.switch_pressed_or_released(switch_num, True)
 
-    def switch_released(self):
-        self.switch_pressed_or_released()
+    def switch_released(self, switch_num):
+        self.switch_pressed_or_released(switch_num, False)
 
-    def switch_pressed_or_released(self):
-        """Need to call registered functions."""
-        # print("a switch was pressed/released")
-        pass
+    def switch_pressed_or_released(self, switch_num, pressed):
+        """Called when a switch button is clicked. The switch is set unless
+        the switches are those of a real board.
+        """
+        if self.cad is None:
+            # a real board's switches are set by the switch watcher
+            self.set_switch(switch_num, pressed)
+
+    def set_switch(self, switch_num, pressed):
+        """Presses or releases one switch, leaving the others as they
+        are.
+        """
+        self.switch_buttons[switch_num].setChecked(pressed)
+        if pressed:
+            self.set_switch_bits(self._switch_bits | (1 << switch_num))
+        else:
+            self.set_switch_bits(self._switch_bits & ~(1 << switch_num))
+
+    def set_switch_bits(self, switch_bits):
+        """Records the switch states and pushes an event for each switch
+        which has changed.
+        """
+        changed = self._switch_bits ^ switch_bits
+        self._switch_bits = switch_bits
+        self.publish_state()
+        if changed and self.switch_events_subscribed:
+            timestamp = time()
+            for switch_num in range(len(self.switch_buttons)):
+                if changed & (1 << switch_num):
+                    pressed = bool(switch_bits & (1 << switch_num))
+                    self.events_pipe.send(
+                        ('switch', switch_num, pressed, timestamp))
 
     @property
     def switch_state(self):
-        """Returns a list of switch values."""
-        if self.cad is None:
-            return [switch.isDown() for switch in self.switch_buttons]
-        else:
-            return [switch.value == 1 for switch in self.cad.switches]
+        """Returns a list of switch values. With a real board they are
+        kept up to date by the switch watcher's interrupts, so this never
+        reads the board.
+        """
+        return [bool(self._switch_bits & (1 << switch_num))
+                for switch_num in range(len(self.switch_buttons))]
 
     def change_display(self, state):
         if state:
@@ -136,17 +242,12 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
         self.cursorColumnLineEdit.setSelection(0, len(str(col)))
 
     def see_cursor(self):
-        if self.cad:
-            self.cad.lcd.see_cursor()
-            self._viewport_corner = self.cad.lcd.viewport_corner
-            self.flush_lcd_lines()
-            self.update_cursor_and_blink()
-        else:
-            while not self.cursorLabel.isVisible():
-                self._viewport_corner = \
-                    (self._viewport_corner + 1) % LCD_ROW_WIDTH
-                self.flush_lcd_lines()
-                self.update_cursor_label()
+        if not self._cursor_is_on_screen():
+            col, row = self.ddram.cursor
+            if col >= self.viewport_corner + LCD_WIDTH:
+                self.viewport_corner = col - (LCD_WIDTH - 1)
+            else:
+                self.viewport_corner = col
 
     def goto_viewport(self):
         try:
@@ -166,15 +267,14 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
         self.viewport_corner += 1
 
     def home(self):
-        if self.cad:
-            self.cad.lcd.home()
+        self.mirror(('home', 0))
         self.viewport_corner = 0
         self._set_virtual_cursor(0, 0)
 
     def clear(self):
-        if self.cad:
-            self.cad.lcd.clear()
-        self.lcd_lines = [" "*LCD_ROW_WIDTH, " "*LCD_ROW_WIDTH]
+        self.mirror(('clear', 0))
+        self.ddram.clear()
+        self.flush_lcd_lines()
         self.viewport_corner = 0
         self._set_virtual_cursor(0, 0)
 
@@ -185,85 +285,85 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
     @viewport_corner.setter
     def viewport_corner(self, value):
         self._viewport_corner = value % LCD_ROW_WIDTH
-        if self.cad:
-            self.cad.lcd.viewport_corner = self._viewport_corner
+        self.mirror(('set_viewport_corner', self._viewport_corner))
         self.flush_lcd_lines()
         self.update_cursor_and_blink()
 
     def display_on(self):
-        if self.cad:
-            self.cad.lcd.display_on()
-        self.lcdLine0Label.setVisible(True)
-        self.lcdLine1Label.setVisible(True)
+        self.mirror(('set_display_enable', 1))
         self.displayCheckBox.setChecked(True)
+        self.flush_lcd_lines()
         self.update_cursor_and_blink()
 
     def display_off(self):
-        if self.cad:
-            self.cad.lcd.display_off()
-        self.lcdLine0Label.setVisible(False)
-        self.lcdLine1Label.setVisible(False)
+        self.mirror(('set_display_enable', 0))
         self.displayCheckBox.setChecked(False)
+        self.flush_lcd_lines()
         self.update_cursor_and_blink()
 
     def backlight_on(self):
-        if self.cad:
-            self.cad.lcd.backlight_on()
+        self.mirror(('set_backlight_enable', 1))
         self.backlightLabel.setVisible(True)
         self.backlightCheckBox.setChecked(True)
+        self.publish_state()
 
     def backlight_off(self):
-        if self.cad:
-            self.cad.lcd.backlight_off()
+        self.mirror(('set_backlight_enable', 0))
         self.backlightLabel.setVisible(False)
         self.backlightCheckBox.setChecked(False)
+        self.publish_state()
 
     def set_cursor(self, col, row):
-        if self.cad:
-            self.cad.lcd.set_cursor(col, row)
         self._set_virtual_cursor(col, row)
+        self.mirror(('set_cursor', get_value_from_col_row(*self.ddram.cursor)))
 
     def get_cursor(self):
-        if self.cad:
-            col, row = self.cad.lcd.get_cursor()
-            self._set_virtual_cursor(col, row)
-        return tuple(self._cursor_position)
+        return self.ddram.cursor
 
     def _set_virtual_cursor(self, col, row):
-        row %= (LCD_LINES - 1)
-        self._cursor_position = [col, row]
+        self.ddram.set_cursor(col, row % LCD_LINES)
         self.update_cursor_and_blink()
 
     def update_cursor_and_blink(self):
-        self.update_cursor_label()
-        self.update_blink_label()
-
-    def update_cursor_label(self):
-        col, row = self.get_cursor_label_col_row()
-        visible = self._cursor_is_visible()
-        self.cursorLabel.setVisible(visible)
-        if visible:
-            # print("trying {},{}".format(col, row))
-            self.cursorLabel.move(COL_PIXEL[col], ROW_PIXEL[row])
+        self._cursor_dirty = True
+        self.update_blink_timer()
+        self.schedule_render()
+
+    def update_blink_timer(self):
+        """Starts blink_timer when a blinking cursor can be seen and stops
+        it when it can't.
+        """
+        blinking = (self._cursor_is_on_screen() and
+                    self.displayCheckBox.isChecked() and
+                    self.blinkCheckBox.isChecked())
+        if blinking == self.blink_timer.isActive():
+            return
+        # the blinking cursor is shown first
+        self._blink_hidden_state = False
+        if blinking:
+            self.blink_timer.start()
+        else:
+            self.blink_timer.stop()
 
-    def update_blink_label(self):
-        col, row = self.get_cursor_label_col_row()
-        visible = self._blink_is_visible()
-        self.blinkLabel.setVisible(visible)
+    def _get_cursor_position(self, visible):
+        """Returns the (col, row) a cursor is drawn at, or None if it is
+        hidden.
+        """
         if visible:
-            self.blinkLabel.move(COL_PIXEL[col], ROW_PIXEL[row])
+            return self.get_cursor_display_col_row()
+        return None
 
-    def get_cursor_label_col_row(self):
-        col, row = self._cursor_position
+    def get_cursor_display_col_row(self):
+        col, row = self.ddram.cursor
         if self._is_wrap_around():
             # add the difference to the column to shift it
-            col = LCD_ROW_WIDTH - self.viewport_corner
+            col += LCD_ROW_WIDTH - self.viewport_corner
         else:
             col -= self.viewport_corner
         return col, row
 
     def _is_wrap_around(self):
-        col, row = self._cursor_position
+        col, row = self.ddram.cursor
         # print("vpc-col", self.viewport_corner-col)
         # print("threshold", LCD_RAM_WIDTH-LCD_WIDTH)
         return (self.viewport_corner - col) > (LCD_ROW_WIDTH - LCD_WIDTH)
@@ -288,7 +388,7 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
         return blink_on_screen and display_on and blink_on and not hidden
 
     def _cursor_is_on_screen(self):
-        col, row = self._cursor_position
+        col, row = self.ddram.cursor
         too_far_right = col >= (self.viewport_corner + LCD_WIDTH)
         too_far_left = col < self.viewport_corner
         can_see_from_wrap_around = \
@@ -304,83 +404,128 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
             can_see_from_wrap_around
 
     def cursor_on(self):
-        if self.cad:
-            self.cad.lcd.cursor_on()
-        self.cursorLabel.setVisible(True)
+        self.mirror(('set_cursor_enable', 1))
         self.cursorCheckBox.setChecked(True)
+        self.update_cursor_and_blink()
 
     def cursor_off(self):
-        if self.cad:
-            self.cad.lcd.cursor_off()
-        self.cursorLabel.setVisible(False)
+        self.mirror(('set_cursor_enable', 0))
         self.cursorCheckBox.setChecked(False)
+        self.update_cursor_and_blink()
 
     def blink_on(self):
-        if self.cad:
-            self.cad.lcd.blink_on()
-        self.blinkLabel.setVisible(True)
+        self.mirror(('set_blink_enable', 1))
         self.blinkCheckBox.setChecked(True)
+        self.update_cursor_and_blink()
 
     def blink_off(self):
-        if self.cad:
-            self.cad.lcd.blink_off()
-        self.blinkLabel.setVisible(False)
+        self.mirror(('set_blink_enable', 0))
         self.blinkCheckBox.setChecked(False)
+        self.update_cursor_and_blink()
 
     def blink(self):
         self._blink_hidden_state = not self._blink_hidden_state
-        self.update_blink_label()
+        self.update_cursor_and_blink()
         # if self.displayCheckBox.isChecked() and \
         #         self.blinkCheckBox.isChecked():
         #     self.blinkLabel.setVisible(not self.blinkLabel.isVisible())
 
+    def send_ir_code(self, ir_code=None):
+        if ir_code is None:
+            ir_code = self.irCodeLineEdit.text()
+        if self.ir_events_subscribed:
+            self.events_pipe.send(('ir', ir_code, time()))
+
     def write_message(self, message=None):
         if message is None:
-            message = self.writeMessageLineEdit.text()
+            # new lines are typed as \n in the line edit
+            message = self.writeMessageLineEdit.text().replace("\\n", "\n")
         # print("Writing message:", message)
-        col, row = self.get_cursor()
-        lines = message.split("\\n")
-
-        # first row
-        pre = self.lcd_lines[row][:col]
-        new_col = col + len(lines[0])
-        post = self.lcd_lines[row][new_col:]
-        self.lcd_lines[row] = "{}{}{}".format(pre, lines[0], post)
-        new_row = row
-
-        # second row
-        if len(lines) > 1:
-            col = 0  # new line starts from the beginning
-            new_col = col+len(lines[1])
-            new_row = 1
-            #pre = self.lcd_lines[1][:col]
-            post = self.lcd_lines[new_row][new_col:]
-            self.lcd_lines[new_row] = "{}{}".format(lines[1], post)
+        self.ddram.write(message)
+        self.mirror(('set_message', message))
+        self.flush_lcd_lines()
+        self.update_cursor_and_blink()
 
+    def store_custom_bitmap(self, char_bank, rows):
+        self.cgram.store(char_bank, rows)
+        self.mirror(('store_custom_bitmap', (char_bank, rows)))
         self.flush_lcd_lines()
-        if self.cad:
-            self.cad.lcd.write(message.replace("\\n", "\n"))
-            col, row = self.cad.lcd.get_cursor()
-            self._set_virtual_cursor(col, row)
-        else:
-            print("setting vc, col {}, row {}".format(new_col, new_row))
-            self._set_virtual_cursor(new_col, new_row)
+
+    def mirror(self, action):
+        """Queues a (task, data) display change for the real board, if
+        there is one.
+        """
+        if self.hardware_mirror is not None:
+            self.hardware_mirror.put(action)
 
     def flush_lcd_lines(self):
-        start = self.viewport_corner
-        end = self.viewport_corner+LCD_WIDTH
+        self._lines_dirty = True
+        self.schedule_render()
+
+    def schedule_render(self):
+        """Repaints the LCD at the next frame, no more than max_fps times
+        a second. Any number of changes before then are drawn at once.
+        """
+        if self.render_timer.isActive():
+            return
+        delay = self._last_render + 1 / self.max_fps - monotonic()
+        self.render_timer.start(max(0, int(delay * 1000)))
+
+    def render(self):
+        """Passes the parts of the LCD which are dirty to lcd_display, which
+        repaints the cells that changed.
+        """
+        self._last_render = monotonic()
+        if self._lines_dirty:
+            self._lines_dirty = False
+            self.render_lcd_lines()
+        if self._cursor_dirty:
+            self._cursor_dirty = False
+            self.lcd_display.set_cursor_position(
+                self._get_cursor_position(self._cursor_is_visible()))
+            self.lcd_display.set_block_position(
+                self._get_cursor_position(self._blink_is_visible()))
+        self.publish_state()
+
+    def render_lcd_lines(self):
+        self.lcd_display.set_display_enabled(
+            self.displayCheckBox.isChecked())
+        for char_bank in range(MAX_CUSTOM_BITMAPS):
+            self.lcd_display.set_custom_bitmap(
+                char_bank, self.cgram.get_bitmap(char_bank))
+        for row in range(LCD_LINES):
+            self.lcd_display.set_line(
+                row, self.ddram.get_visible_line(row, self.viewport_corner))
 
-        # need to support wrapping around
-        # concatenate line with itself and pretend to wrap around
-        top_line = self.lcd_lines[0] + self.lcd_lines[0]
-        self.lcdLine0Label.setText(top_line[start:end])
-        bottom_line = self.lcd_lines[1] + self.lcd_lines[1]
-        self.lcdLine1Label.setText(bottom_line[start:end])
+    @property
+    def state(self):
+        """The current :class:`EmulatorState`."""
+        return EmulatorState(switches=self._switch_bits,
+                             cursor=self.ddram.cursor,
+                             viewport_corner=self.viewport_corner,
+                             display_enabled=self.displayCheckBox.isChecked(),
+                             cursor_enabled=self.cursorCheckBox.isChecked(),
+                             blink_enabled=self.blinkCheckBox.isChecked(),
+                             backlight_enabled=(
+                                 self.backlightCheckBox.isChecked()),
+                             ddram=self.ddram.to_bytes(),
+                             cgram=self.cgram.to_bytes())
+
+    def publish_state(self):
+        """Copies the state into shared memory for the application."""
+        if self.shared_state is not None:
+            self.shared_state.publish(
+                self.messages_applied, self.state, self.messages_dropped)
 
     @Slot(str)
     def slot_set_message(self, message):
         self.write_message(message)
 
+    @Slot(object)
+    def slot_store_custom_bitmap(self, data):
+        char_bank, rows = data
+        self.store_custom_bitmap(char_bank, rows)
+
     @Slot(int)
     def slot_set_cursor(self, value):
         col, row = get_col_row_from_value(value)
@@ -393,6 +538,7 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
     send_viewport_corner = Signal(int)
 
     @Slot(int)
+    @replies_on_error
     def slot_get_viewport_corner(self, data):
         self.send_viewport_corner.emit(data)
 
@@ -427,18 +573,34 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
     send_switch = Signal(int)
 
     @Slot(int)
+    @replies_on_error
     def slot_get_switch(self, switch_num):
         self.send_switch.emit(1 if self.switch_state[switch_num] else 0)
 
-    @Slot(int)
-    def set_switch_enable(self, switch_num):
-        # print("emulator: checking switch", switch_num)
-        self.switch_buttons[switch_num].setChecked(True)
+    send_switch_port = Signal(int)
 
     @Slot(int)
-    def set_switch_disable(self, switch_num):
-        # print("emulator: unchecking switch", switch_num)
-        self.switch_buttons[switch_num].setChecked(False)
+    @replies_on_error
+    def slot_get_switch_port(self, data):
+        self.send_switch_port.emit(get_switch_port_value(self.switch_state))
+
+    def set_switches(self, switch_bits):
+        """Sets every switch at once, bit n is switch n. Only used to
+        start from a real board's switches, after that only the switches
+        which change are set (see :meth:`slot_switches_changed`).
+        """
+        for switch_num, button in enumerate(self.switch_buttons):
+            button.setChecked(bool(switch_bits & (1 << switch_num)))
+        self.set_switch_bits(switch_bits)
+
+    @Slot(int, int)
+    def slot_switches_changed(self, changed, switch_bits):
+        """Sets the switches in changed to their bits in switch_bits."""
+        for switch_num, button in enumerate(self.switch_buttons):
+            if changed & (1 << switch_num):
+                button.setChecked(bool(switch_bits & (1 << switch_num)))
+        self.set_switch_bits(
+            (self._switch_bits & ~changed) | (switch_bits & changed))
 
     @Slot(int)
     def slot_move_left(self, data):
@@ -451,11 +613,19 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
     send_cursor = Signal(int)
 
     @Slot(int)
+    @replies_on_error
     def slot_get_cursor(self, data):
         col, row = self.get_cursor()
         value = get_value_from_col_row(col, row)
         self.send_cursor.emit(value)
 
+    send_state = Signal(object)
+
+    @Slot(int)
+    @replies_on_error
+    def slot_get_state(self, data):
+        self.send_state.emit(self.state)
+
     @Slot(int)
     def slot_home(self, data):
         self.home()
@@ -468,17 +638,93 @@ class PiFaceCADEmulatorWindow(QMainWindow, Ui_pifaceCADEmulatorWindow):
     def slot_see_cursor(self, data):
         self.see_cursor()
 
+    @Slot(object, object)
+    def slot_applied(self, messages_applied, messages_dropped):
+        self.messages_applied = messages_applied
+        self.messages_dropped = messages_dropped
+        self.publish_state()
+
+    send_sync = Signal(object)
+    # sent in place of a reply by a query slot which failed
+    send_error = Signal(str)
+    message_handled = Signal()
+
+    @Slot(object, object)
+    @replies_on_error
+    def slot_sync(self, messages_applied, messages_dropped):
+        self.slot_applied(messages_applied, messages_dropped)
+        self.send_sync.emit(messages_applied)
+
+    @Slot()
+    def slot_handled(self):
+        """Lets the message handler pass on another message."""
+        self.message_handled.emit()
+
+    @Slot(int)
+    def slot_subscribe_switch_events(self, value):
+        self.switch_events_subscribed = value == 1
+        # lets the application know that no more events will be sent
+        self.events_pipe.send(('subscribe', value))
+
+    @Slot(int)
+    def slot_subscribe_ir_events(self, value):
+        self.ir_events_subscribed = value == 1
+        self.events_pipe.send(('subscribe', value))
+
+    @Slot(str)
+    def slot_inject_ir(self, ir_code):
+        self.send_ir_code(ir_code)
+
+    @Slot(object)
+    def slot_inject_switch(self, data):
+        """Presses or releases a switch as if it had been clicked."""
+        switch_num, pressed = data
+        self.set_switch(switch_num, bool(pressed))
+
+    @Slot(object)
+    def slot_batch(self, actions):
+        """Applies a list of (task, data) actions as one display update."""
+        for task, data in actions:
+            getattr(self, 'slot_' + task)(data)
+
 
 def run_emulator(
         sysargv,
         cad,
         proc_comms_q_to_em,
-        proc_comms_q_from_em,
-        emulator_sync):
+        proc_comms_pipe_from_em,
+        events_pipe,
+        shared_state,
+        emulator_sync,
+        coalesce=False,
+        max_fps=None,
+        socket_path=None,
+        switch_debounce=None):
     app = QApplication(sysargv)
 
+    hub = None
+    if socket_path is not None:
+        # share the emulator between the parent process (if there is one)
+        # and socket clients
+        hub = TransportHub()
+        if proc_comms_q_to_em is not None:
+            hub.add_connection(ParentConnection(
+                hub, proc_comms_q_to_em, proc_comms_pipe_from_em,
+                events_pipe))
+        hub.listen(socket_path)
+        proc_comms_q_to_em = hub
+        proc_comms_pipe_from_em = hub.replies
+        events_pipe = hub.events
+
     emu_window = PiFaceCADEmulatorWindow()
+    if max_fps is not None:
+        emu_window.max_fps = max_fps
     emu_window.cad = cad
+    if cad is not None:
+        emu_window.hardware_mirror = HardwareMirror(cad)
+        app.aboutToQuit.connect(emu_window.hardware_mirror.close)
+    emu_window.shared_state = shared_state
+    emu_window.events_pipe = events_pipe
     # now we have to set up some state so that the emulator and the cad are in
     #sync
     emu_window.display_on()
@@ -487,23 +733,63 @@ def run_emulator(
     emu_window.blink_on()
 
     start_interface_message_handler(
-        app, emu_window, proc_comms_q_to_em, proc_comms_q_from_em)
+        app, emu_window, proc_comms_q_to_em, proc_comms_pipe_from_em,
+        coalesce)
 
     # only watch switches if there is actually a piface cad attached
     if emu_window.cad is not None:
-        start_switch_watcher(app, emu_window)
-
-    start_blinker(app, emu_window)  # causing problems
+        if switch_debounce is None:
+            start_switch_watcher(app, emu_window)
+        else:
+            start_switch_watcher(app, emu_window, switch_debounce)
 
     emu_window.show()
     app.exec_()
+    if hub is not None:
+        hub.close()
 
 
-def get_col_row_from_value(value):
-    row = int(value / LCD_ROW_WIDTH)
-    col = value - (LCD_ROW_WIDTH * row)
-    return col, row
-
+def run_emulator_server(
+        sysargv,
+        q_to_server,
+        device_ends,
+        columns,
+        coalesce=False,
+        max_fps=None):
+    """Shows every board hosted by an emulator server, tiled in one
+    window.
+    """
+    app = QApplication(sysargv)
 
-def get_value_from_col_row(col, row):
-    return col + (LCD_ROW_WIDTH * row)
+    server_window = QWidget()
+    server_window.setWindowTitle("PiFace CAD Emulator Server")
+    layout = QGridLayout(server_window)
+
+    device_queues = []
+    for device_id, ends in enumerate(device_ends):
+        pipe_from_em, events_pipe, shared_state = ends
+        emu_window = PiFaceCADEmulatorWindow()
+        # show the window as a tile inside the server window
+        emu_window.setWindowFlags(Qt.Widget)
+        emu_window.shared_state = shared_state
+        emu_window.events_pipe = events_pipe
+        if max_fps is not None:
+            emu_window.max_fps = max_fps
+        emu_window.display_on()
+        emu_window.cursor_on()
+        emu_window.backlight_off()
+        emu_window.blink_on()
+
+        device_queue = queue.Queue()
+        start_interface_message_handler(
+            app, emu_window, device_queue, pipe_from_em, coalesce)
+        layout.addWidget(emu_window, device_id // columns, device_id % columns)
+        device_queues.append(device_queue)
+
+    router = threading.Thread(target=route_server_actions,
+                              args=(q_to_server, device_queues))
+    router.daemon = True
+    router.start()
+
+    server_window.show()
+    app.exec_()
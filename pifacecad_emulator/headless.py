@@ -0,0 +1,206 @@
+import os
+from time import time
+from .lcd import (
+    LCD_LINES,
+    LCD_WIDTH,
+    LCD_ROW_WIDTH,
+    DDRAM,
+    CGRAM,
+    get_col_row_from_value,
+    get_switch_port_value,
+)
+from .state import EmulatorState
+
+
+NUM_SWITCHES = 8
+HEADLESS_ENV_VAR = "PIFACECAD_EMULATOR_HEADLESS"
+
+
+def headless_requested():
+    """Returns True if the headless backend has been selected with the
+    PIFACECAD_EMULATOR_HEADLESS environment variable.
+    """
+    value = os.environ.get(HEADLESS_ENV_VAR, "")
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class HeadlessEmulator(object):
+    """An in-memory model of the PiFace CAD which answers the same actions
+    as the emulator window, without Qt and without another process.
+    """
+    def __init__(self):
+        self.switch_state = [False for i in range(NUM_SWITCHES)]
+        self.display_enabled = True
+        self.cursor_enabled = True
+        self.blink_enabled = True
+        self.backlight_enabled = False
+        self.ddram = DDRAM()
+        self.cgram = CGRAM()
+        self.viewport_corner = 0
+
+        # switch callbacks are called with (switch_num, pressed, timestamp)
+        # and IR callbacks with (ir_code, timestamp)
+        self.event_callbacks = {'switch': [], 'ir': []}
+
+        self.handlers = {
+            'set_message': self.write_message,
+            'set_cursor': self.set_cursor_value,
+            'set_viewport_corner': self.set_viewport_corner,
+            'set_display_enable': self.set_display_enable,
+            'set_backlight_enable': self.set_backlight_enable,
+            'set_cursor_enable': self.set_cursor_enable,
+            'set_blink_enable': self.set_blink_enable,
+            'get_switch': self.get_switch,
+            'get_switch_port': self.get_switch_port,
+            'get_cursor': self.get_cursor,
+            'get_viewport_corner': self.get_viewport_corner,
+            'get_state': self.get_state,
+            'move_left': self.move_left,
+            'move_right': self.move_right,
+            'home': self.home,
+            'clear': self.clear,
+            'see_cursor': self.see_cursor,
+            'store_custom_bitmap': self.store_custom_bitmap,
+            'subscribe_switch_events': self.subscribe_events,
+            'subscribe_ir_events': self.subscribe_events,
+            'inject_ir': self.send_ir_code,
+            'inject_switch': self.inject_switch,
+            'batch': self.batch,
+        }
+
+    def handle(self, action):
+        """Applies a (task, data) action and returns the reply, if any."""
+        task = action[0]
+        if task == 'quit':
+            return None
+        try:
+            data = action[1]
+        except IndexError:
+            data = None
+        return self.handlers[task](data)
+
+    def batch(self, actions):
+        for action in actions:
+            self.handle(action)
+
+    # display memory
+    def clear(self, data=None):
+        self.ddram.clear()
+        self.viewport_corner = 0
+
+    def home(self, data=None):
+        self.viewport_corner = 0
+        self.ddram.set_cursor(0, 0)
+
+    def write_message(self, message):
+        self.ddram.write(message)
+
+    def store_custom_bitmap(self, data):
+        char_bank, rows = data
+        self.cgram.store(char_bank, rows)
+
+    @property
+    def cursor_position(self):
+        return self.ddram.cursor
+
+    @property
+    def state(self):
+        """The current :class:`EmulatorState`."""
+        return EmulatorState(switches=self.get_switch_port(),
+                             cursor=self.cursor_position,
+                             viewport_corner=self.viewport_corner,
+                             display_enabled=self.display_enabled,
+                             cursor_enabled=self.cursor_enabled,
+                             blink_enabled=self.blink_enabled,
+                             backlight_enabled=self.backlight_enabled,
+                             ddram=self.ddram.to_bytes(),
+                             cgram=self.cgram.to_bytes())
+
+    def get_state(self, data=None):
+        return self.state
+
+    @property
+    def visible_lines(self):
+        """The text currently inside the 16 character viewport."""
+        return [self.ddram.get_visible_line(row, self.viewport_corner)
+                for row in range(LCD_LINES)]
+
+    # cursor and viewport
+    def set_cursor(self, col, row):
+        self.ddram.set_cursor(col, row % LCD_LINES)
+
+    def set_cursor_value(self, value):
+        self.set_cursor(*get_col_row_from_value(value))
+
+    def get_cursor(self, data=None):
+        return self.cursor_position
+
+    def set_viewport_corner(self, value):
+        self.viewport_corner = value % LCD_ROW_WIDTH
+
+    def get_viewport_corner(self, data=None):
+        return self.viewport_corner
+
+    def move_left(self, data=None):
+        self.set_viewport_corner(self.viewport_corner - 1)
+
+    def move_right(self, data=None):
+        self.set_viewport_corner(self.viewport_corner + 1)
+
+    def cursor_is_on_screen(self):
+        col, row = self.cursor_position
+        offset = (col - self.viewport_corner) % LCD_ROW_WIDTH
+        return offset < LCD_WIDTH
+
+    def see_cursor(self, data=None):
+        if not self.cursor_is_on_screen():
+            col, row = self.cursor_position
+            if col >= self.viewport_corner + LCD_WIDTH:
+                self.set_viewport_corner(col - (LCD_WIDTH - 1))
+            else:
+                self.set_viewport_corner(col)
+
+    # flags
+    def set_display_enable(self, value):
+        self.display_enabled = value == 1
+
+    def set_backlight_enable(self, value):
+        self.backlight_enabled = value == 1
+
+    def set_cursor_enable(self, value):
+        self.cursor_enabled = value == 1
+
+    def set_blink_enable(self, value):
+        self.blink_enabled = value == 1
+
+    # switches
+    def get_switch(self, switch_num):
+        return 1 if self.switch_state[switch_num] else 0
+
+    def get_switch_port(self, data=None):
+        return get_switch_port_value(self.switch_state)
+
+    def set_switch(self, switch_num, pressed):
+        """Presses (True) or releases (False) an emulated switch."""
+        pressed = bool(pressed)
+        if self.switch_state[switch_num] == pressed:
+            return
+        self.switch_state[switch_num] = pressed
+        timestamp = time()
+        for callback in self.event_callbacks['switch']:
+            callback(switch_num, pressed, timestamp)
+
+    def inject_switch(self, data):
+        switch_num, pressed = data
+        self.set_switch(switch_num, pressed)
+
+    # IR
+    def send_ir_code(self, ir_code):
+        """Sends an IR code to the IR callbacks."""
+        timestamp = time()
+        for callback in self.event_callbacks['ir']:
+            callback(ir_code, timestamp)
+
+    def subscribe_events(self, value):
+        # callbacks are called directly, there is no events pipe to enable
+        pass
@@ -0,0 +1,210 @@
+import os
+import queue
+import socket
+import threading
+from time import time, monotonic, sleep
+import pifacecommon.interrupts
+
+
+# largest datagram read from the IR socket
+IR_SOCKET_BUFFER_SIZE = 4096
+
+
+class IRFunctionMap(pifacecommon.interrupts.FunctionMap):
+    """Maps an IR code to callback function."""
+    def __init__(self, ir_code, callback):
+        self.ir_code = ir_code
+        super(IRFunctionMap, self).__init__(callback)
+
+
+class IREvent(object):
+    """An IR event."""
+    def __init__(self, ir_code, timestamp=None):
+        self.ir_code = ir_code
+        self.timestamp = time() if timestamp is None else timestamp
+
+
+class IREventListener(object):
+    """Listens for emulated IR events and calls the registered functions,
+    just like pifacecad.IREventListener.
+
+    There is no lircd in the emulator. IR codes come from:
+
+    - the emulator window, if ``chip`` is an emulated :class:`PiFaceCAD`
+    - datagrams sent to the Unix socket at ``socket_path``, see
+      :func:`send_ir_code`
+    - :meth:`inject` and :meth:`replay`, for recorded IR scripts
+
+    >>> def print_ir_code(event):
+    ...     print(event.ir_code)
+    ...
+    >>> listener = pifacecad_emulator.IREventListener(prog="myprog",
+    ...                                               chip=cad)
+    >>> listener.register('one', print_ir_code)
+    >>> listener.activate()
+
+    :param prog: The lirc program name. Accepted for compatibility.
+    :type prog: str
+    :param lircrc: The lircrc file. Accepted for compatibility.
+    :type lircrc: str
+    :param chip: An emulated PiFace CAD to receive IR codes from.
+    :type chip: :class:`PiFaceCAD`
+    :param socket_path: Listen for IR codes on a Unix datagram socket.
+    :type socket_path: str
+    """
+
+    TERMINATE_SIGNAL = "astalavista"
+
+    def __init__(self, prog=None, lircrc=None, chip=None, socket_path=None,
+                 daemon=False):
+        self.prog = prog
+        self.lircrc = lircrc
+        self.chip = chip
+        self.socket_path = socket_path
+        self.socket = None
+        self.ir_function_maps = list()
+        self.event_queue = queue.Queue()
+        self.dispatcher = threading.Thread(
+            target=pifacecommon.interrupts.handle_events,
+            args=(
+                self.ir_function_maps,
+                self.event_queue,
+                _event_matches_ir_function_map,
+                IREventListener.TERMINATE_SIGNAL))
+        self.dispatcher.daemon = daemon
+        self.detector = None
+        self.daemon = daemon
+
+    def register(self, ir_code, callback):
+        """Registers an IR code to a callback function.
+
+        :param ir_code: The IR code.
+        :type ir_code: str
+        :param callback: The function to run when event is detected.
+        :type callback: function
+        """
+        self.ir_function_maps.append(IRFunctionMap(ir_code, callback))
+
+    def activate(self):
+        """When activated the :class:`IREventListener` will run callbacks
+        associated with IR codes.
+        """
+        if self.chip is not None:
+            self.chip.add_ir_event_callback(self.inject)
+        if self.socket_path is not None:
+            self.socket = bind_ir_socket(self.socket_path)
+            self.detector = threading.Thread(target=self.watch_ir_socket)
+            self.detector.daemon = self.daemon
+            self.detector.start()
+        self.dispatcher.start()
+
+    def deactivate(self):
+        """When deactivated the :class:`IREventListener` will not run
+        anything.
+        """
+        if self.chip is not None:
+            self.chip.remove_ir_event_callback(self.inject)
+        if self.socket is not None:
+            # an empty datagram stops the detector
+            send_ir_code(self.socket_path, "")
+            self.detector.join()
+            self.socket.close()
+            os.unlink(self.socket_path)
+            self.socket = None
+        self.event_queue.put(self.TERMINATE_SIGNAL)
+        self.dispatcher.join()
+
+    def inject(self, ir_code, timestamp=None):
+        """Queues an IR event as if it had been received by lircd."""
+        self.event_queue.put(IREvent(ir_code, timestamp))
+
+    def replay(self, script, realtime=False):
+        """Injects the IR codes in a recorded script, see
+        :func:`read_ir_script`.
+
+        :param script: The path to the script.
+        :type script: str
+        :param realtime: Wait until each code's time offset before injecting
+            it, otherwise inject them as fast as possible.
+        :type realtime: bool
+        """
+        start = monotonic()
+        for offset, ir_code in read_ir_script(script):
+            if realtime:
+                delay = start + offset - monotonic()
+                if delay > 0:
+                    sleep(delay)
+            self.inject(ir_code)
+
+    def watch_ir_socket(self):
+        while True:
+            try:
+                datagram = self.socket.recv(IR_SOCKET_BUFFER_SIZE)
+            except OSError:
+                return
+            if not datagram:
+                return
+            try:
+                text = datagram.decode('utf-8')
+            except UnicodeDecodeError:
+                # not from lircd or send_ir_code, keep listening
+                continue
+            for line in text.splitlines():
+                ir_code = parse_ir_line(line)
+                if ir_code:
+                    self.inject(ir_code)
+
+
+def _event_matches_ir_function_map(event, function_map):
+    return event.ir_code == function_map.ir_code
+
+
+def parse_ir_line(line):
+    """Returns the IR code in a line. The line is either just the code or a
+    line in the format lircd broadcasts, in which case the button name is
+    the code::
+
+        0000000000f40bf0 00 KEY_UP myremote
+    """
+    fields = line.split()
+    if len(fields) == 4:
+        return fields[2]
+    return line.strip()
+
+
+def read_ir_script(script):
+    """Returns a list of (time offset, IR code) tuples from a script. Each
+    line of a script is the time offset in seconds from the start of the
+    script followed by the IR code. Blank lines and lines starting with #
+    are ignored::
+
+        # offset code
+        0.0 one
+        0.5 two
+    """
+    events = []
+    with open(script) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            offset, ir_code = line.split(None, 1)
+            events.append((float(offset), ir_code))
+    return events
+
+
+def bind_ir_socket(socket_path):
+    ir_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    ir_socket.bind(socket_path)
+    return ir_socket
+
+
+def send_ir_code(socket_path, ir_code):
+    """Sends an IR code to an :class:`IREventListener` listening on
+    socket_path, from any process.
+    """
+    ir_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        ir_socket.sendto(ir_code.encode('utf-8'), socket_path)
+    finally:
+        ir_socket.close()
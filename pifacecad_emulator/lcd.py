@@ -0,0 +1,144 @@
+# LCD geometry and switch helpers shared by the emulator window and the
+# headless model, kept free of Qt so that they can be imported without a
+# display.
+LCD_LINES = 2
+LCD_WIDTH = 16
+LCD_RAM_WIDTH = 80
+LCD_ROW_WIDTH = int(80 / 2)
+
+# characters are stored in DDRAM as one byte each
+DDRAM_ENCODING = "latin-1"
+BLANK_DDRAM = b" " * LCD_RAM_WIDTH
+
+# a blinking cursor alternates between a black block and the character
+# under it every 409.6 ms (HD44780 with a 250 kHz oscillator)
+BLINK_INTERVAL = 0.4096
+
+# character codes 0 to 7 are drawn from the eight 5x8 custom bitmaps in
+# CGRAM, one byte a row with the leftmost dot in bit 4
+MAX_CUSTOM_BITMAPS = 8
+CUSTOM_BITMAP_ROWS = 8
+CUSTOM_BITMAP_COLUMNS = 5
+CUSTOM_BITMAP_MASK = 0x1f
+
+
+def get_col_row_from_value(value):
+    row = int(value / LCD_ROW_WIDTH)
+    col = value - (LCD_ROW_WIDTH * row)
+    return col, row
+
+
+def get_value_from_col_row(col, row):
+    return col + (LCD_ROW_WIDTH * row)
+
+
+def get_custom_bitmap_rows(bitmap):
+    """Returns the CUSTOM_BITMAP_ROWS rows of a bitmap as bytes. Missing
+    rows are blank, extra rows are ignored.
+    """
+    rows = bytes(row & CUSTOM_BITMAP_MASK
+                 for row in bitmap[:CUSTOM_BITMAP_ROWS])
+    return rows.ljust(CUSTOM_BITMAP_ROWS, b"\x00")
+
+
+def get_switch_port_value(switch_state):
+    """Returns the switch states as a bitmask, bit n is switch n."""
+    value = 0
+    for i, pressed in enumerate(switch_state):
+        if pressed:
+            value |= 1 << i
+    return value
+
+
+def get_visible_line(cells, row, viewport_corner):
+    """Returns the LCD_WIDTH characters of a row of DDRAM cells which are
+    shown with the viewport at viewport_corner.
+    """
+    row_start = row * LCD_ROW_WIDTH
+    start = row_start + viewport_corner
+    end = start + LCD_WIDTH
+    row_end = row_start + LCD_ROW_WIDTH
+    if end <= row_end:
+        line = cells[start:end]
+    else:
+        # the viewport wraps around the end of the row
+        line = cells[start:row_end] + cells[row_start:end - LCD_ROW_WIDTH]
+    return line.decode(DDRAM_ENCODING)
+
+
+class DDRAM(object):
+    """The display data RAM of the HD44780: 80 character cells, the first
+    40 are the top row and the rest the bottom row. Writes go to the cell
+    at the address counter, which increments after each character and
+    wraps from the end of one row onto the start of the other.
+    """
+    def __init__(self):
+        self.cells = bytearray(BLANK_DDRAM)
+        self.address = 0
+
+    def clear(self):
+        self.cells[:] = BLANK_DDRAM
+        self.address = 0
+
+    @property
+    def cursor(self):
+        """The address counter as (col, row)."""
+        return get_col_row_from_value(self.address)
+
+    def set_cursor(self, col, row):
+        self.address = get_value_from_col_row(col, row) % LCD_RAM_WIDTH
+
+    def write(self, text):
+        """Writes text from the address counter. A new line moves the
+        address counter to the start of the bottom row.
+        """
+        for i, line in enumerate(text.split("\n")):
+            if i > 0:
+                self.address = LCD_ROW_WIDTH
+            self.write_bytes(line.encode(DDRAM_ENCODING, "replace"))
+
+    def write_bytes(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            count = min(len(view), LCD_RAM_WIDTH - self.address)
+            self.cells[self.address:self.address+count] = view[:count]
+            self.address = (self.address + count) % LCD_RAM_WIDTH
+            view = view[count:]
+
+    def get_visible_line(self, row, viewport_corner):
+        """Returns the LCD_WIDTH characters of a row which are shown with
+        the viewport at viewport_corner.
+        """
+        return get_visible_line(self.cells, row, viewport_corner)
+
+    def to_bytes(self):
+        return bytes(self.cells)
+
+
+class LCDBitmap(bytearray):
+    """A custom bitmap for the LCD, one byte a row. Works like
+    pifacecad.LCDBitmap.
+    """
+    def __init__(self, lines=list()):
+        super(LCDBitmap, self).__init__(lines)
+
+
+class CGRAM(object):
+    """The character generator RAM of the HD44780: MAX_CUSTOM_BITMAPS banks
+    of CUSTOM_BITMAP_ROWS rows each.
+    """
+    def __init__(self):
+        self.cells = bytearray(MAX_CUSTOM_BITMAPS * CUSTOM_BITMAP_ROWS)
+
+    def store(self, char_bank, rows):
+        """Stores the rows (see get_custom_bitmap_rows) of a bank."""
+        start = char_bank * CUSTOM_BITMAP_ROWS
+        self.cells[start:start+CUSTOM_BITMAP_ROWS] = rows
+
+    def get_bitmap(self, char_bank):
+        """Returns the rows of a bank as bytes."""
+        start = char_bank * CUSTOM_BITMAP_ROWS
+        return bytes(self.cells[start:start+CUSTOM_BITMAP_ROWS])
+
+    def to_bytes(self):
+        return bytes(self.cells)
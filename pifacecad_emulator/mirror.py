@@ -0,0 +1,187 @@
+# Mirroring of the emulator window's display to a real PiFace CAD. SPI
+# writes are slow, so they are made on a worker thread while the window
+# carries on with its own copy of the state. Commands which pile up while
+# the board is busy are coalesced (see coalesce.py) so that the board
+# catches up with the latest state instead of replaying every step.
+import threading
+from collections import deque
+from time import monotonic
+from .lcd import get_col_row_from_value
+from .coalesce import coalesce_actions
+
+
+# the most waiting commands coalesced into one update of the board
+MIRROR_MAX_COMMANDS = 1000
+# the most commands left waiting for the board. past this they are
+# coalesced and, if that doesn't free half of them, the oldest are lost
+MIRROR_MAX_PENDING = 10 * MIRROR_MAX_COMMANDS
+# how long, in seconds, close waits for the board to catch up
+MIRROR_CLOSE_TIMEOUT = 5
+
+
+class HardwareMirror(object):
+    """Applies (task, data) display commands to a real PiFace CAD on a
+    worker thread, in order. Nothing is read back from the board.
+
+    :param cad: The board.
+    :type cad: :class:`pifacecad.PiFaceCAD`
+    """
+    def __init__(self, cad):
+        self.lcd = cad.lcd
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.closing = False
+        # when the commands being applied were queued, see lag
+        self._applying_since = None
+
+        self.commands_queued = 0
+        self.commands_applied = 0
+        # overwritten by later commands before the board got them
+        self.commands_dropped = 0
+        # thrown away because too many were waiting, the board may not
+        # match the window until it is cleared
+        self.commands_lost = 0
+        # failed on the board
+        self.errors = 0
+        self.max_lag = 0
+
+        self.handlers = {
+            'set_message': self.lcd.write,
+            'set_cursor': self.set_cursor_value,
+            'set_viewport_corner': self.set_viewport_corner,
+            'set_display_enable': self.set_display_enable,
+            'set_backlight_enable': self.set_backlight_enable,
+            'set_cursor_enable': self.set_cursor_enable,
+            'set_blink_enable': self.set_blink_enable,
+            'home': self.home,
+            'clear': self.clear,
+            'store_custom_bitmap': self.store_custom_bitmap,
+        }
+
+        self.worker = threading.Thread(target=self.run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def put(self, action):
+        """Queues a (task, data) command for the board."""
+        with self.condition:
+            self.pending.append((monotonic(), action))
+            self.commands_queued += 1
+            if len(self.pending) > MIRROR_MAX_PENDING:
+                self.shrink_pending()
+            self.condition.notify_all()
+
+    def shrink_pending(self):
+        # the condition must be held. the coalesced commands are all given
+        # the oldest time, so lag is never understated
+        queued_at = self.pending[0][0]
+        actions, dropped = coalesce_actions(
+            [action for _, action in self.pending])
+        self.commands_dropped += dropped
+        lost = max(0, len(actions) - MIRROR_MAX_PENDING // 2)
+        self.commands_lost += lost
+        self.pending = deque((queued_at, action)
+                             for action in actions[lost:])
+
+    @property
+    def lag(self):
+        """How long, in seconds, the oldest command which hasn't reached
+        the board has been waiting.
+        """
+        with self.condition:
+            queued_at = self._applying_since
+            if queued_at is None and self.pending:
+                queued_at = self.pending[0][0]
+        if queued_at is None:
+            return 0
+        return monotonic() - queued_at
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                queued_at = self.pending[0][0]
+                count = min(len(self.pending), MIRROR_MAX_COMMANDS)
+                actions = [self.pending.popleft()[1] for i in range(count)]
+                self._applying_since = queued_at
+            actions, dropped = coalesce_actions(actions)
+            for action in actions:
+                self.apply(action)
+            with self.condition:
+                self.commands_applied += len(actions)
+                self.commands_dropped += dropped
+                self.max_lag = max(self.max_lag, monotonic() - queued_at)
+                self._applying_since = None
+                self.condition.notify_all()
+
+    def apply(self, action):
+        task, data = action
+        try:
+            self.handlers[task](data)
+        except Exception:
+            # the window is still right, the board missed one command.
+            # anything raised here would kill the worker and the board
+            # would never be updated again
+            self.errors += 1
+
+    def flush(self, timeout=None):
+        """Waits for the board to catch up. Returns False if it hadn't
+        after timeout seconds.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.pending and self._applying_since is None,
+                timeout)
+
+    def close(self, timeout=MIRROR_CLOSE_TIMEOUT):
+        """Stops the worker once the board has caught up, or after
+        timeout seconds.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.worker.join(timeout)
+
+    # board commands
+    def set_cursor_value(self, value):
+        self.lcd.set_cursor(*get_col_row_from_value(value))
+
+    def set_viewport_corner(self, value):
+        self.lcd.viewport_corner = value
+
+    def set_display_enable(self, value):
+        if value == 1:
+            self.lcd.display_on()
+        else:
+            self.lcd.display_off()
+
+    def set_backlight_enable(self, value):
+        if value == 1:
+            self.lcd.backlight_on()
+        else:
+            self.lcd.backlight_off()
+
+    def set_cursor_enable(self, value):
+        if value == 1:
+            self.lcd.cursor_on()
+        else:
+            self.lcd.cursor_off()
+
+    def set_blink_enable(self, value):
+        if value == 1:
+            self.lcd.blink_on()
+        else:
+            self.lcd.blink_off()
+
+    def home(self, data=None):
+        self.lcd.home()
+
+    def clear(self, data=None):
+        self.lcd.clear()
+
+    def store_custom_bitmap(self, data):
+        char_bank, rows = data
+        self.lcd.store_custom_bitmap(char_bank, rows)
@@ -0,0 +1,300 @@
+"""The binary format of the commands sent to the emulator.
+
+Every message starts with the protocol version (one byte, currently 1)
+followed by one action. An action is a one byte opcode followed by its
+argument, if it has one. Integers are little endian and strings are a
+4 byte length followed by UTF-8::
+
+    opcode  task                      argument
+    0x01    set_message               string
+    0x02    set_cursor                int32, col + 40 * row
+    0x03    set_viewport_corner       int32
+    0x04    set_display_enable        uint8, 0 or 1
+    0x05    set_backlight_enable      uint8, 0 or 1
+    0x06    set_cursor_enable         uint8, 0 or 1
+    0x07    set_blink_enable          uint8, 0 or 1
+    0x08    move_left
+    0x09    move_right
+    0x0a    home
+    0x0b    clear
+    0x0c    see_cursor
+    0x0d    store_custom_bitmap       uint8 bank, then 8 bytes of rows
+    0x10    get_switch                uint8, switch number
+    0x11    get_switch_port
+    0x12    get_cursor
+    0x13    get_viewport_corner
+    0x14    get_state
+    0x20    subscribe_switch_events   uint8, 0 or 1
+    0x21    subscribe_ir_events       uint8, 0 or 1
+    0x22    inject_ir                 string
+    0x23    inject_switch             uint8 switch number, then uint8 1 for
+                                      pressed or 0 for released
+    0x30    batch                     uint32 count, then count actions
+    0x3e    sync
+    0x3f    quit
+
+For example, ``set_cursor(3, 1)`` is ``01 02 2b 00 00 00``.
+
+Inside the emulator actions are (task, data) tuples. Actions without an
+argument decode with data 0, except quit which decodes as ('quit',).
+store_custom_bitmap decodes with data (bank, rows) and inject_switch with
+data (switch number, pressed).
+"""
+import queue
+import struct
+import threading
+from collections import deque
+from multiprocessing import Queue
+from .coalesce import is_coalescable
+
+
+PROTOCOL_VERSION = 1
+
+BYTE = struct.Struct("<B")
+INT = struct.Struct("<i")
+LENGTH = struct.Struct("<I")
+CUSTOM_BITMAP = struct.Struct("<B8s")
+SWITCH = struct.Struct("<BB")
+
+# what ActionQueue.put does when the queue is full
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+ERROR = 'error'
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, ERROR)
+
+# argument types which aren't a single struct
+STRING = 'string'
+BATCH = 'batch'
+
+# task: (opcode, argument)
+OPCODES = {
+    'set_message': (0x01, STRING),
+    'set_cursor': (0x02, INT),
+    'set_viewport_corner': (0x03, INT),
+    'set_display_enable': (0x04, BYTE),
+    'set_backlight_enable': (0x05, BYTE),
+    'set_cursor_enable': (0x06, BYTE),
+    'set_blink_enable': (0x07, BYTE),
+    'move_left': (0x08, None),
+    'move_right': (0x09, None),
+    'home': (0x0a, None),
+    'clear': (0x0b, None),
+    'see_cursor': (0x0c, None),
+    'store_custom_bitmap': (0x0d, CUSTOM_BITMAP),
+    'get_switch': (0x10, BYTE),
+    'get_switch_port': (0x11, None),
+    'get_cursor': (0x12, None),
+    'get_viewport_corner': (0x13, None),
+    'get_state': (0x14, None),
+    'subscribe_switch_events': (0x20, BYTE),
+    'subscribe_ir_events': (0x21, BYTE),
+    'inject_ir': (0x22, STRING),
+    'inject_switch': (0x23, SWITCH),
+    'batch': (0x30, BATCH),
+    'sync': (0x3e, None),
+    'quit': (0x3f, None),
+}
+# opcode: (task, argument)
+TASKS = {opcode: (task, argument)
+         for task, (opcode, argument) in OPCODES.items()}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class QueryError(Exception):
+    """A query which the emulator couldn't answer. It is sent back in place
+    of the reply, so that the application isn't left waiting.
+    """
+    pass
+
+
+def encode_action(action):
+    """Returns a (task, data) action as a message."""
+    message = bytearray(BYTE.pack(PROTOCOL_VERSION))
+    _encode_action(action, message)
+    return bytes(message)
+
+
+def _encode_action(action, message):
+    task = action[0]
+    try:
+        opcode, argument = OPCODES[task]
+    except KeyError:
+        raise ProtocolError("Unknown task {!r}.".format(task))
+    message.append(opcode)
+    if argument is None:
+        return
+    data = action[1]
+    if argument is STRING:
+        data = data.encode('utf-8')
+        message += LENGTH.pack(len(data))
+        message += data
+    elif argument is BATCH:
+        message += LENGTH.pack(len(data))
+        for batched_action in data:
+            _encode_action(batched_action, message)
+    elif isinstance(data, tuple):
+        message += argument.pack(*data)
+    else:
+        message += argument.pack(data)
+
+
+def decode_action(message):
+    """Returns the (task, data) action in a message."""
+    try:
+        version = message[0]
+        if version != PROTOCOL_VERSION:
+            raise ProtocolError(
+                "Unsupported protocol version {}.".format(version))
+        action, offset = _decode_action(message, 1)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ProtocolError("Malformed message: {}".format(e))
+    if offset != len(message):
+        raise ProtocolError(
+            "Malformed message: {} bytes after the action.".format(
+                len(message) - offset))
+    return action
+
+
+def _decode_action(message, offset):
+    opcode = message[offset]
+    offset += 1
+    try:
+        task, argument = TASKS[opcode]
+    except KeyError:
+        raise ProtocolError("Unknown opcode {:#04x}.".format(opcode))
+    if argument is None:
+        if task == 'quit':
+            return (task,), offset
+        return (task, 0), offset
+    elif argument is STRING:
+        length = LENGTH.unpack_from(message, offset)[0]
+        offset += LENGTH.size
+        if offset + length > len(message):
+            raise IndexError("string runs past the end of the message")
+        data = bytes(message[offset:offset+length]).decode('utf-8')
+        return (task, data), offset + length
+    elif argument is BATCH:
+        count = LENGTH.unpack_from(message, offset)[0]
+        offset += LENGTH.size
+        actions = []
+        for i in range(count):
+            batched_action, offset = _decode_action(message, offset)
+            actions.append(batched_action)
+        return (task, actions), offset
+    else:
+        data = argument.unpack_from(message, offset)
+        if len(data) == 1:
+            data = data[0]
+        return (task, data), offset + argument.size
+
+
+class ActionQueue(object):
+    """A multiprocessing queue which carries (task, data) actions as
+    messages rather than pickled tuples.
+
+    :param maxsize: The most messages which can be waiting for the
+        emulator, or 0 for no limit.
+    :type maxsize: int
+    :param overflow: What :meth:`put` does when the queue is full: BLOCK
+        waits for the emulator to catch up, ERROR raises queue.Full (after
+        the timeout, if :meth:`put` is given one) and DROP_OLDEST drops
+        the oldest waiting message if it is a display command and
+        otherwise blocks. Nothing is ever reordered.
+    :type overflow: str
+    """
+    def __init__(self, maxsize=0, overflow=BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "overflow must be one of {}.".format(OVERFLOW_POLICIES))
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropping = overflow == DROP_OLDEST and maxsize > 0
+        if self.dropping:
+            # messages wait in the sending process, where display commands
+            # can be dropped without taking them off the emulator's queue,
+            # and are fed to the emulator one at a time (so up to two more
+            # than maxsize can be on their way)
+            self.queue = Queue(1)
+        else:
+            self.queue = Queue(maxsize)
+        self.messages_dropped = 0
+        self._init_sender()
+
+    def _init_sender(self):
+        # (message, coalescable) waiting to be fed to the emulator
+        self._waiting = deque()
+        self._condition = threading.Condition()
+        self._feeder = None
+
+    def __getstate__(self):
+        # the sending side stays in the sending process
+        state = self.__dict__.copy()
+        for name in ('_waiting', '_condition', '_feeder'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_sender()
+
+    def put(self, action, timeout=None):
+        """Queues an action and returns the number of display commands
+        which were dropped to make room for it.
+
+        :param timeout: The most seconds to block for, after which
+            queue.Full is raised. Blocks until there is room by default,
+            or raises queue.Full straight away with the ERROR policy.
+        :type timeout: float
+        """
+        message = encode_action(action)
+        if self.overflow == ERROR and timeout is None:
+            self.queue.put_nowait(message)
+            return 0
+        elif self.dropping:
+            return self._put_waiting(message, is_coalescable(action),
+                                     timeout)
+        self.queue.put(message, True, timeout)
+        return 0
+
+    def _put_waiting(self, message, coalescable, timeout):
+        with self._condition:
+            dropped = 0
+            if len(self._waiting) >= self.maxsize:
+                if self._waiting[0][1]:
+                    self._waiting.popleft()
+                    dropped = 1
+                elif not self._condition.wait_for(
+                        lambda: len(self._waiting) < self.maxsize, timeout):
+                    # the oldest has to reach the emulator, like BLOCK
+                    raise queue.Full
+            self._waiting.append((message, coalescable))
+            self.messages_dropped += dropped
+            if self._feeder is None:
+                self._feeder = threading.Thread(target=self._feed)
+                self._feeder.daemon = True
+                self._feeder.start()
+            self._condition.notify_all()
+        return dropped
+
+    def _feed(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._waiting)
+                message, coalescable = self._waiting.popleft()
+                self._condition.notify_all()
+            self.queue.put(message)
+
+    def get(self, timeout=None):
+        """Returns the next action. Raises queue.Empty if there isn't one
+        after timeout seconds.
+        """
+        return decode_action(self.queue.get(True, timeout))
+
+    def get_nowait(self):
+        return decode_action(self.queue.get_nowait())
+
+    def empty(self):
+        return self.queue.empty()
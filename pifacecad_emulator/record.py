@@ -0,0 +1,160 @@
+# Recording and replay of emulator sessions. A recording is an append-only
+# file of the commands sent to the emulator, the replies to queries and the
+# events pushed back to the application, each with the time since its
+# session started. Records are frames in the socket transport's format
+# (see transport.py), so commands are messages in the emulator's protocol.
+import struct
+import threading
+from time import monotonic, monotonic_ns, sleep, time
+from .protocol import PROTOCOL_VERSION, decode_action
+from .transport import (
+    encode_frame,
+    decode_value,
+    ACTION_FRAME,
+    REPLY_FRAME,
+    EVENT_FRAME,
+    REPLY_TASKS,
+)
+
+
+# a recording starts with this
+RECORDING_MAGIC = b"PFCADREC"
+# every record is the nanoseconds since its session started, then a frame,
+# so it is read back with the frame's length
+TIMESTAMP = struct.Struct("<Q")
+RECORD_HEADER = struct.Struct("<QI")
+# each session starts with one of these, the value is the recording
+# version, the protocol version and the wall clock time
+SESSION_FRAME = b's'
+RECORDING_VERSION = 1
+
+# tasks which are not sent again when replaying. Events aren't replayed so
+# nothing is subscribed to, and syncing only waits for the emulator.
+REPLAY_SKIPPED_TASKS = frozenset((
+    'sync',
+    'subscribe_switch_events',
+    'subscribe_ir_events',
+))
+
+
+class RecordingError(Exception):
+    pass
+
+
+class SessionRecorder(object):
+    """Appends the commands sent to an emulator, the replies to queries and
+    the events the emulator pushes to a file, with monotonic timestamps.
+    Records are buffered until :meth:`close`.
+
+    :param path: The recording. Sessions recorded into a file which already
+        exists are added after the ones in it.
+    :type path: str
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.start = monotonic_ns()
+        self._lock = threading.Lock()
+        with self._lock:
+            if self.file.tell() == 0:
+                self.file.write(RECORDING_MAGIC)
+            self._write(SESSION_FRAME,
+                        (RECORDING_VERSION, PROTOCOL_VERSION, time()))
+
+    def record_action(self, action):
+        """Records a (task, data) action sent to the emulator."""
+        with self._lock:
+            self._write(ACTION_FRAME, action)
+
+    def record_query(self, action, reply):
+        """Records a query and the emulator's reply."""
+        with self._lock:
+            self._write(ACTION_FRAME, action)
+            self._write(REPLY_FRAME, reply)
+
+    def record_event(self, message):
+        """Records an event pushed by the emulator, such as
+        ('switch', switch_num, pressed, timestamp).
+        """
+        with self._lock:
+            self._write(EVENT_FRAME, message)
+
+    def _write(self, kind, value):
+        if self.file.closed:
+            return
+        self.file.write(TIMESTAMP.pack(monotonic_ns() - self.start))
+        self.file.write(encode_frame(kind, value))
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+def read_recording(path):
+    """Yields the (timestamp, kind, value) records in a recording, where
+    timestamp is the seconds since the record's session started and kind
+    is SESSION_FRAME, ACTION_FRAME, REPLY_FRAME or EVENT_FRAME. A record
+    which was cut short (say by a crash) ends the recording.
+    """
+    with open(path, 'rb') as recording:
+        if recording.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise RecordingError("{} is not a recording.".format(path))
+        while True:
+            header = recording.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, length = RECORD_HEADER.unpack(header)
+            payload = recording.read(length)
+            if len(payload) < length:
+                return
+            kind = payload[:1]
+            if kind == ACTION_FRAME:
+                value = decode_action(payload[1:])
+            else:
+                value, offset = decode_value(payload, 1)
+            yield timestamp / 1e9, kind, value
+
+
+def replay(path, cad, real_time=False):
+    """Sends the commands in a recording to an emulator, as fast as possible
+    or with the gaps between them that were recorded. Queries are sent too
+    and their replies compared with the recorded ones. Events are not
+    replayed.
+
+    :param path: The recording.
+    :type path: str
+    :param cad: The emulator to replay the recording on.
+    :type cad: :class:`pifacecad_emulator.PiFaceCAD`
+    :param real_time: Wait between commands as long as was recorded.
+    :type real_time: bool
+    :returns: (action, recorded reply, reply) for each query whose reply
+        was different.
+    """
+    mismatches = []
+    query = None
+    session_start = monotonic()
+    for timestamp, kind, value in read_recording(path):
+        if kind == SESSION_FRAME:
+            session_start = monotonic()
+            continue
+        if real_time:
+            delay = session_start + timestamp - monotonic()
+            if delay > 0:
+                sleep(delay)
+        if kind == ACTION_FRAME:
+            task = value[0]
+            if task in REPLAY_SKIPPED_TASKS:
+                continue
+            elif task in REPLY_TASKS:
+                query = value, cad.get_reply(value)
+            else:
+                cad.send(value)
+        elif kind == REPLY_FRAME and query is not None:
+            action, reply = query
+            query = None
+            # named tuples such as EmulatorState are recorded as tuples,
+            # which they compare equal to
+            if reply != value:
+                mismatches.append((action, value, reply))
+    return mismatches
+
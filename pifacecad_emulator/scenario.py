@@ -0,0 +1,88 @@
+# Timed switch stimulus for testing applications against the emulator. A
+# scenario is a script of presses, releases and holds which is played
+# through :meth:`PiFaceCAD.press_switch` and friends, so applications see
+# the same switch events as they would for clicks in the emulator window.
+from time import monotonic, sleep
+
+
+# what a script line can do to a switch
+PRESS = 'press'
+RELEASE = 'release'
+HOLD = 'hold'
+
+
+def read_switch_script(script):
+    """Returns a list of (time offset, switch number, pressed) tuples from
+    a script, in time order. Each line of a script is the time offset in
+    seconds from the start of the script, the switch number and press,
+    release or hold followed by how long to hold the switch for. Blank
+    lines and lines starting with # are ignored::
+
+        # offset switch action [duration]
+        0.0 0 press
+        0.1 0 release
+        0.5 4 hold 1.5
+    """
+    events = []
+    with open(script) as f:
+        for line_num, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split()
+            offset, switch_num, action = fields[:3]
+            offset, switch_num = float(offset), int(switch_num)
+            if action == PRESS and len(fields) == 3:
+                events.append((offset, switch_num, True))
+            elif action == RELEASE and len(fields) == 3:
+                events.append((offset, switch_num, False))
+            elif action == HOLD and len(fields) == 4:
+                events.append((offset, switch_num, True))
+                events.append((offset + float(fields[3]), switch_num, False))
+            else:
+                raise ValueError(
+                    "Line {} of {} is not 'offset switch press|release' or "
+                    "'offset switch hold duration'.".format(line_num, script))
+    # sorting is stable so events at the same offset stay in script order
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def play_switch_events(cad, events, realtime=True):
+    """Presses and releases switches on an emulator. Every event which is
+    due is sent in one batch, so scripts with thousands of events a second
+    are not limited by the emulator's round trip.
+
+    :param cad: The emulator.
+    :type cad: :class:`pifacecad_emulator.PiFaceCAD`
+    :param events: (time offset, switch number, pressed) tuples in time
+        order, see :func:`read_switch_script`.
+    :type events: list
+    :param realtime: Wait until each event's time offset before sending
+        it, otherwise send them all at once.
+    :type realtime: bool
+    :returns: The number of events sent.
+    """
+    start = monotonic()
+    index = 0
+    while index < len(events):
+        if realtime:
+            delay = start + events[index][0] - monotonic()
+            if delay > 0:
+                sleep(delay)
+            now = monotonic() - start
+        else:
+            now = float('inf')
+        with cad.batch():
+            while index < len(events) and events[index][0] <= now:
+                offset, switch_num, pressed = events[index]
+                cad.set_switch(switch_num, pressed)
+                index += 1
+    return index
+
+
+def play_switch_script(cad, script, realtime=True):
+    """Plays a switch script on an emulator, see :func:`read_switch_script`
+    and :func:`play_switch_events`.
+    """
+    return play_switch_events(cad, read_switch_script(script), realtime)
@@ -0,0 +1,303 @@
+import sys
+import logging
+import weakref
+from multiprocessing import Process, Queue, Pipe
+from .headless import HeadlessEmulator, headless_requested
+from .state import SharedState
+from .transport import TransportHub, ParentConnection, REPLY_TASKS
+from .protocol import encode_action, decode_action, QueryError
+
+
+logger = logging.getLogger(__name__)
+
+
+# how many boards are shown side by side in the emulator server window
+DEFAULT_COLUMNS = 4
+
+
+class DeviceQueue(object):
+    """Sends a board's actions to the emulator server, as messages tagged
+    with the board's device id.
+    """
+    def __init__(self, q_to_server, device_id):
+        self.q_to_server = q_to_server
+        self.device_id = device_id
+
+    def put(self, action, timeout=None):
+        self.q_to_server.put((self.device_id, encode_action(action)),
+                             True, timeout)
+        return 0
+
+
+class ServerDevice(object):
+    """A board hosted by an :class:`EmulatorServer`, as seen from the
+    application. It can be used in place of an :class:`EmulatorProcess`.
+    """
+    def __init__(self, device_id, q_to_server):
+        self.device_id = device_id
+        self.process = None
+        self.q_to_em = DeviceQueue(q_to_server, device_id)
+        self.pipe_from_em, self.pipe_to_here = Pipe(duplex=False)
+        self.events, self.events_to_here = Pipe(duplex=False)
+        self.shared_state = SharedState()
+        weakref.finalize(self, self.shared_state.unlink)
+        self.messages_sent = 0
+
+    @property
+    def server_ends(self):
+        """The pipe ends and shared state used by the server process."""
+        return self.pipe_to_here, self.events_to_here, self.shared_state
+
+    def wait_until_ready(self):
+        """Blocks until the server is answering for this board."""
+        self.q_to_em.put(('sync', 0))
+        self.messages_sent += 1
+        self.pipe_from_em.recv()
+
+    def quit(self):
+        """Does nothing, boards stop with their server. See
+        :meth:`EmulatorServer.close`.
+        """
+        pass
+
+
+class EmulatorServer(object):
+    """Hosts many emulated PiFace CADs in one process, so that emulating
+    lots of boards doesn't need a Python and Qt process each. Commands from
+    every board go to the server on one queue, tagged with the board's
+    device id::
+
+        server = EmulatorServer(devices=50, headless=True)
+        cads = [PiFaceCAD(pool=server) for i in range(50)]
+
+    :param devices: The number of boards.
+    :type devices: int
+    :param headless: Host :class:`HeadlessEmulator` boards instead of
+        showing them tiled in one window. Defaults to the value of the
+        PIFACECAD_EMULATOR_HEADLESS environment variable.
+    :type headless: bool
+    :param columns: The number of boards in each row of the window.
+    :type columns: int
+    :param coalesce: See :class:`PiFaceCAD`. Only used by the window.
+    :type coalesce: bool
+    :param max_fps: See :class:`PiFaceCAD`. Only used by the window.
+    :type max_fps: int
+    """
+    def __init__(self, devices=1, headless=None, columns=DEFAULT_COLUMNS,
+                 coalesce=False, max_fps=None):
+        if headless is None:
+            headless = headless_requested()
+        self.headless = headless
+        self.q_to_server = Queue()
+        self.devices = [ServerDevice(device_id, self.q_to_server)
+                        for device_id in range(devices)]
+        self._next_device = 0
+
+        self.process = Process(target=run_server,
+                               args=(sys.argv,
+                                     self.q_to_server,
+                                     [d.server_ends for d in self.devices],
+                                     headless,
+                                     columns,
+                                     coalesce,
+                                     max_fps))
+        self.process.start()
+        for device in self.devices:
+            device.process = self.process
+            # the server has its own copies of the sending ends
+            device.pipe_to_here.close()
+            device.events_to_here.close()
+
+    def get(self, device_id=None):
+        """Returns a board which is ready to use. Without a device id the
+        next board which hasn't been handed out yet is returned, so that
+        ``PiFaceCAD(pool=server)`` works.
+
+        :param device_id: The board to return.
+        :type device_id: int
+        """
+        if device_id is None:
+            if self._next_device >= len(self.devices):
+                raise RuntimeError(
+                    "All {} boards are in use.".format(len(self.devices)))
+            device_id = self._next_device
+            self._next_device += 1
+        device = self.devices[device_id]
+        device.wait_until_ready()
+        return device
+
+    def close(self):
+        """Stops the server and every board it hosts."""
+        self.q_to_server.put((None, encode_action(('quit',))))
+        self.process.join()
+
+
+class HeadlessBoard(object):
+    """A :class:`HeadlessEmulator` answering a board's actions in the
+    emulator server.
+    """
+    def __init__(self, pipe_from_em, events_pipe, shared_state):
+        self.emulator = HeadlessEmulator()
+        self.pipe_from_em = pipe_from_em
+        self.events_pipe = events_pipe
+        self.shared_state = shared_state
+        self.messages_received = 0
+        self.subscribed = {'switch': False, 'ir': False}
+        self.emulator.event_callbacks['switch'].append(self.send_switch_event)
+        self.emulator.event_callbacks['ir'].append(self.send_ir_event)
+
+    def handle(self, action):
+        """Applies an action. An action which fails is logged and, if it
+        is a query, answered with a QueryError, so that one board can't
+        stop the others.
+        """
+        self.messages_received += 1
+        try:
+            self.apply(action)
+        except Exception as e:
+            logger.exception("Board failed to handle %r.", action)
+            if action[0] in REPLY_TASKS:
+                self.pipe_from_em.send(
+                    QueryError("{}: {}".format(type(e).__name__, e)))
+
+    def apply(self, action):
+        task = action[0]
+        if task == 'quit':
+            # only the server can be quit, see EmulatorServer.close
+            pass
+        elif task == 'sync':
+            self.publish()
+            self.pipe_from_em.send(self.messages_received)
+        elif task == 'subscribe_switch_events':
+            self.subscribe('switch', action[1])
+        elif task == 'subscribe_ir_events':
+            self.subscribe('ir', action[1])
+        else:
+            reply = self.emulator.handle(action)
+            if task.startswith('get_'):
+                self.pipe_from_em.send(reply)
+
+    def subscribe(self, event_type, value):
+        self.subscribed[event_type] = value == 1
+        # lets the application know that no more events will be sent
+        self.events_pipe.send(('subscribe', value))
+
+    def send_switch_event(self, switch_num, pressed, timestamp):
+        if self.subscribed['switch']:
+            self.events_pipe.send(('switch', switch_num, pressed, timestamp))
+
+    def send_ir_event(self, ir_code, timestamp):
+        if self.subscribed['ir']:
+            self.events_pipe.send(('ir', ir_code, timestamp))
+
+    def publish(self):
+        if self.shared_state is not None:
+            self.shared_state.publish(
+                self.messages_received, self.emulator.state)
+
+
+def run_server(sysargv, q_to_server, device_ends, headless, columns,
+               coalesce=False, max_fps=None):
+    if headless:
+        run_headless_server(q_to_server, device_ends)
+    else:
+        # only import Qt when the server window is actually needed
+        from .gui import run_emulator_server
+        run_emulator_server(sysargv, q_to_server, device_ends, columns,
+                            coalesce, max_fps)
+
+
+def route_server_actions(q_to_server, device_queues):
+    """Passes each action from the server queue on to its board's queue."""
+    while True:
+        device_id, message = q_to_server.get()
+        action = decode_action(message)
+        if device_id is None:
+            if action[0] == 'quit':
+                device_queues[0].put(('quit',))
+                return
+            continue
+        if action[0] == 'quit':
+            # only the server can be quit, see EmulatorServer.close. The
+            # action is still counted so that the board's getters don't
+            # wait for it.
+            action = ('batch', [])
+        device_queues[device_id].put(action)
+
+
+def run_headless_server(q_to_server, device_ends):
+    boards = [HeadlessBoard(*ends) for ends in device_ends]
+    # boards which have changed since their state was last published
+    changed = set()
+    while True:
+        device_id, message = q_to_server.get()
+        action = decode_action(message)
+        if device_id is None:
+            if action[0] == 'quit':
+                return
+            continue
+        boards[device_id].handle(action)
+        changed.add(device_id)
+        # publish the state once the queue has been drained
+        if q_to_server.empty():
+            for device_id in changed:
+                boards[device_id].publish()
+            changed.clear()
+
+
+def run_headless_emulator(q_to_em, pipe_to_here, events_to_here,
+                          shared_state, socket_path=None):
+    """Answers an :class:`EmulatorProcess`'s actions with a
+    :class:`HeadlessEmulator`, in place of the emulator window, until it is
+    quit.
+    """
+    hub = None
+    if socket_path is not None:
+        hub = TransportHub()
+        hub.add_connection(ParentConnection(
+            hub, q_to_em, pipe_to_here, events_to_here))
+        hub.listen(socket_path)
+        q_to_em, pipe_to_here, events_to_here = hub, hub.replies, hub.events
+    board = HeadlessBoard(pipe_to_here, events_to_here, shared_state)
+    try:
+        while True:
+            action = q_to_em.get()
+            if action[0] == 'quit':
+                return
+            board.handle(action)
+            # publish the state once the queue has been drained
+            if q_to_em.empty():
+                board.publish()
+    finally:
+        if hub is not None:
+            hub.close()
+
+
+def serve(socket_path, headless=None, coalesce=False, max_fps=None):
+    """Runs an emulator which is driven by clients connecting to the Unix
+    domain socket at socket_path, see ``PiFaceCAD(connect=socket_path)``.
+    Returns when the emulator window is closed, a headless emulator runs
+    until it is interrupted.
+
+    :param headless: Run a :class:`HeadlessEmulator` instead of the
+        emulator window. Defaults to the value of the
+        PIFACECAD_EMULATOR_HEADLESS environment variable.
+    :type headless: bool
+    """
+    if headless is None:
+        headless = headless_requested()
+    if not headless:
+        # only import Qt when the emulator window is actually needed
+        from .gui import run_emulator
+        run_emulator(sys.argv, None, None, None, None, None, None,
+                     coalesce, max_fps, socket_path)
+        return
+
+    hub = TransportHub()
+    hub.listen(socket_path)
+    board = HeadlessBoard(hub.replies, hub.events, None)
+    try:
+        while True:
+            board.handle(hub.get())
+    finally:
+        hub.close()
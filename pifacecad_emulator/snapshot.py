@@ -0,0 +1,130 @@
+# Snapshots of the emulated display for tests and monitors. A snapshot is
+# built from an EmulatorState (which the emulator already publishes in
+# shared memory) so taking one doesn't ask the emulator window anything.
+# Snapshots are immutable and hashable, and two of them can be diffed to
+# find exactly which cells and flags changed.
+from collections import namedtuple
+from .lcd import (
+    LCD_LINES,
+    LCD_WIDTH,
+    LCD_RAM_WIDTH,
+    LCD_ROW_WIDTH,
+    get_visible_line,
+)
+
+
+DisplaySnapshot = namedtuple('DisplaySnapshot', [
+    'lines',
+    'ddram',
+    'cgram',
+    'cursor',
+    'viewport_corner',
+    'display_enabled',
+    'cursor_enabled',
+    'blink_enabled',
+    'backlight_enabled',
+])
+
+
+class SnapshotDiff(namedtuple('SnapshotDiff', ['fields', 'cells', 'ddram'])):
+    """The differences between two :class:`DisplaySnapshot`.
+
+    fields is a tuple of the names of the snapshot fields which changed,
+    cells a tuple of (col, row, old character, new character) for each cell
+    of the visible window which changed and ddram a tuple of (address, old
+    code, new code) for each DDRAM cell which changed. A diff is false if
+    nothing changed.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return len(self.fields) > 0
+
+
+NO_DIFF = SnapshotDiff(fields=(), cells=(), ddram=())
+
+
+def get_snapshot(state):
+    """Returns the :class:`DisplaySnapshot` of an :class:`EmulatorState`.
+
+    :param state: The state.
+    :type state: :class:`pifacecad_emulator.state.EmulatorState`
+    """
+    return DisplaySnapshot(
+        lines=tuple(get_visible_line(state.ddram, row, state.viewport_corner)
+                    for row in range(LCD_LINES)),
+        ddram=state.ddram,
+        cgram=state.cgram,
+        cursor=state.cursor,
+        viewport_corner=state.viewport_corner,
+        display_enabled=state.display_enabled,
+        cursor_enabled=state.cursor_enabled,
+        blink_enabled=state.blink_enabled,
+        backlight_enabled=state.backlight_enabled)
+
+
+def diff_snapshots(old, new):
+    """Returns the :class:`SnapshotDiff` from old to new. Rows which are the
+    same in both are skipped without comparing their cells.
+
+    :param old: The earlier snapshot.
+    :type old: :class:`DisplaySnapshot`
+    :param new: The later snapshot.
+    :type new: :class:`DisplaySnapshot`
+    """
+    if old is new or old == new:
+        return NO_DIFF
+    fields = tuple(field for field, old_value, new_value
+                   in zip(DisplaySnapshot._fields, old, new)
+                   if old_value != new_value)
+
+    cells = []
+    if 'lines' in fields:
+        for row, (old_line, new_line) in enumerate(zip(old.lines,
+                                                       new.lines)):
+            if old_line != new_line:
+                cells.extend((col, row, old_line[col], new_line[col])
+                             for col in range(LCD_WIDTH)
+                             if old_line[col] != new_line[col])
+
+    ddram = []
+    if 'ddram' in fields:
+        for row_start in range(0, LCD_RAM_WIDTH, LCD_ROW_WIDTH):
+            row_end = row_start + LCD_ROW_WIDTH
+            old_row = old.ddram[row_start:row_end]
+            new_row = new.ddram[row_start:row_end]
+            if old_row != new_row:
+                ddram.extend((row_start + i, old_code, new_code)
+                             for i, (old_code, new_code)
+                             in enumerate(zip(old_row, new_row))
+                             if old_code != new_code)
+
+    return SnapshotDiff(fields=fields, cells=tuple(cells), ddram=tuple(ddram))
+
+
+def get_visible_cursor(snapshot):
+    """Returns the (col, row) of the cursor in the visible window, or None
+    if it is scrolled out of view.
+    """
+    col, row = snapshot.cursor
+    offset = (col - snapshot.viewport_corner) % LCD_ROW_WIDTH
+    if offset < LCD_WIDTH:
+        return offset, row
+    return None
+
+
+def format_snapshot(snapshot):
+    """Returns the visible window of a snapshot drawn in a box, with the
+    cursor marked under its column if it can be seen, for test failure
+    messages and logs.
+    """
+    border = "+" + "-" * LCD_WIDTH + "+"
+    rows = [border]
+    cursor = get_visible_cursor(snapshot)
+    for row, line in enumerate(snapshot.lines):
+        rows.append("|" + line + "|")
+        if snapshot.cursor_enabled and cursor is not None and \
+                cursor[1] == row:
+            rows.append(" " * (cursor[0] + 1) + "^")
+    rows.append(border)
+    return "\n".join(rows)
@@ -0,0 +1,168 @@
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+from time import monotonic, sleep
+
+
+# Layout of the shared block. The sequence counter is odd while the
+# emulator is writing, readers retry until they see the same even value
+# before and after copying the body (a seqlock), so reads need no locks.
+# The sequence and message counters are 64 bit so they never wrap.
+SEQUENCE = struct.Struct("<Q")
+BODY = struct.Struct("<QQBHBBB80s64s")
+SHARED_STATE_SIZE = SEQUENCE.size + BODY.size
+
+DISPLAY_FLAG = 0x01
+CURSOR_FLAG = 0x02
+BLINK_FLAG = 0x04
+BACKLIGHT_FLAG = 0x08
+
+# reads retry this many times before sleeping between retries, so a reader
+# doesn't take a core from a writer which was descheduled mid-write
+READ_SPINS = 100
+READ_RETRY_SLEEP = 0.0005
+# seconds before a read gives up, the writer has probably died mid-write
+READ_TIMEOUT = 1.0
+
+
+EmulatorState = namedtuple('EmulatorState', [
+    'switches',
+    'cursor',
+    'viewport_corner',
+    'display_enabled',
+    'cursor_enabled',
+    'blink_enabled',
+    'backlight_enabled',
+    'ddram',
+    'cgram',
+])
+
+
+class SharedStateError(Exception):
+    pass
+
+
+class SharedState(object):
+    """The emulator state published in shared memory. The emulator process
+    publishes, the application process reads without blocking on the GUI.
+    """
+    def __init__(self, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=SHARED_STATE_SIZE)
+            self.shm.buf[:SHARED_STATE_SIZE] = bytes(SHARED_STATE_SIZE)
+        else:
+            self.shm = attach_shared_memory(name)
+        self.sequence = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getstate__(self):
+        return self.name
+
+    def __setstate__(self, name):
+        self.shm = attach_shared_memory(name)
+        self.sequence = SEQUENCE.unpack_from(self.shm.buf, 0)[0]
+
+    def publish(self, applied, state, dropped=0):
+        """Writes the state. There must only be one writer.
+
+        :param applied: The number of messages the emulator has applied.
+        :type applied: int
+        :param state: The state to publish.
+        :type state: :class:`EmulatorState`
+        :param dropped: The number of messages dropped by coalescing.
+        :type dropped: int
+        """
+        flags = 0
+        if state.display_enabled:
+            flags |= DISPLAY_FLAG
+        if state.cursor_enabled:
+            flags |= CURSOR_FLAG
+        if state.blink_enabled:
+            flags |= BLINK_FLAG
+        if state.backlight_enabled:
+            flags |= BACKLIGHT_FLAG
+        col, row = state.cursor
+
+        buf = self.shm.buf
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, 0, self.sequence)
+        BODY.pack_into(buf, SEQUENCE.size,
+                       applied,
+                       dropped,
+                       state.switches,
+                       col,
+                       row,
+                       state.viewport_corner,
+                       flags,
+                       state.ddram,
+                       state.cgram)
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, 0, self.sequence)
+
+    def read_body(self, timeout=READ_TIMEOUT):
+        buf = self.shm.buf
+        tries = 0
+        deadline = None
+        while True:
+            before = SEQUENCE.unpack_from(buf, 0)[0]
+            if not before & 1:
+                body = BODY.unpack_from(buf, SEQUENCE.size)
+                if SEQUENCE.unpack_from(buf, 0)[0] == before:
+                    return body
+            tries += 1
+            if tries < READ_SPINS:
+                continue
+            if deadline is None:
+                deadline = monotonic() + timeout
+            elif monotonic() > deadline:
+                raise SharedStateError(
+                    "The emulator state was not published within {} "
+                    "seconds, the emulator may have stopped while writing "
+                    "it.".format(timeout))
+            sleep(READ_RETRY_SLEEP)
+
+    def read_messages_dropped(self):
+        """Returns the number of messages dropped by coalescing."""
+        return self.read_body()[1]
+
+    def read(self):
+        """Returns the number of applied messages and the current
+        :class:`EmulatorState`.
+        """
+        (applied, dropped, switches, col, row, viewport_corner, flags,
+         ddram, cgram) = self.read_body()
+        state = EmulatorState(switches=switches,
+                              cursor=(col, row),
+                              viewport_corner=viewport_corner,
+                              display_enabled=bool(flags & DISPLAY_FLAG),
+                              cursor_enabled=bool(flags & CURSOR_FLAG),
+                              blink_enabled=bool(flags & BLINK_FLAG),
+                              backlight_enabled=bool(flags & BACKLIGHT_FLAG),
+                              ddram=ddram,
+                              cgram=cgram)
+        return applied, state
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            # before Python 3.13 the resource tracker of a process which
+            # attached to the block may have unlinked it already
+            pass
+
+
+def attach_shared_memory(name):
+    try:
+        # don't let the attaching process unlink the block on exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # track was added in Python 3.13
+        return shared_memory.SharedMemory(name=name)
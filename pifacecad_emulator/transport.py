@@ -0,0 +1,535 @@
+# Transports carry (task, data) actions from an application to the emulator
+# and replies and events back. The default transport uses the queue, pipes
+# and shared memory created with the emulator process. The socket transport
+# lets any number of processes (or containers sharing a directory) drive an
+# emulator which is listening on a Unix domain socket.
+import os
+import queue
+import socket
+import struct
+import threading
+from collections import deque
+from .state import EmulatorState
+from .headless import NUM_SWITCHES
+from .protocol import (
+    encode_action,
+    decode_action,
+    ProtocolError,
+    QueryError,
+)
+
+
+# Every frame on a socket is its length followed by a kind byte and a
+# payload. Actions are messages in the emulator's protocol (see protocol.py)
+# and replies and events are one value encoded with a one byte tag, see
+# encode_value.
+FRAME_LENGTH = struct.Struct("<I")
+COUNT = struct.Struct("<I")
+INT = struct.Struct("<q")
+FLOAT = struct.Struct("<d")
+
+ACTION_FRAME = b'a'
+REPLY_FRAME = b'r'
+EVENT_FRAME = b'e'
+# sent in place of a reply to a query which failed, the payload is why
+ERROR_FRAME = b'x'
+
+# largest read from a socket
+SOCKET_BUFFER_SIZE = 65536
+
+# tasks which the emulator answers on the reply channel
+REPLY_TASKS = frozenset((
+    'get_switch',
+    'get_switch_port',
+    'get_cursor',
+    'get_viewport_corner',
+    'get_state',
+    'sync',
+))
+SUBSCRIBE_TASKS = {
+    'subscribe_switch_events': 'switch',
+    'subscribe_ir_events': 'ir',
+}
+
+
+class TransportError(Exception):
+    pass
+
+
+def get_query_error(action):
+    """Returns a :class:`QueryError` if the emulator can't answer a query,
+    or None.
+    """
+    task = action[0]
+    if task == 'get_switch' and not 0 <= action[1] < NUM_SWITCHES:
+        return QueryError("There are only {} switches (you asked for "
+                          "{}).".format(NUM_SWITCHES, action[1]))
+    return None
+
+
+def encode_value(value, out):
+    """Appends value to the bytearray out. None, bools, ints, floats,
+    strings, bytes, tuples and lists are supported.
+    """
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i'
+        out += INT.pack(value)
+    elif isinstance(value, float):
+        out += b'd'
+        out += FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out += b's'
+        out += COUNT.pack(len(data))
+        out += data
+    elif isinstance(value, (bytes, bytearray)):
+        out += b'b'
+        out += COUNT.pack(len(value))
+        out += value
+    elif isinstance(value, (tuple, list)):
+        out += b't' if isinstance(value, tuple) else b'l'
+        out += COUNT.pack(len(value))
+        for item in value:
+            encode_value(item, out)
+    else:
+        raise TransportError(
+            "Can't encode {} values.".format(type(value).__name__))
+
+
+def decode_value(data, offset=0):
+    """Returns the value encoded at offset and the offset after it."""
+    tag = data[offset:offset+1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    elif tag == b'T':
+        return True, offset
+    elif tag == b'F':
+        return False, offset
+    elif tag == b'i':
+        return INT.unpack_from(data, offset)[0], offset + INT.size
+    elif tag == b'd':
+        return FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size
+    elif tag in (b's', b'b'):
+        length = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        value = bytes(data[offset:offset+length])
+        if tag == b's':
+            value = value.decode('utf-8')
+        return value, offset + length
+    elif tag in (b't', b'l'):
+        count = COUNT.unpack_from(data, offset)[0]
+        offset += COUNT.size
+        items = []
+        for i in range(count):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return (tuple(items) if tag == b't' else items), offset
+    raise TransportError("Unknown value tag {!r}.".format(tag))
+
+
+def encode_frame(kind, value):
+    payload = bytearray(kind)
+    if kind == ACTION_FRAME:
+        payload += encode_action(value)
+    else:
+        encode_value(value, payload)
+    return FRAME_LENGTH.pack(len(payload)) + payload
+
+
+class FrameReader(object):
+    """Reads frames from a stream socket."""
+    def __init__(self, sock):
+        self.socket = sock
+        self.buffer = bytearray()
+
+    def read_frame(self):
+        """Returns the next (kind, value) frame. Raises EOFError when the
+        other end closes the socket.
+        """
+        header = self._read(FRAME_LENGTH.size)
+        length = FRAME_LENGTH.unpack(header)[0]
+        payload = self._read(length)
+        kind = bytes(payload[:1])
+        if kind == ACTION_FRAME:
+            value = decode_action(payload[1:])
+        else:
+            value, offset = decode_value(payload, 1)
+        return kind, value
+
+    def _read(self, size):
+        while len(self.buffer) < size:
+            try:
+                data = self.socket.recv(SOCKET_BUFFER_SIZE)
+            except OSError:
+                data = b''
+            if not data:
+                raise EOFError
+            self.buffer += data
+        data = self.buffer[:size]
+        del self.buffer[:size]
+        return data
+
+
+# application side
+class PipeTransport(object):
+    """Talks to an emulator started by this process through its queue,
+    pipes and shared memory.
+
+    :param emulator_process: The emulator.
+    :type emulator_process: :class:`EmulatorProcess`
+    """
+    def __init__(self, emulator_process):
+        self.q_to_em = emulator_process.q_to_em
+        self.pipe_from_em = emulator_process.pipe_from_em
+        self.events = emulator_process.events
+        self.shared_state = emulator_process.shared_state
+        self.messages_sent = emulator_process.messages_sent
+        # other clients can change the emulator without this process
+        # knowing, so the state in shared memory can't be trusted
+        self.always_sync = \
+            getattr(emulator_process, 'socket_path', None) is not None
+        # display commands dropped because the queue was full
+        self._messages_dropped = 0
+
+    def send(self, action):
+        dropped = self.q_to_em.put(action)
+        # dropped display commands never reach the emulator
+        self.messages_sent += 1 - dropped
+        self._messages_dropped += dropped
+
+    def request(self, action):
+        self.send(action)
+        reply = self.pipe_from_em.recv()
+        if isinstance(reply, QueryError):
+            raise reply
+        return reply
+
+    def recv_event(self):
+        return self.events.recv()
+
+    def read_state(self):
+        """Returns the state in shared memory and True if it reflects every
+        message sent so far, without waiting.
+        """
+        applied, state = self.shared_state.read()
+        return state, not self.always_sync and applied >= self.messages_sent
+
+    def get_state(self):
+        state, up_to_date = self.read_state()
+        if not up_to_date:
+            self.request(('sync', 0))
+            state, up_to_date = self.read_state()
+        return state
+
+    @property
+    def messages_dropped(self):
+        return (self.shared_state.read_messages_dropped() +
+                self._messages_dropped)
+
+
+class SocketTransport(object):
+    """Talks to an emulator listening on a Unix domain socket.
+
+    :param socket_path: The emulator's socket.
+    :type socket_path: str
+    """
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.messages_sent = 0
+        self.replies = queue.Queue()
+        self.events = queue.Queue()
+        self._send_lock = threading.Lock()
+        # replies come back in order, so one request is waited on at a time
+        self._request_lock = threading.Lock()
+        self.reader = threading.Thread(target=self.read_frames)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def send(self, action):
+        frame = encode_frame(ACTION_FRAME, action)
+        with self._send_lock:
+            self.socket.sendall(frame)
+        self.messages_sent += 1
+
+    def request(self, action):
+        with self._request_lock:
+            self.send(action)
+            reply = self.replies.get()
+        if isinstance(reply, EOFError):
+            # leave it for anyone else waiting
+            self.replies.put(reply)
+            raise reply
+        elif isinstance(reply, QueryError):
+            raise reply
+        return reply
+
+    def recv_event(self):
+        event = self.events.get()
+        if isinstance(event, EOFError):
+            # leave it for anyone else waiting
+            self.events.put(event)
+            raise event
+        return event
+
+    def get_state(self):
+        return get_state_from_reply(self.request(('get_state', 0)))
+
+    @property
+    def messages_dropped(self):
+        # the emulator doesn't report dropped commands over sockets
+        return 0
+
+    def read_frames(self):
+        reader = FrameReader(self.socket)
+        while True:
+            try:
+                kind, value = reader.read_frame()
+            except EOFError as e:
+                self.replies.put(e)
+                self.events.put(e)
+                return
+            if kind == REPLY_FRAME:
+                self.replies.put(value)
+            elif kind == ERROR_FRAME:
+                self.replies.put(QueryError(value))
+            elif kind == EVENT_FRAME:
+                self.events.put(tuple(value))
+
+    def close(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+
+def get_state_from_reply(reply):
+    """Returns the :class:`EmulatorState` in a reply to 'get_state'."""
+    return EmulatorState(*reply)
+
+
+# emulator side
+class TransportHub(object):
+    """Lets the parent process and any number of socket clients share one
+    emulator. Actions from all of them are read by the emulator from the
+    hub, in the order they arrived, and replies and events are sent back
+    to whoever asked for them.
+
+    The hub is used in place of the emulator's queue (get, get_nowait and
+    empty), with :attr:`replies` in place of its reply pipe and
+    :attr:`events` in place of its events pipe.
+    """
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.replies = ReplyRouter(self)
+        self.events = EventRouter(self)
+        self.connections = []
+        self.listener = None
+        self._lock = threading.Lock()
+        # who to send the next reply to, and the error to send instead if
+        # their query was rejected. Then who to send the next subscription
+        # acknowledgement to.
+        self._reply_to = deque()
+        self._ack_to = deque()
+
+    def get(self, timeout=None):
+        return self.inbox.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self.inbox.get_nowait()
+
+    def empty(self):
+        return self.inbox.empty()
+
+    def add_connection(self, connection):
+        with self._lock:
+            self.connections.append(connection)
+        connection.start()
+
+    def remove_connection(self, connection):
+        # stop sending events the connection subscribed to
+        for task, event_type in SUBSCRIBE_TASKS.items():
+            if connection.subscribed[event_type]:
+                self.put(connection, (task, 0))
+        with self._lock:
+            self.connections.remove(connection)
+
+    def put(self, connection, action):
+        """Queues an action from a connection for the emulator."""
+        task = action[0]
+        with self._lock:
+            if task in REPLY_TASKS:
+                error = get_query_error(action)
+                self._reply_to.append((connection, error))
+                if error is not None:
+                    # the emulator still answers, so that replies to the
+                    # queries behind it go to the right connections
+                    action = ('sync', 0)
+            elif task in SUBSCRIBE_TASKS:
+                event_type = SUBSCRIBE_TASKS[task]
+                connection.subscribed[event_type] = action[1] == 1
+                self._ack_to.append((connection, action[1]))
+                # the emulator sends events while anyone is subscribed
+                subscribed = any(c.subscribed[event_type]
+                                 for c in self.connections)
+                action = (task, 1 if subscribed else 0)
+            elif task == 'quit' and not connection.can_quit:
+                # the action is still counted by the emulator
+                action = ('batch', [])
+            self.inbox.put(action)
+
+    def listen(self, socket_path):
+        """Accepts socket clients on socket_path."""
+        self.listener = SocketListener(self, socket_path)
+        self.listener.start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+
+
+class ReplyRouter(object):
+    """Sends each reply to the connection which sent the query."""
+    def __init__(self, hub):
+        self.hub = hub
+
+    def send(self, value):
+        with self.hub._lock:
+            connection, error = self.hub._reply_to.popleft()
+        connection.send_reply(value if error is None else error)
+
+
+class EventRouter(object):
+    """Sends each event to the connections which have subscribed to it."""
+    def __init__(self, hub):
+        self.hub = hub
+
+    def send(self, message):
+        with self.hub._lock:
+            if message[0] == 'subscribe':
+                connection, value = self.hub._ack_to.popleft()
+                connections = [connection]
+                message = ('subscribe', value)
+            else:
+                connections = [c for c in self.hub.connections
+                               if c.subscribed[message[0]]]
+        for connection in connections:
+            connection.send_event(message)
+
+
+class ParentConnection(object):
+    """The process which started the emulator, talking to it through the
+    emulator's queue and pipes.
+    """
+    can_quit = True
+
+    def __init__(self, hub, q_to_em, pipe_from_em, events_pipe):
+        self.hub = hub
+        self.q_to_em = q_to_em
+        self.pipe_from_em = pipe_from_em
+        self.events_pipe = events_pipe
+        self.subscribed = {'switch': False, 'ir': False}
+
+    def start(self):
+        forwarder = threading.Thread(target=self.forward_actions)
+        forwarder.daemon = True
+        forwarder.start()
+
+    def forward_actions(self):
+        while True:
+            action = self.q_to_em.get()
+            self.hub.put(self, action)
+            if action[0] == 'quit':
+                return
+
+    def send_reply(self, value):
+        self.pipe_from_em.send(value)
+
+    def send_event(self, message):
+        self.events_pipe.send(message)
+
+
+class SocketConnection(object):
+    """A client connected to the emulator's socket."""
+    can_quit = False
+
+    def __init__(self, hub, sock):
+        self.hub = hub
+        self.socket = sock
+        self.subscribed = {'switch': False, 'ir': False}
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        reader = threading.Thread(target=self.read_actions)
+        reader.daemon = True
+        reader.start()
+
+    def read_actions(self):
+        reader = FrameReader(self.socket)
+        while True:
+            try:
+                kind, action = reader.read_frame()
+            except (EOFError, TransportError, ProtocolError):
+                break
+            if kind == ACTION_FRAME:
+                self.hub.put(self, action)
+        self.hub.remove_connection(self)
+        self.socket.close()
+
+    def send_reply(self, value):
+        if isinstance(value, QueryError):
+            self._send(encode_frame(ERROR_FRAME, str(value)))
+        else:
+            self._send(encode_frame(REPLY_FRAME, value))
+
+    def send_event(self, message):
+        self._send(encode_frame(EVENT_FRAME, message))
+
+    def _send(self, frame):
+        with self._send_lock:
+            try:
+                self.socket.sendall(frame)
+            except OSError:
+                # the client has gone, read_actions cleans up
+                pass
+
+
+class SocketListener(object):
+    """Accepts clients on a Unix domain socket."""
+    def __init__(self, hub, socket_path):
+        self.hub = hub
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            # left behind by an emulator which didn't shut down cleanly
+            os.unlink(socket_path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(socket_path)
+        self.socket.listen()
+
+    def start(self):
+        acceptor = threading.Thread(target=self.accept_connections)
+        acceptor.daemon = True
+        acceptor.start()
+
+    def accept_connections(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except OSError:
+                return
+            self.hub.add_connection(SocketConnection(self.hub, sock))
+
+    def close(self):
+        self.socket.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
@@ -1,25 +1,27 @@
-from PySide.QtCore import (QThread, QObject, Slot, Signal)
+from PySide.QtCore import (QThread, QObject, Slot, Signal, Qt)
+import queue
 import threading
 import pifacecad
-from time import sleep
-
-
-class Blinker(QObject):
-    """Blinks the blinker on the emulator."""
-
-    blink_signal = Signal()
-
-    def __init__(self, emu_window, blinker_start):
-        super(Blinker, self).__init__()
-        self.emu_window = emu_window
-        self.blinker_start = blinker_start
-
-    def blink(self):
-        # print("cursor blinker started")
-        self.blinker_start.wait()
-        while True:
-            sleep(1)
-            self.blink_signal.emit()
+from .lcd import get_col_row_from_value
+from .coalesce import is_coalescable, coalesce_actions
+from .protocol import QueryError
+
+
+# the most queued messages that will be coalesced into one update
+COALESCE_MAX_MESSAGES = 1000
+# the most messages passed to the window which it hasn't applied yet.
+# Messages the window can't keep up with are left in the queue, where
+# queue_size limits them and coalescing can see them, instead of piling up
+# in Qt's event queue.
+HANDLER_MAX_IN_FLIGHT = 64
+# how often, in seconds, the message handler checks if it should stop
+HANDLER_POLL_INTERVAL = 0.1
+# how long, in milliseconds, to wait for the message handler to stop
+HANDLER_STOP_TIMEOUT = 1000
+# how long, in seconds, switches on a real board are left to stop bouncing
+# before their state is passed to the window. Every edge in that time is
+# passed on as one update.
+SWITCH_DEBOUNCE_TIME = 0.02
 
 
 class InterfaceMessageHandler(QObject):
@@ -33,19 +35,32 @@ class InterfaceMessageHandler(QObject):
     set_cursor_enable = Signal(int)
     set_blink_enable = Signal(int)
     get_switch = Signal(int)
+    get_switch_port = Signal(int)
     get_cursor = Signal(int)
     get_viewport_corner = Signal(int)
+    get_state = Signal(int)
     move_left = Signal(int)
     move_right = Signal(int)
     home = Signal(int)
     clear = Signal(int)
     see_cursor = Signal(int)
-
-    def __init__(self, app, q_to_em, q_from_em, handler_start):
+    store_custom_bitmap = Signal(object)
+    subscribe_switch_events = Signal(int)
+    subscribe_ir_events = Signal(int)
+    inject_ir = Signal(str)
+    inject_switch = Signal(object)
+    batch = Signal(object)
+    # message counts are objects as they can outgrow a C++ int
+    applied = Signal(object, object)
+    sync = Signal(object, object)
+    handled = Signal()
+
+    def __init__(self, app, q_to_em, pipe_from_em, handler_start,
+                 coalesce=False):
         super(InterfaceMessageHandler, self).__init__()
         self.main_app = app
         self.q_to_em = q_to_em
-        self.q_from_em = q_from_em
+        self.pipe_from_em = pipe_from_em
         self.signals = {
             'set_message': self.set_message,
             'set_cursor': self.set_cursor,
@@ -55,56 +70,171 @@ class InterfaceMessageHandler(QObject):
             'set_cursor_enable': self.set_cursor_enable,
             'set_blink_enable': self.set_blink_enable,
             'get_switch': self.get_switch,
+            'get_switch_port': self.get_switch_port,
             'get_cursor': self.get_cursor,
             'get_viewport_corner': self.get_viewport_corner,
+            'get_state': self.get_state,
             'move_left': self.move_left,
             'move_right': self.move_right,
             'home': self.home,
             'clear': self.clear,
             'see_cursor': self.see_cursor,
+            'store_custom_bitmap': self.store_custom_bitmap,
+            'subscribe_switch_events': self.subscribe_switch_events,
+            'subscribe_ir_events': self.subscribe_ir_events,
+            'inject_ir': self.inject_ir,
+            'inject_switch': self.inject_switch,
+            'batch': self.batch,
             # 'quit': self.quit_main_app,
         }
         self.handler_start = handler_start
+        self.messages_received = 0
+        # when coalescing, display commands which are overwritten by later
+        # commands in the queue are dropped
+        self.coalesce = coalesce
+        self.messages_dropped = 0
+        # one is taken for each message read and given back by the window
+        # once it has applied it. When coalescing the next message is only
+        # read once the window has caught up, so that everything sent in
+        # the meantime is coalesced.
+        self.in_flight = threading.Semaphore(
+            1 if coalesce else HANDLER_MAX_IN_FLIGHT)
+        # set by stop, or once the quit action has been handled
+        self.stopping = threading.Event()
 
     def check_queue(self):
         self.handler_start.wait()
-        while True:
+        while not self.stopping.is_set():
+            if not self.in_flight.acquire(timeout=HANDLER_POLL_INTERVAL):
+                # the window hasn't caught up
+                continue
             # print("trying for action")
-            action = self.q_to_em.get()
+            try:
+                action = self.q_to_em.get(timeout=HANDLER_POLL_INTERVAL)
+            except queue.Empty:
+                self.in_flight.release()
+                continue
             # print("got action", action)
-            task = action[0]
-            if task == 'quit':
-                self.main_app.quit()
-            else:
-                try:
-                    data = action[1]
-                except IndexError:
-                    data = None
-                self.signals[task].emit(data)
+            self.messages_received += 1
+            if self.coalesce and is_coalescable(action):
+                action = self.coalesce_waiting_actions(action)
+            if action is not None:
+                self.handle_action(action)
+                if action[0] == 'quit':
+                    # nothing is read after quit
+                    self.stop()
+                    return
+            # publish the state once the queue has been drained
+            if self.q_to_em.empty():
+                self.applied.emit(
+                    self.messages_received, self.messages_dropped)
+            # queued behind the signals above, so the window gives the
+            # message back once it has applied it
+            self.handled.emit()
+
+    def handle_action(self, action):
+        task = action[0]
+        if task == 'quit':
+            self.main_app.quit()
+        elif task == 'sync':
+            self.sync.emit(self.messages_received, self.messages_dropped)
+        else:
+            try:
+                data = action[1]
+            except IndexError:
+                data = None
+            self.signals[task].emit(data)
+
+    def stop(self):
+        """Makes check_queue return, within HANDLER_POLL_INTERVAL."""
+        self.stopping.set()
+
+    def coalesce_waiting_actions(self, action):
+        """Reads the display commands waiting in the queue after action and
+        emits the ones which are not overwritten as one batch. Returns the
+        first action read which must be handled in order, or None.
+        """
+        actions = [action]
+        next_action = None
+        while len(actions) < COALESCE_MAX_MESSAGES:
+            try:
+                action = self.q_to_em.get_nowait()
+            except queue.Empty:
+                break
+            self.messages_received += 1
+            if not is_coalescable(action):
+                next_action = action
+                break
+            actions.append(action)
+
+        actions, dropped = coalesce_actions(actions)
+        self.messages_dropped += dropped
+        if actions:
+            self.batch.emit(actions)
+        return next_action
+
+    @Slot()
+    def release_in_flight(self):
+        self.in_flight.release()
 
     @Slot(int)
     def send_get_switch_result(self, value):
-        self.q_from_em.put(value)
+        self.pipe_from_em.send(value)
+
+    @Slot(int)
+    def send_get_switch_port_result(self, value):
+        self.pipe_from_em.send(value)
 
     @Slot(int)
     def send_get_cursor_result(self, value):
         col, row = get_col_row_from_value(value)
-        self.q_from_em.put((col, row))
+        self.pipe_from_em.send((col, row))
 
     @Slot(int)
     def send_get_viewport_corner_result(self, value):
-        self.q_from_em.put(value)
+        self.pipe_from_em.send(value)
 
+    @Slot(object)
+    def send_get_state_result(self, value):
+        self.pipe_from_em.send(value)
 
-class SwitchWatcher(QObject):
-    """Watches switches and changes the emulator accordingly."""
+    @Slot(object)
+    def send_sync_result(self, value):
+        self.pipe_from_em.send(value)
 
-    set_switch_enable = Signal(int)
-    set_switch_disable = Signal(int)
+    @Slot(str)
+    def send_error_result(self, message):
+        self.pipe_from_em.send(QueryError(message))
 
-    def __init__(self):
-        super().__init__()
-        self.event_listener = pifacecad.SwitchEventListener()
+
+class SwitchWatcher(QObject):
+    """Keeps a copy of a real board's switch port which only interrupts
+    change, and passes the switches which changed to the emulator once
+    they have stopped bouncing. Switches pressed in other ways (such as
+    with inject_switch) are left alone.
+
+    :param cad: The board.
+    :type cad: :class:`pifacecad.PiFaceCAD`
+    :param debounce_time: See SWITCH_DEBOUNCE_TIME. Every edge is passed
+        on straight away if this is 0.
+    :type debounce_time: float
+    """
+
+    # (switches which changed, switch port)
+    switches_changed = Signal(int, int)
+
+    def __init__(self, cad, debounce_time=SWITCH_DEBOUNCE_TIME):
+        super(SwitchWatcher, self).__init__()
+        self.debounce_time = debounce_time
+        self._lock = threading.Lock()
+        # the port is read once, after that only interrupts change it
+        self.switch_bits = cad.switch_port.value
+        # the port as it was last passed on
+        self.sent_bits = self.switch_bits
+        self._update_timer = None
+        self.edges = 0
+        self.updates = 0
+        self.event_listener = pifacecad.SwitchEventListener(chip=cad)
         for i in range(8):
             self.event_listener.register(
                 i, pifacecad.IODIR_BOTH, self.set_input)
@@ -115,47 +245,52 @@ class SwitchWatcher(QObject):
 
     def stop_checking_inputs(self):
         self.event_listener.deactivate()
+        with self._lock:
+            if self._update_timer is not None:
+                self._update_timer.cancel()
         # print("switch watcher: deactivated")
 
     def set_input(self, event):
         # print("switch watcher: event detected")
-        if event.direction == pifacecad.IODIR_ON:
-            self.set_switch_enable.emit(event.pin_num)
-        else:
-            self.set_switch_disable.emit(event.pin_num)
-
-
-def start_blinker(app, emu_window):
-    # need to spawn a worker thread that watches the proc_comms_q
-    # need to seperate queue function from queue thread
-    # http://stackoverflow.com/questions/4323678/threading-and-signals-problem
-    # -in-pyqt
-    blinker_start = threading.Barrier(2)
-    blinker = Blinker(emu_window, blinker_start)
-    blinker_thread = QThread()
-    blinker.moveToThread(blinker_thread)
-    blinker_thread.started.connect(blinker.blink)
-
-    blinker.blink_signal.connect(emu_window.blink)
-
-    # not sure why this doesn't work by connecting to blinker_thread.quit
-    def about_to_quit():
-        blinker_thread.quit()
-    app.aboutToQuit.connect(about_to_quit)
-
-    blinker_thread.start()
-    blinker_start.wait()
+        with self._lock:
+            if event.direction == pifacecad.IODIR_ON:
+                self.switch_bits |= 1 << event.pin_num
+            else:
+                self.switch_bits &= ~(1 << event.pin_num)
+            self.edges += 1
+            if self._update_timer is not None:
+                # goes out with the update which is already waiting
+                return
+            if self.debounce_time > 0:
+                self._update_timer = threading.Timer(
+                    self.debounce_time, self.send_update)
+                self._update_timer.daemon = True
+                self._update_timer.start()
+                return
+        self.send_update()
+
+    def send_update(self):
+        with self._lock:
+            self._update_timer = None
+            switch_bits = self.switch_bits
+            changed = switch_bits ^ self.sent_bits
+            self.sent_bits = switch_bits
+            self.updates += 1
+        if changed:
+            self.switches_changed.emit(changed, switch_bits)
 
 
 def start_interface_message_handler(
-        app, emu_window, proc_comms_q_to_em, proc_comms_q_from_em):
+        app, emu_window, proc_comms_q_to_em, proc_comms_pipe_from_em,
+        coalesce=False):
     # need to spawn a worker thread that watches the proc_comms_q
     # need to seperate queue function from queue thread
     # http://stackoverflow.com/questions/4323678/threading-and-signals-problem
     # -in-pyqt
     handler_start = threading.Barrier(2)
     intface_msg_hand = InterfaceMessageHandler(
-        app, proc_comms_q_to_em, proc_comms_q_from_em, handler_start)
+        app, proc_comms_q_to_em, proc_comms_pipe_from_em, handler_start,
+        coalesce)
     intface_msg_hand_thread = QThread()
     intface_msg_hand.moveToThread(intface_msg_hand_thread)
     intface_msg_hand_thread.started.connect(intface_msg_hand.check_queue)
@@ -174,45 +309,64 @@ def start_interface_message_handler(
     intface_msg_hand.set_blink_enable.connect(
         emu_window.slot_set_blink_enable)
     intface_msg_hand.get_switch.connect(emu_window.slot_get_switch)
+    intface_msg_hand.get_switch_port.connect(
+        emu_window.slot_get_switch_port)
     intface_msg_hand.get_cursor.connect(emu_window.slot_get_cursor)
     intface_msg_hand.get_viewport_corner.connect(
         emu_window.slot_get_viewport_corner)
+    intface_msg_hand.get_state.connect(emu_window.slot_get_state)
     intface_msg_hand.move_left.connect(emu_window.slot_move_left)
     intface_msg_hand.move_right.connect(emu_window.slot_move_right)
     intface_msg_hand.home.connect(emu_window.slot_home)
     intface_msg_hand.clear.connect(emu_window.slot_clear)
     intface_msg_hand.see_cursor.connect(emu_window.slot_see_cursor)
-
-    emu_window.send_switch.connect(intface_msg_hand.send_get_switch_result)
-    emu_window.send_cursor.connect(intface_msg_hand.send_get_cursor_result)
+    intface_msg_hand.store_custom_bitmap.connect(
+        emu_window.slot_store_custom_bitmap)
+    intface_msg_hand.subscribe_switch_events.connect(
+        emu_window.slot_subscribe_switch_events)
+    intface_msg_hand.subscribe_ir_events.connect(
+        emu_window.slot_subscribe_ir_events)
+    intface_msg_hand.inject_ir.connect(emu_window.slot_inject_ir)
+    intface_msg_hand.inject_switch.connect(emu_window.slot_inject_switch)
+    intface_msg_hand.batch.connect(emu_window.slot_batch)
+    intface_msg_hand.applied.connect(emu_window.slot_applied)
+    intface_msg_hand.sync.connect(emu_window.slot_sync)
+
+    # The handler thread never returns to its event loop so replies have to
+    # be sent directly from the GUI thread.
+    emu_window.send_switch.connect(
+        intface_msg_hand.send_get_switch_result, Qt.DirectConnection)
+    emu_window.send_switch_port.connect(
+        intface_msg_hand.send_get_switch_port_result, Qt.DirectConnection)
+    emu_window.send_cursor.connect(
+        intface_msg_hand.send_get_cursor_result, Qt.DirectConnection)
     emu_window.send_viewport_corner.connect(
-        intface_msg_hand.send_get_viewport_corner_result)
+        intface_msg_hand.send_get_viewport_corner_result,
+        Qt.DirectConnection)
+    emu_window.send_state.connect(
+        intface_msg_hand.send_get_state_result, Qt.DirectConnection)
+    emu_window.send_sync.connect(
+        intface_msg_hand.send_sync_result, Qt.DirectConnection)
+    emu_window.send_error.connect(
+        intface_msg_hand.send_error_result, Qt.DirectConnection)
+    intface_msg_hand.handled.connect(emu_window.slot_handled)
+    emu_window.message_handled.connect(
+        intface_msg_hand.release_in_flight, Qt.DirectConnection)
 
     def about_to_quit():
+        intface_msg_hand.stop()
         intface_msg_hand_thread.quit()
+        intface_msg_hand_thread.wait(HANDLER_STOP_TIMEOUT)
     app.aboutToQuit.connect(about_to_quit)
 
     intface_msg_hand_thread.start()
     handler_start.wait()
 
 
-def start_switch_watcher(app, emu_window):
-    switch_watcher = SwitchWatcher()
-    switch_watcher.set_switch_enable.connect(emu_window.set_switch_enable)
-    switch_watcher.set_switch_disable.connect(emu_window.set_switch_disable)
+def start_switch_watcher(app, emu_window,
+                         debounce_time=SWITCH_DEBOUNCE_TIME):
+    switch_watcher = SwitchWatcher(emu_window.cad, debounce_time)
+    switch_watcher.switches_changed.connect(emu_window.slot_switches_changed)
+    emu_window.set_switches(switch_watcher.switch_bits)
     app.aboutToQuit.connect(switch_watcher.stop_checking_inputs)
     switch_watcher.check_inputs()
-
-
-# have to reimplement because circular dependent imports
-LCD_RAM_WIDTH = 80
-
-
-def get_col_row_from_value(value):
-    row = int(value / LCD_RAM_WIDTH)
-    col = value - (LCD_RAM_WIDTH * row)
-    return col, row
-
-
-def get_value_from_col_row(col, row):
-    return col + (LCD_RAM_WIDTH * row)
@@ -1,9 +1,29 @@
 #!/usr/bin/env python3
+import os
 import sys
+import json
+import queue
+import socket
 import unittest
+import asyncio
+import tempfile
 import threading
+import multiprocessing
 import pifacecad_emulator
+import pifacecad_emulator.aio
+import pifacecad_emulator.coalesce
+import pifacecad_emulator.font
+import pifacecad_emulator.ir
+import pifacecad_emulator.framebuffer
+import pifacecad_emulator.mirror
+import pifacecad_emulator.server
+import pifacecad_emulator.protocol
+import pifacecad_emulator.record
+import pifacecad_emulator.scenario
+import pifacecad_emulator.transport
+import benchmarks
 from time import sleep
+from pifacecad_emulator.lcd import get_value_from_col_row
 
 
 PY3 = sys.version_info.major >= 3
@@ -116,6 +136,814 @@ class TestInterface(unittest.TestCase):
         pifacecad_emulator.deinit()
 
 
+class TestHeadless(unittest.TestCase):
+    def setUp(self):
+        self.cad = pifacecad_emulator.PiFaceCAD(headless=True)
+
+    def test_write(self):
+        self.cad.lcd.write("hello")
+        self.assertEqual(self.cad.emulator.visible_lines[0],
+                         "hello           ")
+        self.assertEqual(self.cad.lcd.get_cursor(), (5, 0))
+
+    def test_context_manager(self):
+        with pifacecad_emulator.PiFaceCAD(headless=True) as cad:
+            cad.lcd.write("hello")
+        self.assertTrue(cad.closed)
+        self.assertEqual(cad.emulator.ddram.cursor, (5, 0))
+
+    def test_new_line(self):
+        self.cad.lcd.write("hello\nworld")
+        self.assertEqual(self.cad.emulator.visible_lines,
+                         ["hello           ", "world           "])
+
+    def test_write_wraps_into_next_row(self):
+        self.cad.lcd.set_cursor(38, 0)
+        self.cad.lcd.write("spam")
+        self.assertEqual(self.cad.lcd.get_cursor(), (2, 1))
+        self.assertEqual(self.cad.emulator.visible_lines[1],
+                         "am              ")
+        self.cad.lcd.set_cursor(39, 1)
+        self.cad.lcd.write("eggs")
+        self.assertEqual(self.cad.lcd.get_cursor(), (3, 0))
+        self.assertEqual(self.cad.emulator.visible_lines[0],
+                         "ggs             ")
+
+    def test_viewport_corner(self):
+        self.cad.lcd.write("onomatopoeia")
+        self.cad.lcd.viewport_corner = 3
+        self.assertEqual(self.cad.lcd.viewport_corner, 3)
+        self.assertTrue(
+            self.cad.emulator.visible_lines[0].startswith("matopoeia"))
+        self.cad.lcd.viewport_corner = -1
+        self.assertTrue(
+            self.cad.emulator.visible_lines[0].startswith(" onomatopoeia"))
+
+    def test_set_and_get_cursor(self):
+        self.cad.lcd.set_cursor(5, 1)
+        self.assertEqual(self.cad.lcd.get_cursor(), (5, 1))
+
+    def test_see_cursor(self):
+        self.cad.lcd.set_cursor(20, 0)
+        self.cad.lcd.see_cursor()
+        self.assertEqual(self.cad.lcd.viewport_corner, 5)
+
+    def test_batch(self):
+        with self.cad.lcd.batch():
+            self.cad.lcd.write("abracadabra")
+            self.cad.lcd.clear()
+            self.cad.lcd.write("spam")
+            self.assertEqual(self.cad.emulator.visible_lines[0].strip(), "")
+        self.assertEqual(self.cad.emulator.visible_lines[0].strip(), "spam")
+
+    def test_custom_bitmap(self):
+        bitmap = pifacecad_emulator.LCDBitmap([0x0e, 0x1b, 0x11, 0x11, 0x11])
+        self.cad.lcd.write_custom_bitmap(2, bitmap)
+        self.assertEqual(self.cad.emulator.visible_lines[0][0], "\x02")
+        self.assertEqual(self.cad.get_state().cgram[16:24],
+                         b"\x0e\x1b\x11\x11\x11\x00\x00\x00")
+        with self.assertRaises(ValueError):
+            self.cad.lcd.store_custom_bitmap(8, bitmap)
+
+    def test_switches(self):
+        self.assertEqual(self.cad.switches[3].value, 0)
+        self.cad.emulator.set_switch(3, True)
+        self.assertEqual(self.cad.switches[3].value, 1)
+
+    def test_switch_event_listener(self):
+        pressed = threading.Event()
+        events = []
+
+        def switch_pressed(event):
+            events.append(event)
+            pressed.set()
+
+        listener = pifacecad_emulator.SwitchEventListener(chip=self.cad)
+        listener.register(2, pifacecad_emulator.IODIR_ON, switch_pressed)
+        listener.activate()
+        self.cad.emulator.set_switch(1, True)
+        self.cad.emulator.set_switch(2, True)
+        self.assertTrue(pressed.wait(1))
+        listener.deactivate()
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].pin_num, 2)
+        self.assertEqual(events[0].direction, pifacecad_emulator.IODIR_ON)
+
+    def test_ir_event_listener(self):
+        ir_codes = []
+        listener = pifacecad_emulator.IREventListener(chip=self.cad)
+        listener.register('KEY_UP', ir_codes.append)
+        listener.activate()
+        self.cad.send_ir_code('KEY_UP')
+        listener.deactivate()
+        self.assertEqual([event.ir_code for event in ir_codes], ['KEY_UP'])
+
+    def test_switch_port(self):
+        self.cad.emulator.set_switch(0, True)
+        self.cad.emulator.set_switch(3, True)
+        self.assertEqual(self.cad.switch_port.value, 0b00001001)
+
+    def test_press_and_release_switch(self):
+        events = []
+        self.cad.add_switch_event_callback(
+            lambda switch_num, pressed, timestamp:
+                events.append((switch_num, pressed)))
+        self.cad.press_switch(5)
+        self.assertEqual(self.cad.switches[5].value, 1)
+        self.cad.release_switch(5)
+        with self.cad.hold_switch(6):
+            self.assertEqual(self.cad.switches[6].value, 1)
+        self.assertEqual(self.cad.switch_port.value, 0)
+        self.assertEqual(events,
+                         [(5, True), (5, False), (6, True), (6, False)])
+        with self.assertRaises(ValueError):
+            self.cad.press_switch(8)
+
+
+class TestAsyncHeadless(unittest.TestCase):
+    def setUp(self):
+        self.cad = pifacecad_emulator.aio.AsyncPiFaceCAD(headless=True)
+
+    def test_write_and_get_cursor(self):
+        async def write():
+            await self.cad.lcd.write("hello")
+            return await self.cad.lcd.get_cursor()
+        self.assertEqual(asyncio.run(write()), (5, 0))
+
+    def test_switch_events(self):
+        async def press():
+            events = self.cad.switch_events()
+            next_event = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0)
+            self.cad.cad.emulator.set_switch(4, True)
+            event = await next_event
+            await events.aclose()
+            return event
+        event = asyncio.run(press())
+        self.assertEqual(event.pin_num, 4)
+        self.assertEqual(event.direction, pifacecad_emulator.IODIR_ON)
+
+
+class TestAsyncEmulator(unittest.TestCase):
+    def setUp(self):
+        self.server = pifacecad_emulator.EmulatorServer(headless=True)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tempdir.name, "cad.sock")
+        self.emulator = multiprocessing.Process(
+            target=pifacecad_emulator.server.serve,
+            args=(self.socket_path, True))
+        self.emulator.start()
+        while not os.path.exists(self.socket_path):
+            sleep(0.01)
+
+    def tearDown(self):
+        self.server.close()
+        self.emulator.terminate()
+        self.emulator.join()
+        self.tempdir.cleanup()
+
+    async def write_and_press(self, cad):
+        async with cad:
+            await cad.lcd.write("hello")
+            events = cad.switch_events()
+            next_event = asyncio.ensure_future(events.__anext__())
+            # wait until the subscription has reached the emulator
+            await cad.get_state()
+            await cad.press_switch(2)
+            event = await asyncio.wait_for(next_event, 5)
+            await events.aclose()
+            return await cad.lcd.get_cursor(), event.pin_num
+
+    def test_pipes(self):
+        cad = pifacecad_emulator.aio.AsyncPiFaceCAD(pool=self.server)
+        self.assertEqual(asyncio.run(self.write_and_press(cad)),
+                         ((5, 0), 2))
+        self.assertTrue(cad.cad.closed)
+
+    async def close_while_waiting(self, cad):
+        reply = asyncio.ensure_future(cad.request(('get_switch', 0)))
+        await asyncio.sleep(0.1)
+        cad.close()
+        await asyncio.wait_for(reply, 5)
+
+    def test_close_fails_waiting_queries(self):
+        cad = pifacecad_emulator.aio.AsyncPiFaceCAD(pool=self.server)
+        # the query is never answered
+        self.server.close()
+        with self.assertRaises(EOFError):
+            asyncio.run(self.close_while_waiting(cad))
+
+    def test_socket(self):
+        cad = pifacecad_emulator.aio.AsyncPiFaceCAD(
+            connect=self.socket_path)
+        self.assertEqual(asyncio.run(self.write_and_press(cad)),
+                         ((5, 0), 2))
+        self.assertTrue(cad.cad.closed)
+
+
+class TestIREventListener(unittest.TestCase):
+    def setUp(self):
+        self.ir_codes = []
+        self.listener = pifacecad_emulator.IREventListener(prog="tests")
+        self.listener.register('one', self.ir_codes.append)
+        self.listener.register('two', self.ir_codes.append)
+        self.listener.activate()
+
+    def test_inject(self):
+        for i in range(1000):
+            self.listener.inject('one')
+            self.listener.inject('three')
+        self.listener.deactivate()
+        self.assertEqual(len(self.ir_codes), 1000)
+
+    def test_replay(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ir') as script:
+            script.write("# offset code\n0.0 one\n\n0.01 two\n")
+            script.flush()
+            self.listener.replay(script.name, realtime=True)
+        self.listener.deactivate()
+        self.assertEqual([event.ir_code for event in self.ir_codes],
+                         ['one', 'two'])
+
+    def test_undecodable_datagram(self):
+        self.listener.deactivate()
+        tempdir = tempfile.TemporaryDirectory()
+        socket_path = os.path.join(tempdir.name, "ir.sock")
+        self.listener = pifacecad_emulator.IREventListener(
+            prog="tests", socket_path=socket_path)
+        self.listener.register('one', self.ir_codes.append)
+        self.listener.activate()
+        ir_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        ir_socket.sendto(b"\xff\xfe", socket_path)
+        ir_socket.close()
+        # the listener is still listening
+        pifacecad_emulator.ir.send_ir_code(socket_path, "one")
+        for i in range(500):
+            if self.ir_codes:
+                break
+            sleep(0.01)
+        self.listener.deactivate()
+        tempdir.cleanup()
+        self.assertEqual([event.ir_code for event in self.ir_codes],
+                         ['one'])
+
+
+class TestScenario(unittest.TestCase):
+    def setUp(self):
+        self.cad = pifacecad_emulator.PiFaceCAD(headless=True)
+        self.events = []
+        self.cad.add_switch_event_callback(
+            lambda switch_num, pressed, timestamp:
+                self.events.append((switch_num, pressed)))
+
+    def tearDown(self):
+        self.cad.close()
+
+    def test_play_switch_script(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.sw') as script:
+            script.write("# offset switch action\n0.0 1 hold 0.02\n\n"
+                         "0.01 2 press\n0.03 2 release\n")
+            script.flush()
+            self.assertEqual(
+                pifacecad_emulator.read_switch_script(script.name),
+                [(0.0, 1, True), (0.01, 2, True), (0.02, 1, False),
+                 (0.03, 2, False)])
+            sent = pifacecad_emulator.play_switch_script(self.cad,
+                                                         script.name)
+        self.assertEqual(sent, 4)
+        self.assertEqual(self.events,
+                         [(1, True), (2, True), (1, False), (2, False)])
+
+    def test_high_rate(self):
+        events = [(i * 0.0001, i % 8, i % 16 < 8) for i in range(5000)]
+        sent = pifacecad_emulator.play_switch_events(self.cad, events)
+        self.assertEqual(sent, 5000)
+        self.assertEqual(len(self.events), 5000)
+
+    def test_bad_line(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.sw') as script:
+            script.write("0.0 1 hold\n")
+            script.flush()
+            with self.assertRaises(ValueError):
+                pifacecad_emulator.read_switch_script(script.name)
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.cad = pifacecad_emulator.PiFaceCAD(headless=True)
+
+    def tearDown(self):
+        self.cad.close()
+
+    def test_snapshot(self):
+        self.cad.lcd.write("hello\nworld")
+        snapshot = self.cad.snapshot()
+        self.assertEqual(snapshot.lines,
+                         ("hello           ", "world           "))
+        self.assertEqual(snapshot.cursor, (5, 1))
+        self.assertEqual(hash(snapshot), hash(self.cad.snapshot()))
+        self.assertEqual(snapshot, self.cad.snapshot())
+        self.assertFalse(pifacecad_emulator.diff_snapshots(
+            snapshot, self.cad.snapshot()))
+
+    def test_diff(self):
+        self.cad.lcd.write("hello")
+        before = self.cad.snapshot()
+        self.cad.lcd.set_cursor(1, 0)
+        self.cad.lcd.write("a")
+        self.cad.lcd.backlight_on()
+        self.cad.lcd.move_right()
+        diff = pifacecad_emulator.diff_snapshots(before, self.cad.snapshot())
+        self.assertEqual(set(diff.fields),
+                         {'lines', 'ddram', 'cursor', 'viewport_corner',
+                          'backlight_enabled'})
+        self.assertEqual(diff.ddram, ((1, ord("e"), ord("a")),))
+        self.assertEqual(diff.cells[:2],
+                         ((0, 0, "h", "a"), (1, 0, "e", "l")))
+
+
+class TestFramebuffer(unittest.TestCase):
+    def setUp(self):
+        self.cad = pifacecad_emulator.PiFaceCAD(headless=True)
+        self.renderer = pifacecad_emulator.FrameRenderer(scale=1)
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cad.close()
+        self.tempdir.cleanup()
+
+    def get_pixel(self, frame, x, y):
+        offset = (y * self.renderer.width + x) * 3
+        return tuple(frame[offset:offset+3])
+
+    def test_render(self):
+        framebuffer = pifacecad_emulator.framebuffer
+        self.cad.lcd.cursor_off()
+        self.cad.lcd.write("|")
+        frame = self.renderer.render(self.cad.snapshot())
+        self.assertEqual(len(frame),
+                         self.renderer.width * self.renderer.height * 3)
+        # the top dot of | is in the middle of the first cell
+        border = framebuffer.BORDER_DOTS
+        lit = framebuffer.get_dot_rgb(self.cad.snapshot().backlight_enabled,
+                                      pifacecad_emulator.font.LIT_DOT_ALPHA)
+        self.assertEqual(self.get_pixel(frame, border + 2, border), lit)
+        self.assertNotEqual(self.get_pixel(frame, border + 1, border), lit)
+        png = self.renderer.render_png(self.cad.snapshot())
+        self.assertTrue(png.startswith(framebuffer.PNG_SIGNATURE))
+
+    def test_exporter(self):
+        path = os.path.join(self.tempdir.name, "lcd.png")
+        exporter = pifacecad_emulator.FrameExporter(
+            self.cad, path, renderer=self.renderer)
+        self.assertTrue(exporter.export())
+        self.assertFalse(exporter.export())
+        self.cad.lcd.write("hello")
+        self.assertTrue(exporter.export())
+        self.assertEqual(exporter.frames_written, 2)
+        self.assertEqual(exporter.frames_skipped, 1)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(),
+                             self.renderer.render_png(self.cad.snapshot()))
+
+    def test_exporter_keeps_going(self):
+        path = os.path.join(self.tempdir.name, "missing", "lcd.png")
+        exporter = pifacecad_emulator.FrameExporter(
+            self.cad, path, interval=0.01, renderer=self.renderer)
+        exporter.start()
+        for i in range(500):
+            if exporter.frames_failed >= 2:
+                break
+            sleep(0.01)
+        exporter.stop()
+        self.assertGreaterEqual(exporter.frames_failed, 2)
+
+
+class TestCoalesce(unittest.TestCase):
+    def test_superseded_frames_are_dropped(self):
+        frame = [('clear', 0), ('set_message', "hello"), ('set_cursor', 0)]
+        actions = [('batch', frame), ('set_display_enable', 0),
+                   ('batch', frame), ('set_display_enable', 1)]
+        coalesced, dropped = pifacecad_emulator.coalesce.coalesce_actions(
+            actions)
+        self.assertEqual(coalesced, frame + [('set_display_enable', 1)])
+        # the first frame and the first set_display_enable
+        self.assertEqual(dropped, 2)
+
+    def test_same_final_state(self):
+        actions = [('set_cursor', 5), ('set_message', "ab"),
+                   ('set_cursor', 45), ('set_cursor', 2),
+                   ('set_viewport_corner', 3), ('move_left', None),
+                   ('set_message', "c"), ('see_cursor', 0)]
+        coalesced, dropped = pifacecad_emulator.coalesce.coalesce_actions(
+            actions)
+        self.assertEqual(dropped, 1)
+        emulator = pifacecad_emulator.headless.HeadlessEmulator()
+        emulator.batch(actions)
+        coalesced_emulator = pifacecad_emulator.headless.HeadlessEmulator()
+        coalesced_emulator.batch(coalesced)
+        self.assertEqual(emulator.state, coalesced_emulator.state)
+
+    def test_custom_bitmaps(self):
+        frames = [('store_custom_bitmap', (0, bytes([i] * 8)))
+                  for i in range(3)]
+        other_bank = ('store_custom_bitmap', (1, bytes(8)))
+        coalesced, dropped = pifacecad_emulator.coalesce.coalesce_actions(
+            frames + [other_bank])
+        self.assertEqual(coalesced, [frames[-1], other_bank])
+        self.assertEqual(dropped, 2)
+
+    def test_empty_batches_are_not_dropped(self):
+        # the hub sends empty batches in place of socket clients' quits
+        coalesced, dropped = pifacecad_emulator.coalesce.coalesce_actions(
+            [('batch', []), ('set_cursor', 1), ('batch', []),
+             ('set_cursor', 2)])
+        self.assertEqual(coalesced, [('set_cursor', 2)])
+        self.assertEqual(dropped, 1)
+
+
+class TestFont(unittest.TestCase):
+    def test_rom_glyphs(self):
+        font = pifacecad_emulator.font
+        self.assertEqual(len(font.ROM_GLYPHS), font.NUM_CHARACTER_CODES)
+        for rows in font.ROM_GLYPHS:
+            self.assertEqual(len(rows), 8)
+            self.assertTrue(all(row <= 0x1f for row in rows))
+            # the bottom row is left for the cursor
+            self.assertEqual(rows[font.CURSOR_ROW], 0)
+        self.assertEqual(font.ROM_GLYPHS[ord("A")],
+                         bytes([0x0e, 0x11, 0x11, 0x11, 0x1f, 0x11, 0x11, 0]))
+        self.assertEqual(font.ROM_GLYPHS[ord(" ")], font.BLANK_GLYPH)
+
+    def test_upper_rom_glyphs(self):
+        font = pifacecad_emulator.font
+        # katakana a, the degree-like semi-voiced mark, alpha, mu, sigma
+        # and the full block
+        for code in (0xb1, 0xdf, 0xe0, 0xe4, 0xf6, 0xff):
+            self.assertNotEqual(font.ROM_GLYPHS[code], font.BLANK_GLYPH)
+        self.assertEqual(font.ROM_GLYPHS[0xdf],
+                         bytes([0x1c, 0x14, 0x1c, 0, 0, 0, 0, 0]))
+        for code in (0x80, 0x9f, 0xa0, 0xfe):
+            self.assertEqual(font.ROM_GLYPHS[code], font.BLANK_GLYPH)
+
+    def test_custom_characters(self):
+        cgram = pifacecad_emulator.lcd.CGRAM()
+        cgram.store(2, bytes([0x1f] * 8))
+        get_glyph = pifacecad_emulator.font.get_glyph
+        # codes 8 to 15 repeat the custom bitmaps
+        self.assertEqual(get_glyph(2, cgram), bytes([0x1f] * 8))
+        self.assertEqual(get_glyph(10, cgram), bytes([0x1f] * 8))
+        self.assertEqual(get_glyph(3, cgram), bytes(8))
+
+
+class SlowLCD(object):
+    """Stands in for a real board's LCD. Writes wait for release."""
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def write(self, text):
+        self.release.wait()
+        self.calls.append(('write', text))
+
+    def set_cursor(self, col, row):
+        self.calls.append(('set_cursor', col, row))
+
+
+class TestHardwareMirror(unittest.TestCase):
+    def setUp(self):
+        self.lcd = SlowLCD()
+        board = type('Board', (object,), {'lcd': self.lcd})
+        self.mirror = pifacecad_emulator.mirror.HardwareMirror(board)
+
+    def test_commands_waiting_for_the_board_are_coalesced(self):
+        self.mirror.put(('set_message', "hello"))
+        # wait for the board to be busy with the write
+        while self.mirror.pending:
+            sleep(0.01)
+        for col in range(10):
+            self.mirror.put(('set_cursor', col))
+        sleep(0.1)
+        self.assertGreater(self.mirror.lag, 0)
+        self.lcd.release.set()
+        self.assertTrue(self.mirror.flush(timeout=5))
+        self.assertEqual(self.lcd.calls,
+                         [('write', "hello"), ('set_cursor', 9, 0)])
+        self.assertEqual(self.mirror.commands_dropped, 9)
+        self.assertEqual(self.mirror.lag, 0)
+
+    def test_pending_commands_are_bounded(self):
+        max_pending = pifacecad_emulator.mirror.MIRROR_MAX_PENDING
+        self.mirror.put(('set_message', "hello"))
+        while self.mirror.pending:
+            sleep(0.01)
+        for col in range(max_pending * 2):
+            self.mirror.put(('set_cursor', col % 16))
+        self.assertLessEqual(len(self.mirror.pending), max_pending)
+        # writes can't be coalesced, so the oldest are lost
+        for i in range(max_pending * 2):
+            self.mirror.put(('set_message', "x"))
+        self.assertLessEqual(len(self.mirror.pending), max_pending)
+        self.assertGreater(self.mirror.commands_lost, 0)
+
+    def test_errors_are_counted(self):
+        self.lcd.release.set()
+        # the test board has no clear
+        self.mirror.put(('clear', 0))
+        self.mirror.put(('set_message', "hello"))
+        self.assertTrue(self.mirror.flush(timeout=5))
+        self.assertEqual(self.mirror.errors, 1)
+        self.assertEqual(self.lcd.calls, [('write', "hello")])
+
+    def tearDown(self):
+        self.lcd.release.set()
+        self.mirror.close()
+
+
+class TestSharedState(unittest.TestCase):
+    def setUp(self):
+        self.shared_state = pifacecad_emulator.state.SharedState()
+
+    def test_publish_and_read(self):
+        emulator = pifacecad_emulator.headless.HeadlessEmulator()
+        emulator.write_message("hello")
+        emulator.set_switch(2, True)
+        self.shared_state.publish(3, emulator.state)
+
+        reader = pifacecad_emulator.state.SharedState(self.shared_state.name)
+        applied, state = reader.read()
+        reader.close()
+        self.assertEqual(applied, 3)
+        self.assertEqual(state, emulator.state)
+
+    def test_counters_past_32_bits(self):
+        emulator = pifacecad_emulator.headless.HeadlessEmulator()
+        self.shared_state.sequence = 2**32 - 2
+        for applied in (2**32 - 1, 2**32, 2**32 + 1):
+            self.shared_state.publish(applied, emulator.state, applied)
+            self.assertEqual(self.shared_state.read()[0], applied)
+            self.assertEqual(self.shared_state.read_messages_dropped(),
+                             applied)
+
+    def test_writer_died_while_writing(self):
+        # the sequence is left odd, as if the writer stopped mid-write
+        pifacecad_emulator.state.SEQUENCE.pack_into(
+            self.shared_state.shm.buf, 0, 1)
+        with self.assertRaises(pifacecad_emulator.state.SharedStateError):
+            self.shared_state.read_body(timeout=0.05)
+
+    def tearDown(self):
+        self.shared_state.unlink()
+
+
+class TestEmulatorPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = pifacecad_emulator.EmulatorPool(size=1, headless=True)
+        self.cads = []
+
+    def test_pool_refills(self):
+        started = self.pool.emulators[0]
+        for i in range(2):
+            self.cads.append(pifacecad_emulator.PiFaceCAD(pool=self.pool))
+            # a replacement is started for each one taken
+            self.assertEqual(len(self.pool.emulators), 1)
+        self.assertIs(self.cads[0].emulator_process, started)
+        self.assertIsNot(self.cads[1].emulator_process, started)
+        for i, cad in enumerate(self.cads):
+            cad.lcd.write("x" * (i + 1))
+        for i, cad in enumerate(self.cads):
+            self.assertEqual(cad.lcd.get_cursor(), (i + 1, 0))
+
+    def tearDown(self):
+        for cad in self.cads:
+            cad.close()
+            self.assertFalse(cad.emulator_process.process.is_alive())
+        self.pool.close()
+
+
+class TestEmulatorServer(unittest.TestCase):
+    def setUp(self):
+        self.server = pifacecad_emulator.EmulatorServer(
+            devices=3, headless=True)
+        self.cads = [pifacecad_emulator.PiFaceCAD(pool=self.server)
+                     for i in range(3)]
+
+    def test_devices_are_separate(self):
+        for i, cad in enumerate(self.cads):
+            cad.lcd.write("x" * (i + 1))
+        for i, cad in enumerate(self.cads):
+            self.assertEqual(cad.lcd.get_cursor(), (i + 1, 0))
+
+    def test_bad_action_only_fails_its_board(self):
+        self.cads[0].put_command(('inject_switch', (9, 1)))
+        with self.assertRaises(pifacecad_emulator.protocol.QueryError):
+            self.cads[0].transport.request(('get_switch', 200))
+        self.cads[1].lcd.write("x")
+        self.assertEqual(self.cads[1].lcd.get_cursor(), (1, 0))
+        self.assertEqual(self.cads[0].lcd.get_cursor(), (0, 0))
+
+    def test_all_devices_in_use(self):
+        with self.assertRaises(RuntimeError):
+            pifacecad_emulator.PiFaceCAD(pool=self.server)
+
+    def tearDown(self):
+        self.server.close()
+
+
+class TestSocketTransport(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tempdir.name, "cad.sock")
+        self.emulator = multiprocessing.Process(
+            target=pifacecad_emulator.server.serve,
+            args=(self.socket_path, True))
+        self.emulator.start()
+        while not os.path.exists(self.socket_path):
+            sleep(0.01)
+
+    def test_encode_and_decode(self):
+        value = ('batch', [('set_message', "héllo"), ('set_cursor', -1)],
+                 None, True, 1.5, b"\x00\xff")
+        encoded = bytearray()
+        pifacecad_emulator.transport.encode_value(value, encoded)
+        decoded, offset = \
+            pifacecad_emulator.transport.decode_value(encoded)
+        self.assertEqual(decoded, value)
+        self.assertEqual(offset, len(encoded))
+
+    def test_clients_share_emulator(self):
+        cad0 = pifacecad_emulator.PiFaceCAD(connect=self.socket_path)
+        cad1 = pifacecad_emulator.PiFaceCAD(connect=self.socket_path)
+        cad0.lcd.write("hello")
+        cad0.lcd.viewport_corner = 2
+        # wait until the emulator has applied cad0's actions
+        cad0.get_state()
+        self.assertEqual(cad1.lcd.get_cursor(), (5, 0))
+        self.assertEqual(cad1.lcd.viewport_corner, 2)
+        self.assertEqual(cad1.get_state().ddram[:5], b"hello")
+        cad0.close()
+        cad1.close()
+
+    def test_bad_query_is_rejected(self):
+        cad0 = pifacecad_emulator.PiFaceCAD(connect=self.socket_path)
+        cad1 = pifacecad_emulator.PiFaceCAD(connect=self.socket_path)
+        cad1.lcd.set_cursor(3, 1)
+        with self.assertRaises(pifacecad_emulator.protocol.QueryError):
+            cad0.transport.request(('get_switch', 200))
+        # replies still go to the connection which asked
+        self.assertEqual(cad1.lcd.get_cursor(), (3, 1))
+        self.assertEqual(cad0.transport.request(('get_switch', 0)), 0)
+        cad0.close()
+        cad1.close()
+
+    def tearDown(self):
+        self.emulator.terminate()
+        self.emulator.join()
+        self.tempdir.cleanup()
+
+
+class TestRecord(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "session")
+
+    def test_record_and_replay(self):
+        with pifacecad_emulator.PiFaceCAD(headless=True,
+                                          record=self.path) as cad:
+            cad.add_switch_event_callback(lambda *args: None)
+            with cad.batch():
+                cad.lcd.write("hello")
+                cad.lcd.set_cursor(3, 1)
+            self.assertEqual(cad.lcd.get_cursor(), (3, 1))
+            cad.emulator.set_switch(2, True)
+        kinds = [kind for timestamp, kind, value in
+                 pifacecad_emulator.record.read_recording(self.path)]
+        self.assertEqual(kinds, [b's', b'a', b'a', b'r', b'e'])
+
+        replayed = pifacecad_emulator.PiFaceCAD(headless=True)
+        self.assertEqual(
+            pifacecad_emulator.record.replay(self.path, replayed), [])
+        # switch events are recorded but not replayed
+        self.assertEqual(replayed.emulator.visible_lines,
+                         cad.emulator.visible_lines)
+        self.assertEqual(replayed.emulator.switch_state[2], False)
+
+    def test_replay_differences(self):
+        with pifacecad_emulator.PiFaceCAD(headless=True,
+                                          record=self.path) as cad:
+            cad.lcd.get_cursor()
+        replayed = pifacecad_emulator.PiFaceCAD(headless=True)
+        replayed.lcd.write("a")
+        mismatches = pifacecad_emulator.record.replay(self.path, replayed)
+        self.assertEqual(len(mismatches), 1)
+        action, recorded, reply = mismatches[0]
+        self.assertEqual(action, ('get_state', 0))
+        self.assertEqual(recorded[1], (0, 0))
+        self.assertEqual(reply.cursor, (1, 0))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+class TestProtocol(unittest.TestCase):
+    def test_encode_and_decode(self):
+        protocol = pifacecad_emulator.protocol
+        actions = [
+            ('set_message', "héllo\nworld"),
+            ('set_cursor', get_value_from_col_row(3, 1)),
+            ('set_blink_enable', 1),
+            ('home', 0),
+            ('get_switch', 7),
+            ('inject_switch', (3, 1)),
+            ('store_custom_bitmap', (3, b"\x1f\x11\x11\x11\x11\x11\x1f\x00")),
+            ('batch', [('clear', 0), ('set_viewport_corner', -2)]),
+            ('quit',),
+        ]
+        for action in actions:
+            message = protocol.encode_action(action)
+            self.assertEqual(protocol.decode_action(message), action)
+
+    def test_set_cursor_message(self):
+        message = pifacecad_emulator.protocol.encode_action(
+            ('set_cursor', get_value_from_col_row(3, 1)))
+        self.assertEqual(message, b"\x01\x02\x2b\x00\x00\x00")
+
+    def test_bad_messages(self):
+        protocol = pifacecad_emulator.protocol
+        set_message = protocol.encode_action(('set_message', "hello"))
+        for message in (b"\x02\x08", b"\x01\xff", b"\x01\x01\x05",
+                        # empty, trailing bytes and a truncated string
+                        b"", protocol.encode_action(('home', 0)) + b"\x00",
+                        set_message[:-1]):
+            with self.assertRaises(protocol.ProtocolError):
+                protocol.decode_action(message)
+
+
+class TestActionQueue(unittest.TestCase):
+    def test_overflow_error(self):
+        q = pifacecad_emulator.protocol.ActionQueue(1, 'error')
+        q.put(('home', 0))
+        with self.assertRaises(queue.Full):
+            q.put(('home', 0))
+
+    def test_overflow_error_with_timeout(self):
+        q = pifacecad_emulator.protocol.ActionQueue(1, 'error')
+        q.put(('home', 0))
+        threading.Timer(0.1, q.get).start()
+        # waits for room, as EmulatorProcess.quit does
+        q.put(('quit',), timeout=5)
+        self.assertEqual(q.get(timeout=5), ('quit',))
+
+    def get_all(self, q):
+        actions = []
+        while True:
+            try:
+                actions.append(q.get(timeout=0.2))
+            except queue.Empty:
+                return actions
+
+    def test_overflow_drop_oldest(self):
+        q = pifacecad_emulator.protocol.ActionQueue(2, 'drop_oldest')
+        q.put(('sync', 0))
+        messages = [chr(ord("a") + i) for i in range(10)]
+        for message in messages:
+            q.put(('set_message', message))
+        actions = self.get_all(q)
+        # only a message being fed and two waiting can be kept
+        self.assertGreaterEqual(q.messages_dropped, 7)
+        self.assertEqual(len(actions) - 1 + q.messages_dropped, 10)
+        self.assertEqual(actions[0], ('sync', 0))
+        kept = [data for task, data in actions[1:]]
+        self.assertEqual(kept, sorted(kept))
+        self.assertEqual(kept[-1], "j")
+
+    def test_overflow_drop_oldest_keeps_order(self):
+        q = pifacecad_emulator.protocol.ActionQueue(2, 'drop_oldest')
+        actions = [('get_switch', i) for i in range(4)]
+        for action in actions:
+            q.put(action)
+        # the oldest waiting message is a query, which can't be dropped
+        with self.assertRaises(queue.Full):
+            q.put(('set_message', "b"), timeout=0.1)
+        self.assertEqual(q.messages_dropped, 0)
+        self.assertEqual(self.get_all(q), actions)
+
+    def test_bad_overflow(self):
+        with self.assertRaises(ValueError):
+            pifacecad_emulator.protocol.ActionQueue(1, 'wait')
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_headless_benchmarks(self):
+        results = benchmarks.run_benchmarks(
+            headless_only=True, repeat=10, writes=10, startups=1)
+        headless = results['backends']['headless']
+        self.assertEqual(headless['write']['batched']['writes'], 10)
+        self.assertEqual(headless['getters']['get_cursor']['calls'], 10)
+        # the results must be JSON serialisable
+        json.dumps(results)
+
+
 def yes_no_question(question):
     answer = input("{} [Y/n] ".format(question))
     correct_answers = ("y", "yes", "Y", "")